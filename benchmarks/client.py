@@ -0,0 +1,145 @@
+"""Outils communs aux benchmarks : serveur local, joueurs simulés, mesures."""
+import asyncio
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+
+import aiohttp
+import socketio
+
+SERVER_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'server')
+
+
+def percentiles(values, points=(50, 95, 99)):
+    """Percentiles en millisecondes d'une liste de durées en secondes."""
+    if not values:
+        return {f'p{point}': None for point in points}
+    ordered = sorted(values)
+    return {f'p{point}': round(ordered[min(len(ordered) - 1, int(len(ordered) * point / 100))] * 1000, 2)
+            for point in points}
+
+
+def rss_mb(pid):
+    """Mémoire résidente d'un processus (Linux), en Mo."""
+    try:
+        with open(f'/proc/{pid}/status') as status:
+            for line in status:
+                if line.startswith('VmRSS:'):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    return None
+
+
+class Server:
+    """Serveur de jeu lancé dans un processus séparé, sur une base et un journal vides."""
+
+    def __init__(self, port=5100, async_mode='threading', env=None):
+        self.port = port
+        self.url = f'http://127.0.0.1:{port}'
+        self.async_mode = async_mode
+        self.env = env or {}
+        self.process = None
+        self.directory = tempfile.TemporaryDirectory(prefix='chess-bench-')
+
+    def __enter__(self):
+        env = dict(os.environ, PORT=str(self.port), ASYNC_MODE=self.async_mode, CHESS_DEBUG='0',
+                   DATABASE_URL=f'sqlite:///{self.directory.name}/bench.db',
+                   CHESS_MOVELOG_DIR=os.path.join(self.directory.name, 'movelogs'),
+                   CHESS_IDLE_DIR=os.path.join(self.directory.name, 'idle_games'),
+                   CHESS_POSITION_INDEX_DIR=os.path.join(self.directory.name, 'position_index'), **self.env)
+        # Session à part : l'arrêt vise tout le groupe, processus des pools compris
+        self.process = subprocess.Popen([sys.executable, 'app.py'], cwd=SERVER_DIR, env=env,
+                                        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                                        start_new_session=True)
+        return self
+
+    async def wait_ready(self, timeout=30):
+        deadline = time.time() + timeout
+        async with aiohttp.ClientSession() as session:
+            while time.time() < deadline:
+                if self.process.poll() is not None:
+                    raise RuntimeError('Le serveur s\'est arrêté au démarrage')
+                try:
+                    async with session.get(self.url + '/api/user/status') as response:
+                        if response.status == 200:
+                            return
+                except aiohttp.ClientError:
+                    pass
+                await asyncio.sleep(0.2)
+        raise TimeoutError('Serveur injoignable')
+
+    @property
+    def rss_mb(self):
+        return rss_mb(self.process.pid)
+
+    def _signal(self, signum):
+        try:
+            os.killpg(self.process.pid, signum)
+        except ProcessLookupError:
+            pass
+
+    def __exit__(self, *exc):
+        self._signal(signal.SIGTERM)
+        try:
+            self.process.wait(10)
+        except subprocess.TimeoutExpired:
+            pass
+        # Processus restants du groupe (serveur bloqué, pools non arrêtés)
+        self._signal(signal.SIGKILL)
+        self.process.wait()
+        self.directory.cleanup()
+
+
+class Player:
+    """Joueur simulé : session HTTP authentifiée et connexions Socket.IO."""
+
+    def __init__(self, server_url, username):
+        self.server_url = server_url
+        self.username = username
+        self.http = aiohttp.ClientSession(cookie_jar=aiohttp.CookieJar(unsafe=True))
+        self.sio = None
+        self.lobby = None
+
+    async def request(self, method, path, **kwargs):
+        async with self.http.request(method, self.server_url + path, **kwargs) as response:
+            return response.status, await response.json(content_type=None)
+
+    async def register_and_login(self, password='benchmark'):
+        await self.request('POST', '/register', json={
+            'username': self.username, 'email': f'{self.username}@bench.local', 'password': password})
+        status, body = await self.request('POST', '/login', json={'username': self.username, 'password': password})
+        if status != 200:
+            raise RuntimeError(f'Connexion refusée pour {self.username} : {body}')
+
+    def _cookie_header(self):
+        cookies = self.http.cookie_jar.filter_cookies(self.server_url)
+        return {'Cookie': '; '.join(f'{name}={morsel.value}' for name, morsel in cookies.items())}
+
+    async def connect(self, handlers=None, namespace='/'):
+        """Ouvre une connexion WebSocket (espace de noms '/' ou '/lobby')."""
+        client = socketio.AsyncClient(reconnection=False)
+        for event, handler in (handlers or {}).items():
+            client.on(event, handler, namespace=namespace)
+        await client.connect(self.server_url, headers=self._cookie_header(), transports=['websocket'],
+                             namespaces=[namespace])
+        if namespace == '/':
+            self.sio = client
+        else:
+            self.lobby = client
+        return client
+
+    async def call(self, event, data, timeout=30):
+        """Émet un événement et renvoie (réponse, durée de l'ack en secondes)."""
+        started = time.perf_counter()
+        response = await self.sio.call(event, data, timeout=timeout)
+        return response, time.perf_counter() - started
+
+    async def close(self):
+        for client in (self.sio, self.lobby):
+            if client is not None and client.connected:
+                await client.disconnect()
+        await self.http.close()
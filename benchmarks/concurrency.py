@@ -0,0 +1,128 @@
+"""Combien de joueurs connectés un processus tient-il à latence de coup acceptable ?
+
+Lance le serveur dans le mode demandé, puis connecte les joueurs par paliers
+(parties en cours, deux joueurs par partie). À chaque palier, chaque partie
+joue des coups aléatoires légaux à cadence fixe pendant une fenêtre de mesure ;
+le script rapporte la latence de l'ack de make_move et la mémoire du serveur,
+et s'arrête au premier palier dont le p99 dépasse le budget.
+
+    python benchmarks/concurrency.py --mode eventlet --steps 100,500,1000,2000
+
+Une ligne JSON par palier sur la sortie standard (et dans --output).
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+
+import chess
+
+from client import Player, Server, percentiles
+
+
+class BenchGame:
+    def __init__(self, white, black, game_uuid):
+        self.white = white
+        self.black = black
+        self.game_uuid = game_uuid
+        self.board = chess.Board()
+
+    async def play(self, until, interval, latencies, errors):
+        # Départ décalé pour étaler les coups des parties sur l'intervalle
+        await asyncio.sleep(random.random() * interval)
+        while time.time() < until and not self.board.is_game_over():
+            player = self.white if self.board.turn == chess.WHITE else self.black
+            move = random.choice(list(self.board.legal_moves))
+            try:
+                response, elapsed = await player.call('make_move', {'game_uuid': self.game_uuid, 'move': move.uci()})
+            except Exception:
+                errors.append('timeout')
+                return
+            if response and response.get('status') == 'success':
+                latencies.append(elapsed)
+                self.board.push(move)
+            else:
+                errors.append(response.get('message') if response else 'vide')
+            await asyncio.sleep(interval)
+
+
+async def open_game(server, index, semaphore):
+    async with semaphore:
+        white = Player(server.url, f'bench_w{index}')
+        black = Player(server.url, f'bench_b{index}')
+        await white.register_and_login()
+        await black.register_and_login()
+        _, created = await white.request('POST', '/api/games/create', json={'game_type': 'casual'})
+        await black.request('POST', f"/api/games/join/{created['game_id']}")
+        for player in (white, black):
+            await player.connect()
+            response, _ = await player.call('join_game', {'game_uuid': created['game_uuid']})
+            if response.get('status') != 'success':
+                raise RuntimeError(response)
+        return BenchGame(white, black, created['game_uuid'])
+
+
+async def run(args):
+    results = []
+    games = []
+    with Server(port=args.port, async_mode=args.mode) as server:
+        await server.wait_ready()
+        semaphore = asyncio.Semaphore(args.setup_concurrency)
+        for step in args.steps:
+            target = step // 2
+            started = time.time()
+            opened = await asyncio.gather(*(open_game(server, index, semaphore)
+                                            for index in range(len(games), target)), return_exceptions=True)
+            failures = [game for game in opened if isinstance(game, Exception)]
+            games.extend(game for game in opened if not isinstance(game, Exception))
+            setup_seconds = time.time() - started
+
+            latencies, errors = [], []
+            until = time.time() + args.window
+            await asyncio.gather(*(game.play(until, args.move_interval, latencies, errors) for game in games))
+
+            result = {
+                'benchmark': 'concurrency',
+                'mode': args.mode,
+                'connected_players': 2 * len(games),
+                'connect_failures': len(failures),
+                'setup_seconds': round(setup_seconds, 2),
+                'moves': len(latencies),
+                'moves_per_second': round(len(latencies) / args.window, 1),
+                'move_errors': len(errors),
+                'make_move_ack_ms': percentiles(latencies),
+                'server_rss_mb': server.rss_mb,
+            }
+            results.append(result)
+            print(json.dumps(result), flush=True)
+
+            p99 = result['make_move_ack_ms']['p99']
+            if failures or p99 is None or p99 > args.budget_ms:
+                break
+
+        await asyncio.gather(*(player.close() for game in games for player in (game.white, game.black)))
+
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(results, output, indent=2)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--mode', default='eventlet', choices=['threading', 'eventlet', 'gevent'])
+    parser.add_argument('--steps', default='50,100,250,500,1000',
+                        type=lambda value: [int(step) for step in value.split(',')],
+                        help='nombre de joueurs connectés à chaque palier')
+    parser.add_argument('--window', type=float, default=10, help='durée de mesure par palier (s)')
+    parser.add_argument('--move-interval', type=float, default=1.0, help='pause entre deux coups d\'une partie (s)')
+    parser.add_argument('--budget-ms', type=float, default=100, help='p99 acceptable pour l\'ack de make_move')
+    parser.add_argument('--setup-concurrency', type=int, default=20)
+    parser.add_argument('--port', type=int, default=5100)
+    parser.add_argument('--output', help='fichier JSON des résultats')
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == '__main__':
+    main()
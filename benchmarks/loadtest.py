@@ -0,0 +1,244 @@
+"""Test de charge de bout en bout avec des joueurs simulés.
+
+Inscrit et connecte N joueurs (/register, /login), les place dans les files
+de matchmaking casual et ranked, puis chaque paire trouvée joue des coups
+aléatoires légaux (python-chess) par Socket.IO jusqu'à la fin de la partie ou
+abandon après --max-plies demi-coups ; les joueurs se remettent ensuite en file
+jusqu'à la fin de --duration.
+
+Mesures : temps de matchmaking (entrée en file -> match_found sur /lobby),
+latence de l'ack de make_move, latence de diffusion du coup à l'adversaire
+(émission -> réception du game_move), débit de coups et de parties, mémoire
+du serveur. Le résumé est écrit en JSON (--output) pour comparer les exécutions.
+
+    python benchmarks/loadtest.py --players 200 --duration 60 --output run.json
+"""
+import argparse
+import asyncio
+import json
+import platform
+import random
+import time
+from collections import defaultdict
+
+import chess
+
+from client import Player, Server, percentiles, rss_mb
+
+
+class Metrics:
+    def __init__(self):
+        self.samples = defaultdict(list)
+        self.counters = defaultdict(int)
+        self.errors = defaultdict(int)
+        self.rss = []
+
+    def add(self, name, seconds):
+        self.samples[name].append(seconds)
+
+    def count(self, name, value=1):
+        self.counters[name] += value
+
+    def error(self, kind):
+        self.errors[kind] += 1
+
+
+class LoadPlayer(Player):
+    """Joueur qui enchaîne file d'attente et parties, et horodate ce qu'il reçoit."""
+
+    def __init__(self, server_url, username, game_type):
+        super().__init__(server_url, username)
+        self.game_type = game_type
+        self.match = None
+        self.moves_seen = {}
+
+    async def start(self):
+        await self.register_and_login()
+        await self.connect({'match_found': self._on_match_found}, namespace='/lobby')
+        await self.connect({'game_move': self._on_game_move})
+
+    async def _on_match_found(self, data):
+        if self.match and not self.match.done():
+            self.match.set_result(data)
+
+    async def _on_game_move(self, data):
+        waiter = self.moves_seen.get(data['seq'])
+        if waiter and not waiter.done():
+            waiter.set_result(time.perf_counter())
+
+    def expect_move(self, seq):
+        self.moves_seen = {seq: asyncio.get_running_loop().create_future()}
+        return self.moves_seen[seq]
+
+    async def find_match(self, metrics):
+        self.match = asyncio.get_running_loop().create_future()
+        started = time.perf_counter()
+        status, body = await self.request('POST', '/api/games/matchmaking', json={'game_type': self.game_type})
+        if status != 200:
+            metrics.error('matchmaking_refused')
+            return None
+        notification = await self.match
+        metrics.add(f'matchmaking_{self.game_type}', time.perf_counter() - started)
+        return notification
+
+
+class Pairing:
+    """Réunit les deux joueurs d'une partie : les blancs la mènent, les noirs attendent sa fin."""
+
+    def __init__(self):
+        self.games = {}
+
+    def _entry(self, game_uuid):
+        loop = asyncio.get_running_loop()
+        return self.games.setdefault(game_uuid, (loop.create_future(), loop.create_future()))
+
+    def arrive(self, game_uuid, black):
+        opponent, done = self._entry(game_uuid)
+        opponent.set_result(black)
+        return done
+
+    async def opponent(self, game_uuid, timeout=30):
+        return await asyncio.wait_for(self._entry(game_uuid)[0], timeout)
+
+    def finish(self, game_uuid):
+        _, done = self.games.pop(game_uuid)
+        done.set_result(None)
+
+
+async def play_game(game_uuid, white, black, args, metrics):
+    for player in (white, black):
+        response, _ = await player.call('join_game', {'game_uuid': game_uuid})
+        if response.get('status') != 'success':
+            metrics.error('join_game')
+            return
+    board = chess.Board()
+    while not board.is_game_over():
+        mover, opponent = (white, black) if board.turn == chess.WHITE else (black, white)
+        if board.ply() >= args.max_plies:
+            await mover.sio.emit('resign_game', {'game_uuid': game_uuid})
+            break
+        move = random.choice(list(board.legal_moves))
+        received = opponent.expect_move(board.ply() + 1)
+        sent = time.perf_counter()
+        try:
+            response, elapsed = await mover.call('make_move', {'game_uuid': game_uuid, 'move': move.uci()})
+        except Exception:
+            metrics.error('make_move_timeout')
+            return
+        if response.get('status') != 'success':
+            metrics.error('make_move_rejected')
+            return
+        metrics.add('make_move_ack', elapsed)
+        board.push(move)
+        metrics.count('moves')
+        try:
+            metrics.add('move_fanout', await asyncio.wait_for(received, timeout=10) - sent)
+        except asyncio.TimeoutError:
+            metrics.error('fanout_timeout')
+        await asyncio.sleep(args.think_time * random.random())
+    metrics.count('games')
+
+
+async def player_loop(player, pairing, until, args, metrics):
+    while time.time() < until:
+        notification = await player.find_match(metrics)
+        if notification is None:
+            return
+        game_uuid = notification['game_uuid']
+        if notification['color'] == 'black':
+            await pairing.arrive(game_uuid, player)
+            continue
+        try:
+            black = await pairing.opponent(game_uuid)
+            await play_game(game_uuid, player, black, args, metrics)
+        except asyncio.TimeoutError:
+            metrics.error('opponent_missing')
+        finally:
+            pairing.finish(game_uuid)
+
+
+async def sample_rss(server, metrics, until):
+    while time.time() < until:
+        value = server.rss_mb
+        if value is not None:
+            metrics.rss.append(value)
+        await asyncio.sleep(1)
+
+
+async def run(args):
+    metrics = Metrics()
+    with Server(port=args.port, async_mode=args.mode) as server:
+        await server.wait_ready()
+        players = [LoadPlayer(server.url, f'load_{index}',
+                              'ranked' if index < args.players * args.ranked_share else 'casual')
+                   for index in range(args.players)]
+        semaphore = asyncio.Semaphore(args.setup_concurrency)
+
+        async def start(player):
+            async with semaphore:
+                await player.start()
+
+        started = time.time()
+        await asyncio.gather(*(start(player) for player in players))
+        setup_seconds = time.time() - started
+
+        pairing = Pairing()
+        started = time.time()
+        until = started + args.duration
+        sampler = asyncio.create_task(sample_rss(server, metrics, until + 5))
+        tasks = [asyncio.create_task(player_loop(player, pairing, until, args, metrics)) for player in players]
+        # Laisser les parties en cours se terminer, sans attendre indéfiniment
+        done, pending = await asyncio.wait(tasks, timeout=args.duration + args.drain)
+        for task in pending:
+            task.cancel()
+        elapsed = time.time() - started
+        sampler.cancel()
+        await asyncio.gather(*(player.close() for player in players), return_exceptions=True)
+
+    summary = {
+        'benchmark': 'loadtest',
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'host': platform.node(),
+        'python': platform.python_version(),
+        'config': {key: value for key, value in vars(args).items() if key != 'output'},
+        'setup_seconds': round(setup_seconds, 2),
+        'elapsed_seconds': round(elapsed, 2),
+        'latency_ms': {name: dict(percentiles(values), count=len(values))
+                       for name, values in sorted(metrics.samples.items())},
+        'throughput': {
+            'moves_per_second': round(metrics.counters['moves'] / elapsed, 2),
+            'games_per_second': round(metrics.counters['games'] / elapsed, 3),
+            'moves': metrics.counters['moves'],
+            'games': metrics.counters['games'],
+        },
+        'errors': dict(metrics.errors),
+        'server_rss_mb': {
+            'max': max(metrics.rss, default=None),
+            'last': metrics.rss[-1] if metrics.rss else None,
+        },
+        'client_rss_mb': rss_mb('self'),
+    }
+    print(json.dumps(summary, indent=2))
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(summary, output, indent=2)
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--players', type=int, default=100)
+    parser.add_argument('--ranked-share', type=float, default=0.5, help='part des joueurs en file ranked')
+    parser.add_argument('--duration', type=float, default=60, help='durée de la charge (s)')
+    parser.add_argument('--drain', type=float, default=30, help='délai laissé aux parties en cours (s)')
+    parser.add_argument('--max-plies', type=int, default=60, help='abandon après ce nombre de demi-coups')
+    parser.add_argument('--think-time', type=float, default=0.5, help='pause maximale entre deux coups (s)')
+    parser.add_argument('--mode', default='threading', choices=['threading', 'eventlet', 'gevent'])
+    parser.add_argument('--setup-concurrency', type=int, default=20)
+    parser.add_argument('--port', type=int, default=5100)
+    parser.add_argument('--output', help='fichier JSON du résumé')
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,374 @@
+import atexit
+import io
+import json
+import os
+import queue
+import threading
+import time
+from collections import OrderedDict
+
+import chess
+import chess.engine
+import chess.pgn
+from sqlalchemy import update
+
+from concurrency import process_pool
+from logs import get_logger
+from metrics import registry
+from positions import push_move, zobrist_key
+
+log = get_logger('analysis')
+
+# Processus d'analyse (priorité minimale : ils ne prennent que le CPU laissé libre
+# par les workers Socket.IO), profondeur de la recherche intégrée, et moteur UCI
+# local facultatif (chemin du binaire) avec son temps de réflexion par position
+ANALYSIS_WORKERS = int(os.environ.get('ANALYSIS_WORKERS', max((os.cpu_count() or 1) - 1, 1)))
+ANALYSIS_NICE = int(os.environ.get('ANALYSIS_NICE', 19))
+ANALYSIS_DEPTH = int(os.environ.get('ANALYSIS_DEPTH', 2))
+UCI_ENGINE = os.environ.get('UCI_ENGINE')
+UCI_MOVETIME = float(os.environ.get('UCI_MOVETIME', 0.1))
+# Évaluations gardées en cache (environ 150 octets chacune)
+ANALYSIS_CACHE_SIZE = int(os.environ.get('ANALYSIS_CACHE_SIZE', 200000))
+
+# Perte (centipions, du point de vue du joueur) à partir de laquelle un coup est signalé
+MISTAKE = 100
+BLUNDER = 300
+# Mat en n coups : MATE - n ; les pertes sont calculées sur des évaluations bornées
+MATE = 100000
+EVAL_CLAMP = 1500
+
+PIECE_VALUES = {chess.PAWN: 100, chess.KNIGHT: 320, chess.BISHOP: 330, chess.ROOK: 500, chess.QUEEN: 900,
+                chess.KING: 0}
+
+# Tables pièce-case (du point de vue des Blancs, a8 en premier)
+PIECE_SQUARES = {
+    chess.PAWN: (
+        0, 0, 0, 0, 0, 0, 0, 0,
+        50, 50, 50, 50, 50, 50, 50, 50,
+        10, 10, 20, 30, 30, 20, 10, 10,
+        5, 5, 10, 25, 25, 10, 5, 5,
+        0, 0, 0, 20, 20, 0, 0, 0,
+        5, -5, -10, 0, 0, -10, -5, 5,
+        5, 10, 10, -20, -20, 10, 10, 5,
+        0, 0, 0, 0, 0, 0, 0, 0),
+    chess.KNIGHT: (
+        -50, -40, -30, -30, -30, -30, -40, -50,
+        -40, -20, 0, 0, 0, 0, -20, -40,
+        -30, 0, 10, 15, 15, 10, 0, -30,
+        -30, 5, 15, 20, 20, 15, 5, -30,
+        -30, 0, 15, 20, 20, 15, 0, -30,
+        -30, 5, 10, 15, 15, 10, 5, -30,
+        -40, -20, 0, 5, 5, 0, -20, -40,
+        -50, -40, -30, -30, -30, -30, -40, -50),
+    chess.BISHOP: (
+        -20, -10, -10, -10, -10, -10, -10, -20,
+        -10, 0, 0, 0, 0, 0, 0, -10,
+        -10, 0, 5, 10, 10, 5, 0, -10,
+        -10, 5, 5, 10, 10, 5, 5, -10,
+        -10, 0, 10, 10, 10, 10, 0, -10,
+        -10, 10, 10, 10, 10, 10, 10, -10,
+        -10, 5, 0, 0, 0, 0, 5, -10,
+        -20, -10, -10, -10, -10, -10, -10, -20),
+    chess.KING: (
+        -30, -40, -40, -50, -50, -40, -40, -30,
+        -30, -40, -40, -50, -50, -40, -40, -30,
+        -30, -40, -40, -50, -50, -40, -40, -30,
+        -30, -40, -40, -50, -50, -40, -40, -30,
+        -20, -30, -30, -40, -40, -30, -30, -20,
+        -10, -20, -20, -20, -20, -20, -20, -10,
+        20, 20, 0, 0, 0, 0, 20, 20,
+        20, 30, 10, 0, 0, 10, 30, 20),
+}
+
+
+def evaluate(board):
+    """Évaluation statique (matériel et tables pièce-case), du point de vue du trait."""
+    score = 0
+    for square, piece in board.piece_map().items():
+        table = PIECE_SQUARES.get(piece.piece_type)
+        index = square ^ 56 if piece.color == chess.WHITE else square
+        value = PIECE_VALUES[piece.piece_type] + (table[index] if table else 0)
+        score += value if piece.color == chess.WHITE else -value
+    return score if board.turn == chess.WHITE else -score
+
+
+def _ordered(board, moves):
+    # Prises d'abord, la plus forte victime par le plus faible attaquant (MVV-LVA)
+    def weight(move):
+        victim = board.piece_type_at(move.to_square) or (chess.PAWN if board.is_en_passant(move) else None)
+        if victim is None:
+            return 0 if move.promotion is None else -PIECE_VALUES[move.promotion]
+        return -10 * PIECE_VALUES[victim] + PIECE_VALUES[board.piece_type_at(move.from_square)]
+    return sorted(moves, key=weight)
+
+
+def _quiescence(board, alpha, beta):
+    stand_pat = evaluate(board)
+    if stand_pat >= beta:
+        return beta
+    alpha = max(alpha, stand_pat)
+    for move in _ordered(board, board.generate_legal_captures()):
+        board.push(move)
+        score = -_quiescence(board, -beta, -alpha)
+        board.pop()
+        if score >= beta:
+            return beta
+        alpha = max(alpha, score)
+    return alpha
+
+
+def _negamax(board, depth, alpha, beta, ply):
+    moves = list(board.legal_moves)
+    if not moves:
+        return (-(MATE - ply) if board.is_check() else 0), None
+    if board.is_insufficient_material():
+        return 0, None
+    if depth == 0:
+        return _quiescence(board, alpha, beta), None
+    best_move = None
+    for move in _ordered(board, moves):
+        board.push(move)
+        score = -_negamax(board, depth - 1, -beta, -alpha, ply + 1)[0]
+        board.pop()
+        if score > alpha or best_move is None:
+            alpha, best_move = max(alpha, score), move
+        if alpha >= beta:
+            break
+    return alpha, best_move
+
+
+def search(board, depth=ANALYSIS_DEPTH):
+    """Recherche alpha-bêta à profondeur fixe, avec recherche des prises au-delà."""
+    return _negamax(board, depth, -MATE - 1, MATE + 1, 0)
+
+
+_engine = None
+
+
+def analyse_position(fen):
+    """Évaluation (centipions, du point de vue des Blancs) et meilleur coup UCI d'une
+    position ; exécuté dans un processus du pool."""
+    global _engine
+    board = chess.Board(fen)
+    if board.is_game_over():
+        outcome = board.outcome()
+        score = 0 if outcome.winner is None else MATE if outcome.winner == chess.WHITE else -MATE
+        return score, None
+    if UCI_ENGINE:
+        if _engine is None:
+            _engine = chess.engine.SimpleEngine.popen_uci(UCI_ENGINE)
+        info = _engine.analyse(board, chess.engine.Limit(time=UCI_MOVETIME))
+        best = info['pv'][0].uci() if info.get('pv') else None
+        return info['score'].white().score(mate_score=MATE), best
+    score, move = search(board)
+    if board.turn == chess.BLACK:
+        score = -score
+    return score, move.uci() if move else None
+
+
+def _lower_priority(niceness):
+    os.nice(niceness)
+
+
+class EvaluationCache:
+    """Cache LRU des évaluations par clé Zobrist : une ouverture jouée dans mille
+    parties n'est analysée qu'une fois."""
+
+    def __init__(self, maxsize=ANALYSIS_CACHE_SIZE):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key, entry):
+        with self.lock:
+            self.entries[key] = entry
+            if len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def stats(self):
+        return {'hit': self.hits, 'miss': self.misses}
+
+
+def annotate(board, moves, evaluations):
+    """Coups annotés à partir des évaluations (Blancs) des positions successives :
+    évaluation après le coup, meilleur coup, perte du joueur et signalement."""
+    clamp = lambda score: max(-EVAL_CLAMP, min(EVAL_CLAMP, score))
+    annotated = []
+    losses = {'white': [], 'black': []}
+    for ply, move in enumerate(moves):
+        (before, best), (after, _) = evaluations[ply], evaluations[ply + 1]
+        mover = 'white' if board.turn == chess.WHITE else 'black'
+        sign = 1 if mover == 'white' else -1
+        loss = max(sign * (clamp(before) - clamp(after)), 0) if best != move.uci() else 0
+        losses[mover].append(loss)
+        entry = {
+            'ply': ply + 1,
+            'san': board.san(move),
+            'uci': move.uci(),
+            'eval': after,
+            'best': board.san(chess.Move.from_uci(best)) if best else None,
+            'loss': loss,
+            'flag': 'blunder' if loss >= BLUNDER else 'mistake' if loss >= MISTAKE else None,
+        }
+        board.push(move)
+        annotated.append(entry)
+    summary = {color: {
+        'average_loss': round(sum(values) / len(values)) if values else 0,
+        'mistakes': sum(MISTAKE <= loss < BLUNDER for loss in values),
+        'blunders': sum(loss >= BLUNDER for loss in values),
+    } for color, values in losses.items()}
+    return {'initial_eval': evaluations[0][0], 'moves': annotated, 'summary': summary,
+            'engine': os.path.basename(UCI_ENGINE) if UCI_ENGINE else f'builtin-d{ANALYSIS_DEPTH}'}
+
+
+class AnalysisQueue:
+    """Analyse des parties terminées, en tâche de fond.
+
+    Les positions d'une partie absentes du cache sont évaluées en parallèle par
+    un pool de processus à priorité minimale, créé à la première analyse
+    (comme celui des mots de passe) ; le thread d'analyse ne fait qu'attendre
+    leurs résultats, puis enregistre l'analyse avec la partie.
+    """
+
+    def __init__(self, workers=ANALYSIS_WORKERS):
+        self.workers = workers
+        self.jobs = queue.Queue()
+        self.queued = set()
+        self.cache = EvaluationCache()
+        self.positions = 0
+        self.pool = None
+        self.app = None
+        self._started = False
+        self.stopped = False
+
+    def init_app(self, app, db, game_model):
+        self.app = app
+        self.db = db
+        self.game_model = game_model
+
+    def _pool(self):
+        if self.pool is None and self.workers > 0:
+            self.pool = process_pool(self.workers, initializer=_lower_priority, initargs=(ANALYSIS_NICE,))
+            atexit.register(self.shutdown)
+        return self.pool
+
+    def shutdown(self):
+        self.stopped = True
+        pool, self.pool = self.pool, None
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
+
+    def submit(self, game_uuid):
+        self.queued.add(game_uuid)
+        self.jobs.put(game_uuid)
+
+    def status(self, game_uuid):
+        return 'pending' if game_uuid in self.queued else None
+
+    def evaluate(self, board, moves):
+        """Évaluations (Blancs) de chaque position de la partie, depuis le cache ou le pool."""
+        keys, known, fens = [], {}, {}
+        key = zobrist_key(board)
+        for move in [None] + moves:
+            if move is not None:
+                key = push_move(board, move, key)
+            keys.append(key)
+            if key in known or key in fens:
+                continue
+            cached = self.cache.get(key)
+            if cached is not None:
+                known[key] = cached
+            else:
+                fens[key] = board.fen()
+        if fens:
+            chunksize = max(len(fens) // (4 * max(self.workers, 1)), 1)
+            pool = self._pool()
+            results = (pool.map(analyse_position, fens.values(), chunksize=chunksize) if pool
+                       else map(analyse_position, fens.values()))
+            for key, result in zip(fens, results):
+                known[key] = result
+                self.cache.put(key, result)
+            self.positions += len(fens)
+        return [known[key] for key in keys]
+
+    def analyse(self, game_uuid):
+        Game = self.game_model
+        with self.app.app_context():
+            row = self.db.session.execute(
+                self.db.select(Game.pgn).where(Game.game_uuid == game_uuid)
+            ).first()
+            self.db.session.remove()
+        if row is None or row.pgn is None:
+            return None
+        game = chess.pgn.read_game(io.StringIO(row.pgn))
+        moves = list(game.mainline_moves())
+        if not moves:
+            return None
+        evaluations = self.evaluate(game.board(), moves)
+        analysis = annotate(game.board(), moves, evaluations)
+        with self.app.app_context():
+            try:
+                # updated_at inchangé : l'index des positions parcourt les parties archivées
+                # par updated_at et compterait la partie une seconde fois
+                self.db.session.execute(
+                    update(Game).where(Game.game_uuid == game_uuid)
+                    .values(analysis=json.dumps(analysis, separators=(',', ':')), updated_at=Game.updated_at)
+                )
+                self.db.session.commit()
+            except Exception:
+                self.db.session.rollback()
+                raise
+        return analysis
+
+    def _run(self, sleep):
+        while True:
+            game_uuid = self.jobs.get()
+            if self.stopped:
+                return
+            started = time.monotonic()
+            try:
+                analysis = self.analyse(game_uuid)
+                if analysis is not None:
+                    log.info('Analyse terminée', game_uuid=game_uuid, moves=len(analysis['moves']),
+                             seconds=round(time.monotonic() - started, 2))
+            except Exception:
+                if self.stopped:
+                    # Pool arrêté en pleine analyse : le serveur s'arrête
+                    return
+                log.exception('Analyse', game_uuid=game_uuid)
+            finally:
+                self.queued.discard(game_uuid)
+                self.jobs.task_done()
+
+    def start(self, socketio=None):
+        if self.app is None or self._started:
+            return
+        self._started = True
+        if socketio is not None:
+            socketio.start_background_task(self._run, socketio.sleep)
+        else:
+            threading.Thread(target=self._run, args=(time.sleep,), daemon=True).start()
+
+
+analysis_queue = AnalysisQueue()
+
+registry.gauge('chess_analysis_queue', 'Parties en attente d\'analyse', callback=lambda: len(analysis_queue.queued))
+registry.counter('chess_analysis_positions', 'Positions évaluées par le pool depuis le démarrage',
+                 callback=lambda: analysis_queue.positions)
+registry.counter('chess_analysis_cache_lookups', 'Consultations du cache des évaluations depuis le démarrage',
+                 labels=('result',), callback=analysis_queue.cache.stats)
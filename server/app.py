@@ -1,88 +1,224 @@
-from flask import Flask, request, jsonify, render_template, redirect, url_for
-from flask_sqlalchemy import SQLAlchemy
-from flask_login import LoginManager, UserMixin, login_user, login_required, logout_user, current_user
-from werkzeug.security import generate_password_hash, check_password_hash
+from concurrency import ASYNC_MODE  # en premier : patch eventlet/gevent
+from flask import Flask, request, jsonify, render_template, redirect, url_for, Response, stream_with_context
+from flask_login import LoginManager, login_user, login_required, logout_user, current_user
 from flask_socketio import SocketIO, join_room, leave_room
 import os
-from datetime import datetime, UTC
+import signal
+import sys
+from datetime import datetime, timedelta, UTC
 from collections import defaultdict
+import heapq
+import itertools
 import threading
 import time
 import uuid
-from chessgame import init_socketio, create_game, active_games, get_game
+import chess
+from sqlalchemy import tuple_, update
+from chessgame import (init_socketio, create_game, active_games, get_game, restore_game, flag_scheduler,
+                       game_lock, adopt_game, release_game, owned_games, idle_evictor, reap_finished_games,
+                       create_games, game_exists)
+from matchmaking import Matchmaker, SharedMatchmaker
+from finalization import finalizer
+from reaper import reaper, FINISHED_GRACE, WAITING_TIMEOUT, QUEUE_TIMEOUT, ABANDONED_TIMEOUT
+from stats import stats_writer
+import ratings
+from database import db, init_db, User, Game, Tournament, TournamentPlayer
+from lobby import LobbySnapshot, PAGE_SIZE, MAX_PAGE_SIZE, encode_cursor, decode_cursor
+from movelog import move_log
+from spectators import spectator_fanout, spectator_room, shard_of
+from archive import build_pgn, iter_archived_pgn, gzip_stream, parse_date
+from state import state, SharedDict, socketio_options
+from sharding import GameRouter, GAME_NOT_FOUND
+from logs import configure as configure_logging, get_logger
+from metrics import registry, connected_sockets
+from hashing import password_hasher, HasherBusy
+from usercache import user_cache
+from posindex import position_index
+from analysis import analysis_queue
+from tournaments import TournamentDirector, SWISS_ROUNDS, ARENA_MINUTES
+
+configure_logging()
+log = get_logger('app')
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'votre_cle_secrete_ici'
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///chess.db'
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 
-db = SQLAlchemy(app)
+init_db(app)
 login_manager = LoginManager()
 login_manager.init_app(app)
 login_manager.login_view = 'login'
 
-socketio = SocketIO(app)
+# Avec un backend d'état partagé, les emits passent par une file de messages
+# pour atteindre les clients connectés aux autres workers
+socketio = SocketIO(app, async_mode=ASYNC_MODE, **socketio_options(backend=state))
 init_socketio(socketio)
 
-# File d'attente pour le matchmaking
-matchmaking_queue = defaultdict(list)
-queue_lock = threading.Lock()
-
-# Dictionnaire pour stocker les notifications de match
-match_notifications = defaultdict(dict)
-
-user_sockets = {}
-
-
-class User(UserMixin, db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    username = db.Column(db.String(80), unique=True, nullable=False)
-    email = db.Column(db.String(120), unique=True, nullable=False)
-    password_hash = db.Column(db.String(128))
-    games_played = db.Column(db.Integer, default=0)
-    wins = db.Column(db.Integer, default=0)
-    losses = db.Column(db.Integer, default=0)
-    draws = db.Column(db.Integer, default=0)
-    elo_rating = db.Column(db.Integer, default=1000)
-
-    def set_password(self, password):
-        self.password_hash = generate_password_hash(password)
-
-    def check_password(self, password):
-        return check_password_hash(self.password_hash, password)
-
-class Game(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    game_uuid = db.Column(db.String(36), unique=True, default=lambda: str(uuid.uuid4()))
-    white_player_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
-    black_player_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=True)
-    game_type = db.Column(db.String(20), nullable=False, default='casual')
-    status = db.Column(db.String(20), nullable=False, default='waiting')
-    name = db.Column(db.String(100), nullable=False, default='Partie d\'échecs')
-    description = db.Column(db.String(500), nullable=True)
-    created_at = db.Column(db.DateTime, nullable=False, default=lambda: datetime.now(UTC))
-    updated_at = db.Column(db.DateTime, nullable=False, default=lambda: datetime.now(UTC), onupdate=lambda: datetime.now(UTC))
-    
-    white_player = db.relationship('User', foreign_keys=[white_player_id], backref='white_games')
-    black_player = db.relationship('User', foreign_keys=[black_player_id], backref='black_games')
-    
-    def to_dict(self):
-        return {
-            'id': self.id,
-            'game_uuid': self.game_uuid,
-            'white_player': self.white_player.username if self.white_player else None,
-            'black_player': self.black_player.username if self.black_player else None,
-            'game_type': self.game_type,
-            'status': self.status,
-            'name': self.name,
-            'description': self.description,
-            'created_at': self.created_at.isoformat() if self.created_at else None,
-            'updated_at': self.updated_at.isoformat() if self.updated_at else None
-        }
+if state.shared:
+    match_notifications = SharedDict(state, 'match_notifications', int)
+    user_sockets = SharedDict(state, 'user_sockets', int)
+    lobby_sockets = SharedDict(state, 'lobby_sockets', int)
+    lobby_users = SharedDict(state, 'lobby_users')
+else:
+    # Notifications de match en attente pour les joueurs hors ligne du lobby
+    match_notifications = defaultdict(dict)
+
+    user_sockets = {}
+
+    # Sockets du namespace /lobby : user_id -> sid (et l'inverse pour la déconnexion)
+    lobby_sockets = {}
+    lobby_users = {}
+lobby_lock = threading.Lock()
+
+# Parties regardées par chaque socket spectateur de ce worker : sid -> {game_uuid}
+spectating = {}
+FEATURED_LIMIT = 10
+
+LOBBY_NAMESPACE = '/lobby'
+
+NOT_A_PLAYER = {'status': 'error', 'message': 'Accès non autorisé'}
+NO_DRAW_OFFER = {'status': 'error', 'message': "Pas d'offre de nulle de l'adversaire"}
+
+
+def restore_owned_games():
+    """Recharge depuis le journal des coups les parties en cours dont ce worker est propriétaire."""
+    with app.app_context():
+        for game in Game.query.filter(Game.status.in_(['active', 'in_progress'])):
+            if router.owns(game.game_uuid):
+                restore_game(game.game_uuid, game.white_player_id, game.black_player_id)
+
+
+# Chaque partie vit dans un seul worker ; les événements reçus ailleurs lui sont relayés
+router = GameRouter(state, get_game=get_game, adopt=adopt_game, release=release_game,
+                    owned_games=owned_games, on_members_lost=restore_owned_games,
+                    lock=game_lock)
+
 
 @login_manager.user_loader
 def load_user(user_id):
-    return db.session.get(User, int(user_id))
+    return user_cache.load(db.session, User, int(user_id))
+
+def notify_match(user_id, notification):
+    """Pousse le match au socket lobby du joueur, sinon le garde pour sa reconnexion."""
+    with lobby_lock:
+        sid = lobby_sockets.get(user_id)
+        if sid is None:
+            match_notifications[user_id] = notification
+            return
+    socketio.emit('match_found', notification, to=sid, namespace=LOBBY_NAMESPACE)
+
+@finalizer.register
+def record_game_result(result):
+    """Étape de finalisation : statut de la partie, puis statistiques des joueurs
+    confiées à l'écriture différée (une seule fois, même en cas de nouvel essai)."""
+    winner = result['winner']
+    white_id, black_id = result['white_player_id'], result['black_player_id']
+    winner_id = {'white': white_id, 'black': black_id}.get(winner)
+
+    with app.app_context():
+        try:
+            db_game = Game.query.filter_by(game_uuid=result['game_uuid']).first()
+            if db_game:
+                if db_game.status == 'finished':
+                    return
+                db_game.status = 'finished'
+                db_game.winner_id = winner_id
+                db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+
+    for player_id in (white_id, black_id):
+        if winner == 'draw':
+            stats_writer.add(player_id, 'draw')
+        else:
+            stats_writer.add(player_id, 'win' if player_id == winner_id else 'loss')
+
+@finalizer.register
+def update_ratings(result):
+    """Étape de finalisation : mise à jour ELO incrémentale des parties classées (une
+    seule fois par partie : le drapeau rated est posé dans la même transaction)."""
+    with app.app_context():
+        try:
+            db_game = Game.query.filter_by(game_uuid=result['game_uuid']).first()
+            if db_game is None or db_game.game_type != 'ranked':
+                return
+            white = db.session.get(User, result['white_player_id'])
+            black = db.session.get(User, result['black_player_id'])
+            if white is None or black is None:
+                return
+            rated = db.session.execute(
+                update(Game)
+                .where(Game.id == db_game.id, Game.rated.is_(False))
+                .values(rated=True, updated_at=Game.updated_at)
+            ).rowcount
+            if rated != 1:
+                db.session.rollback()
+                return
+            score = {'white': 1, 'black': 0, 'draw': 0.5}[result['winner']]
+            white.elo_rating, black.elo_rating = ratings.elo_update(white.elo_rating, black.elo_rating, score)
+            db.session.commit()
+            user_cache.invalidate(white.id, black.id)
+        except Exception:
+            db.session.rollback()
+            raise
+
+@finalizer.register
+def archive_game(result):
+    """Étape de finalisation : PGN de la partie enregistré en base, puis journal des coups supprimé."""
+    with app.app_context():
+        try:
+            db_game = Game.query.filter_by(game_uuid=result['game_uuid']).first()
+            if db_game is None or db_game.pgn is not None:
+                return
+            white = db.session.get(User, result['white_player_id'])
+            black = db.session.get(User, result['black_player_id'])
+            db_game.pgn = build_pgn(db_game, white.username if white else '?', black.username if black else '?',
+                                    move_log.entries(result['game_uuid']), result)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+    move_log.discard(result['game_uuid'])
+
+@finalizer.register
+def queue_analysis(result):
+    """Étape de finalisation : partie archivée confiée à la file d'analyse."""
+    analysis_queue.submit(result['game_uuid'])
+
+@finalizer.register
+def record_tournament_result(result):
+    """Étape de finalisation : points du tournoi (une seule fois par partie)."""
+    with app.app_context():
+        try:
+            tournament_director.record_result(result)
+        except Exception:
+            db.session.rollback()
+            raise
+
+@finalizer.register
+def advance_tournament(result):
+    """Étape de finalisation : ronde suivante d'un suisse dont c'était la dernière partie.
+    Étape à part : un échec de la ronde suivante ne rejoue pas le décompte des points."""
+    with app.app_context():
+        try:
+            tournament = tournament_director.tournament_of(result['game_uuid'])
+            if tournament is not None and tournament.format == 'swiss':
+                tournament_director.advance(tournament)
+        except Exception:
+            db.session.rollback()
+            raise
+
+@app.cli.command('index-positions')
+def index_positions_command():
+    """Ajoute à l'index des positions les parties archivées depuis la dernière mise à jour."""
+    count = position_index.update()
+    print(f"{count} parties indexées")
+
+@app.cli.command('recompute-ratings')
+def recompute_ratings_command():
+    """Recalcule tous les classements ELO depuis l'historique des parties classées."""
+    count = ratings.rebuild(db.session, User, Game)
+    print(f"{count} parties classées prises en compte")
 
 @app.route('/')
 def landing():
@@ -108,10 +244,11 @@ def create_game_api():
         description = data.get('description', '')
         
         # Vérifier si l'utilisateur a déjà une partie en cours
-        active_game = Game.query.filter(
-            ((Game.white_player_id == current_user.id) | (Game.black_player_id == current_user.id)) &
-            (Game.status.in_(['waiting', 'active']))
-        ).first()
+        # Deux recherches indexées, une par couleur, plutôt qu'un OR
+        active_game = (
+            Game.query.filter(Game.white_player_id == current_user.id, Game.status.in_(['waiting', 'active'])).first()
+            or Game.query.filter(Game.black_player_id == current_user.id, Game.status.in_(['waiting', 'active'])).first()
+        )
         
         if active_game:
             return jsonify({
@@ -129,17 +266,10 @@ def create_game_api():
         )
         db.session.add(game)
         db.session.commit()
+        lobby.invalidate()
         
-        # Notifier le créateur de la partie
-        match_notifications[current_user.id] = {
-            'match_found': True,
-            'game_uuid': game.game_uuid,
-            'opponent': None,
-            'color': 'white',
-            'name': game.name,
-            'description': game.description
-        }
-        
+        # Pas de notification ici : le créateur a la réponse, et les deux joueurs
+        # sont prévenus par notify_match quand un adversaire rejoint la partie
         return jsonify({
             'success': True,
             'game_id': game.id,
@@ -152,18 +282,43 @@ def create_game_api():
         db.session.rollback()
         return jsonify({'error': str(e)}), 500
 
+def load_waiting_games():
+    """Parties en attente et pseudo du créateur, en une seule requête jointe."""
+    rows = db.session.execute(
+        db.select(Game.id, Game.name, Game.description, Game.game_type, Game.created_at, User.username)
+        .join(User, Game.white_player_id == User.id)
+        .where(Game.status == 'waiting')
+        .order_by(Game.created_at, Game.id)
+    ).all()
+    return [{
+        'id': row.id,
+        'name': row.name,
+        'description': row.description,
+        'white_player': row.username,
+        'game_type': row.game_type,
+        'created_at': row.created_at.isoformat()
+    } for row in rows]
+
+
+lobby = LobbySnapshot(loader=load_waiting_games, backend=state if state.shared else None)
+
 @app.route('/api/games/waiting')
 @login_required
 def get_waiting_games():
-    games = Game.query.filter_by(status='waiting').all()
-    return jsonify([{
-        'id': game.id,
-        'name': game.name,
-        'description': game.description,
-        'white_player': game.white_player.username,
-        'game_type': game.game_type,
-        'created_at': game.created_at.isoformat()
-    } for game in games])
+    try:
+        games, next_cursor, version = lobby.page(
+            game_type=request.args.get('game_type') or None,
+            cursor=request.args.get('cursor'),
+            limit=request.args.get('limit', PAGE_SIZE, type=int)
+        )
+    except ValueError:
+        return jsonify({'error': 'Curseur invalide'}), 400
+
+    response = jsonify({'games': games, 'next_cursor': next_cursor})
+    # L'ETag dépend de la version du lobby et des paramètres de la page
+    response.set_etag(f"{version}-{request.query_string.decode()}")
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response.make_conditional(request)
 
 @app.route('/api/games/join/<int:game_id>', methods=['POST'])
 @login_required
@@ -179,24 +334,27 @@ def join_game(game_id):
     game.black_player_id = current_user.id
     game.status = 'active'
     db.session.commit()
+    lobby.invalidate()
     
     # Notifier les deux joueurs
-    match_notifications[game.white_player_id] = {
+    notify_match(game.white_player_id, {
         'match_found': True,
+        'game_id': game.id,
         'game_uuid': game.game_uuid,
         'opponent': current_user.username,
         'color': 'white',
         'name': game.name,
         'description': game.description
-    }
-    match_notifications[game.black_player_id] = {
+    })
+    notify_match(game.black_player_id, {
         'match_found': True,
+        'game_id': game.id,
         'game_uuid': game.game_uuid,
         'opponent': game.white_player.username,
         'color': 'black',
         'name': game.name,
         'description': game.description
-    }
+    })
     
     return jsonify({
         'success': True,
@@ -207,136 +365,107 @@ def join_game(game_id):
         'description': game.description
     })
 
+def create_match_game(game_type, player1, player2):
+    """Crée la partie d'une paire trouvée par le matchmaker et notifie les joueurs."""
+    with app.app_context():
+        game = Game(
+            game_uuid=str(uuid.uuid4()),
+            white_player_id=player1['id'],
+            black_player_id=player2['id'],
+            game_type=game_type,
+            status='in_progress',
+            name=player1['name'],
+            description=player1['description']
+        )
+        db.session.add(game)
+        db.session.commit()
+
+        notify_match(player1['id'], {
+            'game_id': game.id,
+            'game_uuid': game.game_uuid,
+            'opponent': player2['username'],
+            'color': 'white',
+            'match_found': True,
+            'name': game.name,
+            'description': game.description
+        })
+        notify_match(player2['id'], {
+            'game_id': game.id,
+            'game_uuid': game.game_uuid,
+            'opponent': player1['username'],
+            'color': 'black',
+            'match_found': True,
+            'name': game.name,
+            'description': game.description
+        })
+
+
+def push_queue_status(user_id, status):
+    sid = lobby_sockets.get(user_id)
+    if sid:
+        socketio.emit('queue_status', status, to=sid, namespace=LOBBY_NAMESPACE)
+
+
+def start_tournament_games(tournament, games):
+    """Ronde de tournoi créée en base : parties de ce worker créées en mémoire d'un bloc
+    (les autres le seront par leur worker à l'arrivée des joueurs), puis joueurs prévenus."""
+    create_games([(game['game_uuid'], game['white_player_id'], game['black_player_id'])
+                  for game in games if router.owns(game['game_uuid'])])
+    for game in games:
+        for color, opponent in (('white', 'black'), ('black', 'white')):
+            notify_match(game[color + '_player_id'], {
+                'game_id': game['game_id'],
+                'game_uuid': game['game_uuid'],
+                'opponent': game[opponent],
+                'color': color,
+                'match_found': True,
+                'name': game['name'],
+                'description': game['description'],
+                'tournament_id': tournament.id
+            })
+
+tournament_director = TournamentDirector(on_round=start_tournament_games)
+
+if state.shared:
+    matchmaker = SharedMatchmaker(state, on_match=create_match_game, on_queue_status=push_queue_status)
+else:
+    matchmaker = Matchmaker(on_match=create_match_game, on_queue_status=push_queue_status)
+
+@app.route('/api/games/cancel/<int:game_id>', methods=['POST'])
+@login_required
+def cancel_game(game_id):
+    game = Game.query.get_or_404(game_id)
+
+    if game.white_player_id != current_user.id or game.status != 'waiting':
+        return jsonify({'error': 'Impossible d\'annuler cette partie'}), 400
+
+    game.status = 'cancelled'
+    db.session.commit()
+    lobby.invalidate()
+
+    return jsonify({'message': 'Partie annulée'}), 200
+
 @app.route('/api/games/matchmaking', methods=['POST'])
 @login_required
 def matchmaking():
     data = request.get_json()
     game_type = data.get('game_type', 'casual')
-    
-    with queue_lock:
-        # Vérifier si l'utilisateur est déjà dans la file d'attente
-        if current_user.id in [user['id'] for user in matchmaking_queue[game_type]]:
-            return jsonify({'error': 'Vous êtes déjà dans la file d\'attente'}), 400
-        
-        # Ajouter l'utilisateur à la file d'attente
-        matchmaking_queue[game_type].append({
-            'id': current_user.id,
-            'username': current_user.username,
-            'elo': current_user.elo_rating,
-            'timestamp': datetime.now(UTC),
-            'name': data.get('name', 'Partie d\'échecs'),
-            'description': data.get('description', '')
-        })
-        
-        # Vérifier s'il y a un match possible
-        if len(matchmaking_queue[game_type]) >= 2:
-            if game_type == 'ranked':
-                # Trier par ELO pour le mode classé
-                matchmaking_queue[game_type].sort(key=lambda x: x['elo'])
-                # Prendre les deux joueurs les plus proches en ELO
-                player1 = matchmaking_queue[game_type][0]
-                player2 = matchmaking_queue[game_type][1]
-                if abs(player1['elo'] - player2['elo']) <= 200:
-                    matchmaking_queue[game_type].remove(player1)
-                    matchmaking_queue[game_type].remove(player2)
-                    
-                    # Créer la partie
-                    game = Game(
-                        game_uuid=str(uuid.uuid4()),
-                        white_player_id=player1['id'],
-                        black_player_id=player2['id'],
-                        game_type=game_type,
-                        status='in_progress',
-                        name=data.get('name', 'Partie d\'échecs'),
-                        description=data.get('description', '')
-                    )
-                    db.session.add(game)
-                    db.session.commit()
-                    
-                    # Notifier les deux joueurs immédiatement
-                    match_notifications[player1['id']] = {
-                        'game_id': game.id,
-                        'game_uuid': game.game_uuid,
-                        'opponent': player2['username'],
-                        'color': 'white',
-                        'match_found': True,
-                        'name': game.name,
-                        'description': game.description
-                    }
-                    match_notifications[player2['id']] = {
-                        'game_id': game.id,
-                        'game_uuid': game.game_uuid,
-                        'opponent': player1['username'],
-                        'color': 'black',
-                        'match_found': True,
-                        'name': game.name,
-                        'description': game.description
-                    }
-                    
-                    return jsonify({
-                        'message': 'Match trouvé !',
-                        'game_id': game.id,
-                        'game_uuid': game.game_uuid,
-                        'opponent': player2['username'] if current_user.id == player1['id'] else player1['username'],
-                        'color': 'white' if current_user.id == player1['id'] else 'black',
-                        'match_found': True,
-                        'name': game.name,
-                        'description': game.description
-                    }), 200
-            else:
-                # Mode casual : prendre les deux premiers joueurs
-                player1 = matchmaking_queue[game_type][0]
-                player2 = matchmaking_queue[game_type][1]
-                matchmaking_queue[game_type].remove(player1)
-                matchmaking_queue[game_type].remove(player2)
-                
-                # Créer la partie
-                game = Game(
-                    game_uuid=str(uuid.uuid4()),
-                    white_player_id=player1['id'],
-                    black_player_id=player2['id'],
-                    game_type=game_type,
-                    status='in_progress',
-                    name=data.get('name', 'Partie d\'échecs'),
-                    description=data.get('description', '')
-                )
-                db.session.add(game)
-                db.session.commit()
-                
-                # Notifier les deux joueurs immédiatement
-                match_notifications[player1['id']] = {
-                    'game_id': game.id,
-                    'game_uuid': game.game_uuid,
-                    'opponent': player2['username'],
-                    'color': 'white',
-                    'match_found': True,
-                    'name': game.name,
-                    'description': game.description
-                }
-                match_notifications[player2['id']] = {
-                    'game_id': game.id,
-                    'game_uuid': game.game_uuid,
-                    'opponent': player1['username'],
-                    'color': 'black',
-                    'match_found': True,
-                    'name': game.name,
-                    'description': game.description
-                }
-                
-                return jsonify({
-                    'message': 'Match trouvé !',
-                    'game_id': game.id,
-                    'game_uuid': game.game_uuid,
-                    'opponent': player2['username'] if current_user.id == player1['id'] else player1['username'],
-                    'color': 'white' if current_user.id == player1['id'] else 'black',
-                    'match_found': True,
-                    'name': game.name,
-                    'description': game.description
-                }), 200
-    
+
+    # L'appariement se fait dans le cycle de fond du matchmaker
+    queue_position = matchmaker.enqueue(
+        game_type,
+        current_user.id,
+        current_user.username,
+        current_user.elo_rating,
+        name=data.get('name', 'Partie d\'échecs'),
+        description=data.get('description', '')
+    )
+    if queue_position is None:
+        return jsonify({'error': 'Vous êtes déjà dans la file d\'attente'}), 400
+
     return jsonify({
         'message': 'Recherche d\'adversaire en cours...',
-        'queue_position': len(matchmaking_queue[game_type]),
+        'queue_position': queue_position,
         'match_found': False
     }), 200
 
@@ -344,51 +473,148 @@ def matchmaking():
 @login_required
 def matchmaking_status():
     game_type = request.args.get('game_type', 'casual')
-    
-    with queue_lock:
-        queue_position = next((i for i, user in enumerate(matchmaking_queue[game_type]) if user['id'] == current_user.id), None)
-        
-        if queue_position is not None:
-            return jsonify({
-                'in_queue': True,
-                'queue_position': queue_position + 1,
-                'total_players': len(matchmaking_queue[game_type])
-            })
-        
-        return jsonify({'in_queue': False})
+    queue_position, total_players = matchmaker.status(game_type, current_user.id)
+
+    if queue_position is not None:
+        return jsonify({
+            'in_queue': True,
+            'queue_position': queue_position,
+            'total_players': total_players
+        })
+
+    return jsonify({'in_queue': False})
 
 @app.route('/api/games/matchmaking/cancel', methods=['POST'])
 @login_required
 def cancel_matchmaking():
     game_type = request.args.get('game_type', 'casual')
-    
-    with queue_lock:
-        matchmaking_queue[game_type] = [user for user in matchmaking_queue[game_type] if user['id'] != current_user.id]
-    
+    matchmaker.cancel(game_type, current_user.id)
+
     return jsonify({'message': 'Recherche d\'adversaire annulée'}), 200
 
-@app.route('/api/games/matchmaking/check')
+def tournament_standings(tournament_id):
+    rows = db.session.execute(
+        db.select(TournamentPlayer.user_id, TournamentPlayer.score, TournamentPlayer.byes, User.username,
+                  User.elo_rating)
+        .join(User, TournamentPlayer.user_id == User.id)
+        .where(TournamentPlayer.tournament_id == tournament_id)
+        .order_by(TournamentPlayer.score.desc(), User.elo_rating.desc(), TournamentPlayer.user_id)
+    )
+    return [{'user_id': row.user_id, 'username': row.username, 'elo': row.elo_rating, 'score': row.score,
+             'byes': row.byes} for row in rows]
+
+@app.route('/api/tournaments')
 @login_required
-def check_matchmaking():
-    """Vérifie si un match a été trouvé pour l'utilisateur"""
-    if current_user.id in match_notifications:
-        notification = match_notifications.pop(current_user.id)
-        return jsonify({
-            'match_found': True,
-            'game_id': notification['game_id'],
-            'game_uuid': notification['game_uuid'],
-            'opponent': notification['opponent'],
-            'color': notification['color'],
-            'name': notification['name'],
-            'description': notification['description']
-        })
-    return jsonify({'match_found': False})
+def list_tournaments():
+    tournaments = Tournament.query.filter(Tournament.status != 'finished') \
+        .order_by(Tournament.created_at.desc()).all()
+    counts = dict(db.session.execute(
+        db.select(TournamentPlayer.tournament_id, db.func.count(TournamentPlayer.id))
+        .where(TournamentPlayer.tournament_id.in_([tournament.id for tournament in tournaments]))
+        .group_by(TournamentPlayer.tournament_id)
+    ).all())
+    return jsonify({'tournaments': [dict(tournament.to_dict(), players=counts.get(tournament.id, 0))
+                                    for tournament in tournaments]})
+
+@app.route('/api/tournaments', methods=['POST'])
+@login_required
+def create_tournament():
+    """Tournoi suisse (rounds : nombre de rondes) ou arène (rounds : durée en minutes)."""
+    data = request.get_json() or {}
+    tournament_format = data.get('format', 'swiss')
+    game_type = data.get('game_type', 'casual')
+    if tournament_format not in ('swiss', 'arena') or game_type not in ('casual', 'ranked'):
+        return jsonify({'error': 'Format ou type de partie invalide'}), 400
+    default_rounds = SWISS_ROUNDS if tournament_format == 'swiss' else ARENA_MINUTES
+    try:
+        rounds = int(data.get('rounds', default_rounds))
+    except (TypeError, ValueError):
+        return jsonify({'error': 'Nombre de rondes invalide'}), 400
+    if rounds < 1:
+        return jsonify({'error': 'Nombre de rondes invalide'}), 400
+
+    tournament = Tournament(name=data.get('name') or 'Tournoi', format=tournament_format, game_type=game_type,
+                            rounds=rounds, creator_id=current_user.id)
+    db.session.add(tournament)
+    db.session.commit()
+    return jsonify(tournament.to_dict()), 201
+
+@app.route('/api/tournaments/<int:tournament_id>')
+@login_required
+def get_tournament(tournament_id):
+    tournament = Tournament.query.get_or_404(tournament_id)
+    return jsonify(dict(tournament.to_dict(), standings=tournament_standings(tournament_id)))
+
+@app.route('/api/tournaments/<int:tournament_id>/join', methods=['POST'])
+@login_required
+def join_tournament(tournament_id):
+    tournament = Tournament.query.get_or_404(tournament_id)
+    if tournament.status == 'finished' or (tournament.status == 'running' and tournament.format == 'swiss'):
+        return jsonify({'error': 'Inscriptions closes'}), 400
+    if TournamentPlayer.query.filter_by(tournament_id=tournament_id, user_id=current_user.id).first():
+        return jsonify({'error': 'Vous êtes déjà inscrit'}), 400
+    db.session.add(TournamentPlayer(tournament_id=tournament_id, user_id=current_user.id))
+    db.session.commit()
+    return jsonify({'message': 'Inscription enregistrée'})
+
+@app.route('/api/tournaments/<int:tournament_id>/leave', methods=['POST'])
+@login_required
+def leave_tournament(tournament_id):
+    tournament = Tournament.query.get_or_404(tournament_id)
+    if tournament.status != 'open':
+        return jsonify({'error': 'Le tournoi a commencé'}), 400
+    TournamentPlayer.query.filter_by(tournament_id=tournament_id, user_id=current_user.id).delete()
+    db.session.commit()
+    return jsonify({'message': 'Inscription annulée'})
+
+@app.route('/api/tournaments/<int:tournament_id>/start', methods=['POST'])
+@login_required
+def start_tournament(tournament_id):
+    tournament = Tournament.query.get_or_404(tournament_id)
+    if tournament.creator_id != current_user.id or tournament.status != 'open':
+        return jsonify({'error': 'Impossible de démarrer ce tournoi'}), 400
+    try:
+        games = tournament_director.launch(tournament)
+    except Exception:
+        db.session.rollback()
+        raise
+    if not games:
+        return jsonify({'error': 'Pas assez de joueurs inscrits'}), 400
+    return jsonify({'message': 'Tournoi démarré', 'games': games})
+
+@app.route('/api/games/export.pgn')
+@login_required
+def export_games():
+    """Export PGN des parties terminées : d'un joueur (?user=pseudo), d'une période
+    (?since=AAAA-MM-JJ&until=AAAA-MM-JJ) ou du site entier, en flux et compressé
+    en gzip si le client l'accepte."""
+    user_id = None
+    if request.args.get('user'):
+        user = User.query.filter_by(username=request.args['user']).first()
+        if user is None:
+            return jsonify({'error': 'Utilisateur inconnu'}), 404
+        user_id = user.id
+    try:
+        since = parse_date(request.args.get('since'))
+        until = parse_date(request.args.get('until'))
+    except ValueError:
+        return jsonify({'error': 'Date invalide'}), 400
+
+    chunks = iter_archived_pgn(user_id=user_id, since=since, until=until)
+    headers = {'Content-Disposition': 'attachment; filename="games.pgn"'}
+    if 'gzip' in request.accept_encodings:
+        chunks = gzip_stream(chunks)
+        headers['Content-Encoding'] = 'gzip'
+        headers['Vary'] = 'Accept-Encoding'
+    return Response(stream_with_context(chunks), mimetype='application/x-chess-pgn', headers=headers)
 
 @app.route('/chessgame/<string:game_uuid>')
 @login_required
 def game_page(game_uuid):
     game = Game.query.filter_by(game_uuid=game_uuid).first_or_404()
     if game.white_player_id != current_user.id and game.black_player_id != current_user.id:
+        if game.status in ('active', 'in_progress'):
+            return redirect(url_for('spectate_page', game_uuid=game_uuid))
         return redirect(url_for('games'))
     
     color = 'white' if game.white_player_id == current_user.id else 'black'
@@ -396,11 +622,59 @@ def game_page(game_uuid):
     
     return render_template('chessgame.html', game=game, color=color, opponent=opponent)
 
+@app.route('/spectate/<string:game_uuid>')
+@login_required
+def spectate_page(game_uuid):
+    game = Game.query.filter_by(game_uuid=game_uuid).first_or_404()
+    if game.status not in ('active', 'in_progress'):
+        return redirect(url_for('games'))
+    return render_template('spectate.html', game=game)
+
+@app.route('/api/games/featured')
+@login_required
+def featured_games():
+    """Parties en cours mises en avant pour les spectateurs : les classées au plus fort ELO moyen."""
+    White, Black = db.aliased(User), db.aliased(User)
+    rows = db.session.execute(
+        db.select(Game.game_uuid, Game.name, Game.created_at, White.username.label('white'),
+                  Black.username.label('black'), White.elo_rating.label('white_elo'),
+                  Black.elo_rating.label('black_elo'))
+        .join(White, Game.white_player_id == White.id)
+        .join(Black, Game.black_player_id == Black.id)
+        .where(Game.status == 'in_progress', Game.game_type == 'ranked')
+        .order_by((White.elo_rating + Black.elo_rating).desc())
+        .limit(FEATURED_LIMIT)
+    ).all()
+    return jsonify({'games': [{
+        'game_uuid': row.game_uuid,
+        'name': row.name,
+        'white_player': row.white,
+        'black_player': row.black,
+        'white_elo': row.white_elo,
+        'black_elo': row.black_elo,
+        'created_at': row.created_at.isoformat()
+    } for row in rows]})
+
+registry.gauge('chess_active_games', 'Parties en mémoire sur ce worker', callback=lambda: len(active_games))
+registry.counter('chess_reaped', 'Éléments retirés par le nettoyage périodique', labels=('task',),
+                 callback=lambda: dict(reaper.reaped))
+registry.counter('chess_evicted_games', 'Parties mises sur disque depuis le démarrage',
+                 callback=lambda: idle_evictor.evicted)
+registry.gauge('chess_matchmaking_queue_depth', 'Joueurs en file de matchmaking', labels=('game_type',),
+               callback=lambda: matchmaker.depths())
+
+
+@app.route('/metrics')
+def metrics():
+    """Métriques de ce worker au format texte Prometheus."""
+    return Response(registry.render(), mimetype='text/plain; version=0.0.4')
+
 @app.route('/api/user/status')
 def user_status():
     if current_user.is_authenticated:
         return jsonify({
             'is_authenticated': True,
+            'id': current_user.id,
             'username': current_user.username,
             'email': current_user.email,
             'stats': {
@@ -413,6 +687,126 @@ def user_status():
         })
     return jsonify({'is_authenticated': False})
 
+def load_history_side(user_id, color, before, limit):
+    """Parties d'un joueur pour une couleur, des plus récentes aux plus anciennes,
+    avec le pseudo de l'adversaire par jointure."""
+    player, opponent = ((Game.white_player_id, Game.black_player_id) if color == 'white'
+                        else (Game.black_player_id, Game.white_player_id))
+    query = (
+        db.select(Game.id, Game.game_uuid, Game.game_type, Game.status, Game.created_at, Game.winner_id,
+                  User.username.label('opponent'))
+        .outerjoin(User, opponent == User.id)
+        .where(player == user_id, Game.status != 'cancelled')
+        .order_by(Game.created_at.desc(), Game.id.desc())
+        .limit(limit)
+    )
+    if before is not None:
+        query = query.where(tuple_(Game.created_at, Game.id) < before)
+    return [(row, color) for row in db.session.execute(query)]
+
+
+@app.route('/api/user/<int:user_id>/games')
+@login_required
+def user_games(user_id):
+    """Historique paginé par curseur sur (created_at, id) : le coût d'une page ne
+    dépend pas de sa profondeur, contrairement à un OFFSET."""
+    limit = max(1, min(request.args.get('limit', PAGE_SIZE, type=int), MAX_PAGE_SIZE))
+    before = None
+    if request.args.get('cursor'):
+        try:
+            created_at, game_id = decode_cursor(request.args['cursor'])
+            before = (datetime.fromisoformat(created_at), game_id)
+        except ValueError:
+            return jsonify({'error': 'Curseur invalide'}), 400
+
+    # Deux recherches indexées, une par couleur, fusionnées plutôt qu'un OR
+    rows = heapq.merge(load_history_side(user_id, 'white', before, limit + 1),
+                       load_history_side(user_id, 'black', before, limit + 1),
+                       key=lambda item: (item[0].created_at, item[0].id), reverse=True)
+    page = list(itertools.islice(rows, limit + 1))
+    games = []
+    for row, color in page[:limit]:
+        if row.status == 'abandoned':
+            result = 'abandoned'
+        elif row.status != 'finished':
+            result = None
+        elif row.winner_id is None:
+            result = 'draw'
+        else:
+            result = 'win' if row.winner_id == user_id else 'loss'
+        games.append({
+            'id': row.id,
+            'game_uuid': row.game_uuid,
+            'game_type': row.game_type,
+            'status': row.status,
+            'created_at': row.created_at.isoformat(),
+            'color': color,
+            'opponent': row.opponent,
+            'result': result
+        })
+    next_cursor = encode_cursor(games[-1]) if len(page) > limit else None
+    return jsonify({'games': games, 'next_cursor': next_cursor})
+
+@app.route('/api/games/<string:game_uuid>/analysis')
+@login_required
+def game_analysis(game_uuid):
+    """Analyse d'après-partie : évaluation, meilleur coup et erreurs de chaque coup."""
+    row = db.session.execute(db.select(Game.analysis).where(Game.game_uuid == game_uuid)).first()
+    if row is None:
+        return jsonify({'error': 'Partie introuvable'}), 404
+    if row.analysis is not None:
+        return Response('{"status":"done","analysis":' + row.analysis + '}', mimetype='application/json')
+    if analysis_queue.status(game_uuid) == 'pending':
+        return jsonify({'status': 'pending'}), 202
+    return jsonify({'status': 'unavailable'}), 404
+
+@app.route('/analysis/<string:game_uuid>')
+@login_required
+def analysis_page(game_uuid):
+    game = Game.query.filter_by(game_uuid=game_uuid).first_or_404()
+    if game.status != 'finished':
+        return redirect(url_for('games'))
+    return render_template('analysis.html', game=game)
+
+@app.route('/api/positions')
+@login_required
+def position_games():
+    """Parties archivées passées par une position (?fen=...) : coups joués ensuite
+    avec leurs résultats, et les parties les plus récentes."""
+    try:
+        board = chess.Board(request.args.get('fen', chess.STARTING_FEN))
+    except ValueError:
+        return jsonify({'error': 'FEN invalide'}), 400
+    limit = max(1, min(request.args.get('limit', PAGE_SIZE, type=int), MAX_PAGE_SIZE))
+
+    found = position_index.lookup(board, limit)
+    White, Black = db.aliased(User), db.aliased(User)
+    rows = db.session.execute(
+        db.select(Game.id, Game.game_uuid, Game.game_type, Game.created_at, Game.winner_id, Game.white_player_id,
+                  White.username.label('white'), Black.username.label('black'))
+        .outerjoin(White, Game.white_player_id == White.id)
+        .outerjoin(Black, Game.black_player_id == Black.id)
+        .where(Game.id.in_(found.pop('recent')))
+        .order_by(Game.id.desc())
+    )
+    found['recent'] = [{
+        'game_uuid': row.game_uuid,
+        'game_type': row.game_type,
+        'created_at': row.created_at.isoformat(),
+        'white': row.white,
+        'black': row.black,
+        'winner': 'draw' if row.winner_id is None else 'white' if row.winner_id == row.white_player_id else 'black'
+    } for row in rows]
+    found['fen'] = board.fen()
+    return jsonify(found)
+
+def server_busy():
+    """Réponse immédiate quand la file de hachage est pleine : le client réessaie plus tard."""
+    response = jsonify({'error': 'Serveur surchargé, réessayez dans quelques secondes'})
+    response.status_code = 503
+    response.headers['Retry-After'] = '2'
+    return response
+
 @app.route('/register', methods=['POST'])
 def register():
     data = request.get_json()
@@ -424,7 +818,10 @@ def register():
         return jsonify({'error': 'Email déjà utilisé'}), 400
     
     user = User(username=data['username'], email=data['email'])
-    user.set_password(data['password'])
+    try:
+        user.password_hash = password_hasher.hash(data['password'])
+    except HasherBusy:
+        return server_busy()
     
     db.session.add(user)
     db.session.commit()
@@ -436,7 +833,11 @@ def login():
     data = request.get_json()
     user = User.query.filter_by(username=data['username']).first()
     
-    if user and user.check_password(data['password']):
+    try:
+        valid = user is not None and password_hasher.verify(user.password_hash, data['password'])
+    except HasherBusy:
+        return server_busy()
+    if valid:
         login_user(user)
         return jsonify({
             'message': 'Connexion réussie',
@@ -456,12 +857,41 @@ def logout():
 
 @socketio.on('connect')
 def handle_connect():
-    print("[SOCKET] Connexion établie (mais sans user_id tant que join_game n'est pas appelé)")
+    connected_sockets.inc('/')
+    log.debug("Connexion établie (sans user_id tant que join_game n'est pas appelé)", sid=request.sid)
 
 
 @socketio.on('disconnect')
 def handle_disconnect():
-    print('Client déconnecté')
+    connected_sockets.dec('/')
+    for game_uuid in spectating.pop(request.sid, ()):
+        router.call('unwatch_game', game_uuid, None, {})
+    log.debug('Client déconnecté', sid=request.sid)
+
+@socketio.on('connect', namespace=LOBBY_NAMESPACE)
+def handle_lobby_connect():
+    if not current_user.is_authenticated:
+        return False
+
+    connected_sockets.inc(LOBBY_NAMESPACE)
+    with lobby_lock:
+        lobby_sockets[current_user.id] = request.sid
+        lobby_users[request.sid] = current_user.id
+        notification = match_notifications.pop(current_user.id, None)
+
+    # Livrer un match trouvé pendant que le joueur était hors ligne
+    if notification:
+        socketio.emit('match_found', notification, to=request.sid, namespace=LOBBY_NAMESPACE)
+
+
+@socketio.on('disconnect', namespace=LOBBY_NAMESPACE)
+def handle_lobby_disconnect():
+    connected_sockets.dec(LOBBY_NAMESPACE)
+    with lobby_lock:
+        user_id = lobby_users.pop(request.sid, None)
+        if lobby_sockets.get(user_id) == request.sid:
+            del lobby_sockets[user_id]
+
 
 @socketio.on('join_game')
 def handle_join_game(data):
@@ -476,121 +906,274 @@ def handle_join_game(data):
         if request.sid in socketio.server.environ:
             socketio.server.environ[request.sid]['user_id'] = current_user.id
 
-        print(f"[SOCKET] {current_user.username} a rejoint la room {game_uuid}")
-
-        # Initialiser la partie si elle n'existe pas déjà
-        if game_uuid not in active_games:
-            chess_game = create_game(game_uuid, game.white_player_id, game.black_player_id)
-            chess_game.set_socketio(socketio)
-            active_games[game_uuid] = chess_game
+        log.info('Joueur entré dans la partie', user_id=current_user.id, game_uuid=game_uuid)
 
-        return {'status': 'success'}
+        return router.call('join_game', game_uuid, current_user.id, {
+            'game_uuid': game_uuid,
+            'sid': request.sid,
+            'white_player_id': game.white_player_id,
+            'black_player_id': game.black_player_id
+        })
 
     return {'status': 'error', 'message': 'Partie non trouvée ou accès non autorisé'}
 
 
+@router.handler('join_game')
+def open_game(game, user_id, data):
+    # Initialiser la partie si elle n'existe pas déjà
+    if game is None:
+        game = create_game(data['game_uuid'], data['white_player_id'], data['black_player_id'])
+
+    # État complet pour ce client uniquement ; la room ne reçoit que des deltas
+    game.emit_game_state(to=data['sid'])
+    return {'status': 'success'}
+
+
+@socketio.on('watch_game')
+def handle_watch_game(data):
+    """Spectateur : room à part, diffusion regroupée par le worker propriétaire de la partie."""
+    game_uuid = data['game_uuid']
+    if not current_user.is_authenticated or game_uuid in spectating.get(request.sid, ()):
+        return {'status': 'error', 'message': 'Accès non autorisé'}
+    response = router.call('watch_game', game_uuid, current_user.id, {'sid': request.sid})
+    if response.get('status') == 'success':
+        join_room(spectator_room(game_uuid, shard_of(request.sid)))
+        spectating.setdefault(request.sid, set()).add(game_uuid)
+    return response
+
+
+@router.handler('watch_game')
+def watch_game(game, user_id, data):
+    if game is None:
+        return GAME_NOT_FOUND
+    game.spectators += 1
+    # Première image tout de suite, les suivantes au rythme de la diffusion
+    socketio.emit('spectator_state', game.spectator_frame(), to=data['sid'])
+    return {'status': 'success'}
+
+
+@socketio.on('unwatch_game')
+def handle_unwatch_game(data):
+    game_uuid = data['game_uuid']
+    if game_uuid in spectating.get(request.sid, ()):
+        spectating[request.sid].discard(game_uuid)
+        leave_room(spectator_room(game_uuid, shard_of(request.sid)))
+        router.call('unwatch_game', game_uuid, current_user.id, {})
+    return {'status': 'success'}
+
+
+@router.handler('unwatch_game')
+def unwatch_game(game, user_id, data):
+    if game is not None and game.spectators > 0:
+        game.spectators -= 1
+
+
+@socketio.on('request_game_state')
+def handle_request_game_state(data):
+    """Renvoie l'état complet à un client qui a détecté un trou de séquence."""
+    return router.call('request_game_state', data.get('game_uuid'), current_user.id,
+                       {'sid': request.sid})
+
+
+@router.handler('request_game_state')
+def send_game_state(game, user_id, data):
+    if game and user_id in [game.white_player_id, game.black_player_id]:
+        game.emit_game_state(to=data['sid'])
+        return {'status': 'success'}
+    return GAME_NOT_FOUND
 
 @socketio.on('make_move')
 def handle_make_move(data):
-    print("[DEBUG] Socket reçu : make_move", data)
-    game_uuid = data['game_uuid']
-    move_uci = data['move']
-    
-    if game_uuid in active_games:
-        game = active_games[game_uuid]
-        success, message = game.make_move(current_user.id, move_uci)
-        if success:
-            # Émettre l'état du jeu à tous les joueurs dans la salle
-            game.emit_game_state()
-        return {'status': 'success' if success else 'error', 'message': message}
-    return {'status': 'error', 'message': 'Partie non trouvée'}
+    log.debug('Socket reçu : make_move', user_id=current_user.id, game_uuid=data.get('game_uuid'),
+              move=data.get('move'))
+    return router.call('make_move', data['game_uuid'], current_user.id, {'move': data['move']})
 
-@socketio.on('resign_game')
-def handle_resign_game(data):
-    game_uuid = data.get('game_uuid')
-    player_id = current_user.id
-    game = get_game(game_uuid)
 
-    if game:
-        game.game_over = True
+@router.handler('make_move')
+def play_move(game, user_id, data):
+    if game is None:
+        return GAME_NOT_FOUND
+    if not game.is_player(user_id):
+        return NOT_A_PLAYER
+    success, message = game.make_move(user_id, data['move'])
+    return {'status': 'success' if success else 'error', 'message': message}
 
-        if player_id == game.white_player_id:
-            game.winner = 'black'
-            winner_color = 'Noirs'
-        else:
-            game.winner = 'white'
-            winner_color = 'Blancs'
+@socketio.on('resign_game')
+def handle_resign_game(data):
+    router.call('resign_game', data.get('game_uuid'), current_user.id, {})
 
-        db_game = Game.query.filter_by(game_uuid=game_uuid).first()
-        if db_game:
-            db_game.status = 'finished'
-            db.session.commit()
 
-        socketio.emit('game_over', {
-            'result': f'Victoire des {winner_color} (abandon)',
-            'winner': game.winner,
-            'game_uuid': game_uuid
-        }, room=game_uuid)
+@router.handler('resign_game')
+def resign_game(game, user_id, data):
+    if game and user_id in [game.white_player_id, game.black_player_id]:
+        game.resign(user_id)
 
 
 
 @socketio.on('offer_draw')
 def handle_offer_draw(data):
-    print(f"[SOCKET] Offre de nulle reçue pour {data['game_uuid']} par {current_user.username}")
-    game_uuid = data.get('game_uuid')
-    game = get_game(game_uuid)
+    log.info('Offre de nulle reçue', game_uuid=data['game_uuid'], user_id=current_user.id)
+    return router.call('offer_draw', data.get('game_uuid'), current_user.id, {})
 
-    if game:
-        if current_user.id == game.white_player_id:
-            opponent_id = game.black_player_id
-        else:
-            opponent_id = game.white_player_id
 
-        opponent_sid = user_sockets.get(opponent_id)
-        if opponent_sid:
-            socketio.emit('draw_offered', {'game_uuid': game_uuid}, room=opponent_sid)
-        else:
-            print(f"[ERREUR] SID non trouvé pour l'adversaire {opponent_id}")
+@router.handler('offer_draw')
+def offer_draw(game, user_id, data):
+    if game is None:
+        return GAME_NOT_FOUND
+    if not game.offer_draw(user_id):
+        return NOT_A_PLAYER
+    if user_id == game.white_player_id:
+        opponent_id = game.black_player_id
+    else:
+        opponent_id = game.white_player_id
+
+    opponent_sid = user_sockets.get(opponent_id)
+    if opponent_sid:
+        socketio.emit('draw_offered', {'game_uuid': game.game_uuid}, room=opponent_sid)
+    else:
+        log.warning("SID non trouvé pour l'adversaire", game_uuid=game.game_uuid, opponent_id=opponent_id)
+    return {'status': 'success'}
 
 
 @socketio.on('accept_draw')
 def handle_accept_draw(data):
-    game = get_game(data['game_uuid'])
-    if game:
-        game.game_over = True
-        game.winner = None
-        db_game = Game.query.filter_by(game_uuid=game.game_uuid).first()
-        if db_game:
-            db_game.status = 'finished'
-            db.session.commit()
+    return router.call('accept_draw', data['game_uuid'], current_user.id, {})
+
 
-        socketio.emit('game_over', {
-            'result': 'Partie nulle',
-            'game_uuid': game.game_uuid
-        }, room=game.game_uuid)
+@router.handler('accept_draw')
+def accept_draw(game, user_id, data):
+    if game is None:
+        return GAME_NOT_FOUND
+    if not game.accept_draw(user_id):
+        return NO_DRAW_OFFER
+    return {'status': 'success'}
 
 @socketio.on('decline_draw')
 def handle_decline_draw(data):
-    game = get_game(data['game_uuid'])
-    if game:
-        game.decline_draw()
+    return router.call('decline_draw', data['game_uuid'], current_user.id, {})
+
+
+@router.handler('decline_draw')
+def decline_draw(game, user_id, data):
+    if game is None:
+        return GAME_NOT_FOUND
+    if not game.decline_draw(user_id):
+        return NO_DRAW_OFFER
+    return {'status': 'success'}
 
 
 
 
 @socketio.on('send_greeting')
 def handle_greeting(data):
-    print("Greeting reçu :", data)
+    log.debug('Greeting reçu', game_uuid=data.get('game_uuid'), greeting=data.get('message'))
     game_uuid = data['game_uuid']
     message = data['message']
     # Envoyer à tous les membres de la room (y compris l'expéditeur si souhaité)
     socketio.emit('receive_greeting', {'message': message}, room=game_uuid)
 
 
-# Créer la base de données si elle n'existe pas
-with app.app_context():
-    if not os.path.exists('chess.db'):
-        db.create_all()
+@reaper.register
+def reap_finished():
+    """Parties terminées : retirées de la mémoire après un délai laissé aux retardataires."""
+    return reap_finished_games(FINISHED_GRACE)
+
+@reaper.register
+def expire_waiting_games():
+    """Parties du lobby restées sans adversaire : annulées, comme par leur créateur."""
+    cutoff = datetime.now(UTC) - timedelta(seconds=WAITING_TIMEOUT)
+    with app.app_context():
+        try:
+            count = Game.query.filter(Game.status == 'waiting', Game.created_at < cutoff) \
+                .update({'status': 'cancelled'}, synchronize_session=False)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+    if count:
+        lobby.invalidate()
+    return count
+
+@reaper.register
+def expire_queue_entries():
+    """Joueurs en file depuis trop longtemps : retirés et prévenus sur le lobby."""
+    stale = matchmaker.stale_entries(datetime.now(UTC) - timedelta(seconds=QUEUE_TIMEOUT))
+    expired = 0
+    for game_type, user_id in stale:
+        # None : apparié ou parti entre-temps
+        if matchmaker.cancel(game_type, user_id) is not None:
+            push_queue_status(user_id, {'game_type': game_type, 'in_queue': False, 'expired': True})
+            expired += 1
+    return expired
+
+@reaper.register
+def close_abandoned_games():
+    """Parties commencées dont ce worker est propriétaire mais qui ne vivent plus nulle part
+    (jamais ouvertes, ou journal des coups perdu) et sans coup depuis ABANDONED_TIMEOUT :
+    marquées abandonnées, un statut à part qui ne compte ni pour le classement ni pour
+    les statistiques. Les parties mises sur disque ne sont pas rechargées pour autant."""
+    cutoff = datetime.now(UTC) - timedelta(seconds=ABANDONED_TIMEOUT)
+    with app.app_context():
+        try:
+            candidates = db.session.execute(
+                db.select(Game.id, Game.game_uuid)
+                .where(Game.status.in_(['active', 'in_progress']), Game.updated_at < cutoff)
+            ).all()
+            abandoned = []
+            for row in candidates:
+                if not router.owns(row.game_uuid) or game_exists(row.game_uuid):
+                    continue
+                # updated_at ne bouge pas à chaque coup : le journal des coups date le dernier
+                last_move = move_log.last_move_at(row.game_uuid)
+                if last_move is None or last_move < cutoff.timestamp():
+                    abandoned.append(row.id)
+            if abandoned:
+                Game.query.filter(Game.id.in_(abandoned), Game.status.in_(['active', 'in_progress'])) \
+                    .update({'status': 'abandoned'}, synchronize_session=False)
+                db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+    return len(abandoned)
+
+
+stats_writer.init_app(app, db, User)
+position_index.init_app(app, db, Game)
+analysis_queue.init_app(app, db, Game)
+tournament_director.init_app(app)
+
+
+def start_workers():
+    """Tâches de fond du worker : à lancer une seule fois, dans le processus qui sert
+    (pas dans le parent du rechargeur de Werkzeug, qui ne fait que surveiller les fichiers)."""
+    # Recharger les parties interrompues par un redémarrage
+    router.join()
+    restore_owned_games()
+
+    router.start(socketio)
+    matchmaker.start(socketio)
+    finalizer.start(socketio)
+    flag_scheduler.start(socketio)
+    idle_evictor.start(socketio)
+    spectator_fanout.start(socketio)
+    reaper.start(socketio)
+    stats_writer.start(socketio)
+    position_index.start(socketio)
+    analysis_queue.start(socketio)
+    tournament_director.start(socketio)
+
 
 if __name__ == '__main__':
-    app.run(host='127.0.0.1', port=5000, debug=True) 
\ No newline at end of file
+    # Plusieurs workers : un port par processus (PORT) et STATE_BACKEND partagé.
+    # socketio.run choisit le serveur du mode (Werkzeug, eventlet ou gevent).
+    debug = os.environ.get('CHESS_DEBUG', '0') == '1'
+    if not debug or os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        start_workers()
+    # SIGTERM : sortie normale, pour arrêter les pools de processus ci-dessous
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        socketio.run(app, host='127.0.0.1', port=int(os.environ.get('PORT', 5000)),
+                     debug=debug, allow_unsafe_werkzeug=True)
+    finally:
+        password_hasher.shutdown()
+        analysis_queue.shutdown()
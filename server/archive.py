@@ -0,0 +1,90 @@
+import os
+import zlib
+from datetime import datetime
+
+import chess
+import chess.pgn
+from sqlalchemy import or_, tuple_
+
+from database import db, Game
+
+# Nom du site dans l'en-tête PGN et nombre de parties lues par requête à l'export
+PGN_SITE = os.environ.get('CHESS_SITE', 'ProjetPro')
+EXPORT_BATCH = 500
+
+RESULT_TAGS = {'white': '1-0', 'black': '0-1', 'draw': '1/2-1/2'}
+TERMINATIONS = {'temps': 'time forfeit', 'abandon': 'abandoned', 'accord': 'normal'}
+
+
+def format_clock(seconds):
+    seconds = max(int(seconds), 0)
+    return f'{seconds // 3600}:{seconds // 60 % 60:02d}:{seconds % 60:02d}'
+
+
+def build_pgn(db_game, white_name, black_name, moves, result, time_control=600):
+    """PGN d'une partie terminée : en-têtes de `Game`, coups du journal et pendule
+    restante du joueur après chacun de ses coups ({[%clk h:mm:ss]})."""
+    game = chess.pgn.Game()
+    game.headers['Event'] = db_game.name
+    game.headers['Site'] = PGN_SITE
+    game.headers['Date'] = db_game.created_at.strftime('%Y.%m.%d')
+    game.headers['Round'] = '-'
+    game.headers['White'] = white_name
+    game.headers['Black'] = black_name
+    game.headers['Result'] = RESULT_TAGS[result['winner']]
+    game.headers['TimeControl'] = str(time_control)
+    game.headers['Termination'] = TERMINATIONS.get(result.get('reason'), 'normal')
+    game.headers['GameType'] = db_game.game_type
+    game.headers['UTCDate'] = db_game.created_at.strftime('%Y.%m.%d')
+    game.headers['UTCTime'] = db_game.created_at.strftime('%H:%M:%S')
+
+    node = game
+    for move in moves:
+        mover = 'white' if node.board().turn == chess.WHITE else 'black'
+        node = node.add_variation(chess.Move.from_uci(move['uci']))
+        node.comment = f'[%clk {format_clock(move[mover])}]'
+    return str(game) + '\n\n'
+
+
+def parse_date(value):
+    """Date AAAA-MM-JJ (ou date et heure ISO) des paramètres d'export ; ValueError sinon."""
+    return datetime.fromisoformat(value) if value else None
+
+
+def iter_archived_pgn(user_id=None, since=None, until=None, batch=EXPORT_BATCH):
+    """PGN des parties archivées, par ordre de création.
+
+    Pagination par clé (created_at, id) : chaque lot reprend après la dernière
+    partie du lot précédent, sans OFFSET, si bien que la mémoire reste
+    constante quel que soit le nombre de parties exportées.
+    """
+    query = db.select(Game.id, Game.created_at, Game.pgn).where(Game.status == 'finished', Game.pgn.isnot(None))
+    if user_id is not None:
+        query = query.where(or_(Game.white_player_id == user_id, Game.black_player_id == user_id))
+    if since is not None:
+        query = query.where(Game.created_at >= since)
+    if until is not None:
+        query = query.where(Game.created_at < until)
+    query = query.order_by(Game.created_at, Game.id).limit(batch)
+
+    last = None
+    while True:
+        page = query if last is None else query.where(tuple_(Game.created_at, Game.id) > last)
+        rows = db.session.execute(page).all()
+        # Relâcher la connexion entre deux lots : un export lent ne bloque pas le pool
+        db.session.remove()
+        for row in rows:
+            yield row.pgn
+        if len(rows) < batch:
+            return
+        last = (rows[-1].created_at, rows[-1].id)
+
+
+def gzip_stream(chunks, level=6):
+    """Compresse un flux de textes au format gzip, morceau par morceau."""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode('utf-8'))
+        if data:
+            yield data
+    yield compressor.flush()
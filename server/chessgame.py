@@ -1,190 +1,570 @@
+import base64
 import chess
 import json
+import os
+import threading
 import time
-from database import db, User
+from array import array
+from collections import OrderedDict
 from datetime import datetime
 from flask_socketio import emit
+from movelog import move_log
+from gamestore import game_store
+from finalization import finalizer
+from clocks import FlagScheduler
+from logs import get_logger
+from metrics import move_validation_seconds, emit_seconds
+from positions import position_cache, push_move, zobrist_key, encode_move, decode_move
+from spectators import spectator_fanout
+
+log = get_logger('chessgame')
+
+RESULT_LABELS = {'white': 'Blancs', 'black': 'Noirs'}
+STARTING_KEY = zobrist_key(chess.Board())
 
 class ChessGame:
+    """Partie en cours, gardée en mémoire sous une forme compacte.
+
+    L'échiquier ne conserve pas sa pile de coups : les coups joués sont encodés
+    sur 16 bits dans `moves`, et la répétition est suivie par les clés Zobrist
+    des positions depuis le dernier coup irréversible (`recent`). Les pendules
+    sont trois nombres et le camp dont le temps s'écoule.
+    """
+
+    __slots__ = ('game_uuid', 'white_player_id', 'black_player_id', 'board', 'zobrist', 'moves', 'recent',
+                 'game_over', 'winner', 'result', 'seq', 'white_time', 'black_time', 'clock_started',
+                 'running', 'last_active', 'spectators', 'draw_offer')
+
     def __init__(self, game_uuid, white_id, black_id, total_time_seconds=600):
         self.game_uuid = game_uuid
         self.white_player_id = white_id
         self.black_player_id = black_id
         self.board = chess.Board()
-        self.current_turn = 'white'
+        # Clé Zobrist de la position courante, tenue à jour coup par coup
+        self.zobrist = STARTING_KEY
+        self.moves = array('H')
+        self.recent = array('Q', [STARTING_KEY])
         self.game_over = False
         self.winner = None
-        self.socketio = None
-        self.clock = {
-            'white': total_time_seconds,
-            'black': total_time_seconds,
-            'last_update': time.time(),
-            'running': 'white'
+        # Résultat final, fixé une seule fois par finish()
+        self.result = None
+        # Numéro de version de l'état, incrémenté à chaque coup diffusé
+        self.seq = 0
+        # Temps restant de chaque camp au début du trait en cours
+        self.white_time = float(total_time_seconds)
+        self.black_time = float(total_time_seconds)
+        self.clock_started = time.time()
+        self.running = 'white'
+        self.last_active = time.time()
+        # Spectateurs inscrits auprès du worker propriétaire
+        self.spectators = 0
+        # Joueur dont l'offre de nulle attend une réponse
+        self.draw_offer = None
+
+    @property
+    def socketio(self):
+        return _socketio
+
+    @property
+    def current_turn(self):
+        return 'white' if self.board.turn == chess.WHITE else 'black'
+
+    def to_state(self):
+        """État sérialisable de la partie, pour la céder à un autre worker ou la mettre sur disque."""
+        return {
+            'game_uuid': self.game_uuid,
+            'white_player_id': self.white_player_id,
+            'black_player_id': self.black_player_id,
+            'fen': self.board.fen(),
+            'moves': base64.b64encode(self.moves.tobytes()).decode(),
+            'recent': list(self.recent),
+            'game_over': self.game_over,
+            'winner': self.winner,
+            'result': self.result,
+            'seq': self.seq,
+            'spectators': self.spectators,
+            'draw_offer': self.draw_offer,
+            'clock': {
+                'white': self.white_time,
+                'black': self.black_time,
+                'last_update': self.clock_started,
+                'running': self.running
+            }
         }
 
-    def set_socketio(self, socketio_instance):
-        self.socketio = socketio_instance
+    @classmethod
+    def from_state(cls, data):
+        game = cls(data['game_uuid'], data['white_player_id'], data['black_player_id'])
+        game.board = chess.Board(data['fen'])
+        game.zobrist = zobrist_key(game.board)
+        game.moves = array('H', base64.b64decode(data['moves']))
+        game.recent = array('Q', data['recent'])
+        game.game_over = data['game_over']
+        game.winner = data['winner']
+        game.result = data['result']
+        game.seq = data['seq']
+        game.spectators = data.get('spectators', 0)
+        game.draw_offer = data.get('draw_offer')
+        clock = data['clock']
+        game.white_time = clock['white']
+        game.black_time = clock['black']
+        game.clock_started = clock['last_update']
+        game.running = clock['running']
+        return game
+
+    def play(self, move):
+        """Joue un coup légal sur l'échiquier, sans pendule ni diffusion."""
+        self.zobrist = push_move(self.board, move, self.zobrist)
+        self.board.clear_stack()
+        self.moves.append(encode_move(move))
+        if self.board.halfmove_clock == 0:
+            # Coup irréversible : les positions précédentes ne peuvent plus se répéter
+            self.recent = array('Q')
+        self.recent.append(self.zobrist)
+
+    def position(self):
+        """Coups légaux et issue de la position courante, depuis le cache partagé."""
+        return position_cache.lookup(self.zobrist, self.board)
 
     def get_winner(self):
-        if not self.board.is_game_over():
-            return None
-        outcome = self.board.outcome()
-        if outcome.winner is None:
+        outcome = self.position().outcome
+        if outcome:
+            return outcome
+        # Répétition et règle des 75 coups dépendent de l'historique, pas de la position
+        if self.recent.count(self.zobrist) >= 5 or self.board.is_seventyfive_moves():
             return 'draw'
-        return 'white' if outcome.winner else 'black'
+        return None
+
+    def time_left(self, color, now=None):
+        remaining = self.white_time if color == 'white' else self.black_time
+        if color == self.running and not self.game_over:
+            remaining -= (now or time.time()) - self.clock_started
+        return remaining
+
+    def schedule_flag(self):
+        """Programme la chute du drapeau de la pendule en cours."""
+        remaining = self.white_time if self.running == 'white' else self.black_time
+        flag_scheduler.schedule(self.game_uuid, self.clock_started + remaining)
+
+    def check_flag(self):
+        """Termine la partie au temps si la pendule en cours est tombée."""
+        if self.game_over:
+            return False
+        now = time.time()
+        running = self.running
+        if self.time_left(running, now) > 0:
+            self.schedule_flag()
+            return False
+
+        if running == 'white':
+            self.white_time = 0
+        else:
+            self.black_time = 0
+        self.clock_started = now
+        opponent = 'black' if running == 'white' else 'white'
+        # Pas de victoire au temps sans matériel suffisant pour mater
+        if self.board.has_insufficient_material(chess.WHITE if opponent == 'white' else chess.BLACK):
+            self.finish('draw', 'temps')
+        else:
+            self.finish(opponent, 'temps')
+        return True
 
     def make_move(self, player_id, move_uci):
-        print("[INFO] Coup reçu :", move_uci, "de joueur ID", player_id)
+        log.debug('Coup reçu', game_uuid=self.game_uuid, move=move_uci, player_id=player_id)
         if self.game_over:
-            print("[INFO] La partie est déjà terminée")
+            log.debug('La partie est déjà terminée', game_uuid=self.game_uuid)
             return False, "La partie est terminée"
+        if not self.is_player_turn(player_id):
+            log.debug('Coup refusé : pas le trait', game_uuid=self.game_uuid, player_id=player_id)
+            return False, "Ce n'est pas votre tour"
+        if self.check_flag():
+            return False, "Temps écoulé"
 
         try:
-            move = chess.Move.from_uci(move_uci)
-            if move in self.board.legal_moves:
-                self.board.push(move)
+            with move_validation_seconds.time():
+                legal = move_uci in self.position().legal
+            if legal:
+                self.play(chess.Move.from_uci(move_uci))
                 now = time.time()
-                elapsed = now - self.clock['last_update']
+                elapsed = now - self.clock_started
                 if self.board.turn == chess.WHITE:
-                    self.clock['black'] -= elapsed
-                    self.clock['running'] = 'white'
+                    self.black_time -= elapsed
+                    self.running = 'white'
                 else:
-                    self.clock['white'] -= elapsed
-                    self.clock['running'] = 'black'
-                self.clock['last_update'] = now
-                self.current_turn = 'black' if self.current_turn == 'white' else 'white'
+                    self.white_time -= elapsed
+                    self.running = 'black'
+                self.clock_started = now
+                self.last_active = now
+                self.schedule_flag()
+                move_log.append(self.game_uuid, self.board.ply(), move_uci, self.white_time, self.black_time,
+                                self.running, self.board.fen(), self.moves)
 
-                if self.board.is_game_over():
-                    result = self.board.result()
+                self.seq += 1
+                winner = self.get_winner()
+                if winner:
                     self.game_over = True
-                    if result == '1-0':
-                        self.winner = 'blancs'
-                        self.update_player_stats(winner_id=self.white_player_id, loser_id=self.black_player_id)
-                    elif result == '0-1':
-                        self.winner = 'noirs'
-                        self.update_player_stats(winner_id=self.black_player_id, loser_id=self.white_player_id)
-                    else:
-                        self.winner = 'draw'
-                        self.update_player_stats(draw_ids=[self.white_player_id, self.black_player_id])
-                    time.sleep(0.3)
-                    self.socketio.emit('game_over', {
-                        'result': f'Victoire des {self.winner} !' if self.winner != 'draw' else 'Nulle',
-                        'winner': self.winner,
-                        'game_uuid': self.game_uuid
-                    }, room=self.game_uuid)
-
-                self.emit_game_state()
+                    self.winner = winner
+                self.emit_move(move_uci)
+                if self.game_over:
+                    self.finish(self.winner)
                 return True, "Coup accepté"
             else:
-                print("[INFO] Coup illégal selon python-chess")
+                log.debug('Coup illégal selon python-chess', game_uuid=self.game_uuid, move=move_uci)
                 return False, "Coup illégal"
         except Exception as e:
-            print("[ERREUR] Problème dans make_move :", str(e))
+            log.exception('Problème dans make_move', game_uuid=self.game_uuid, move=move_uci)
             return False, str(e)
 
-    def update_player_stats(self, winner_id=None, loser_id=None, draw_ids=[]):
-        if winner_id:
-            winner = User.query.get(winner_id)
-            if winner:
-                winner.wins += 1
-                winner.games_played += 1
-        if loser_id:
-            loser = User.query.get(loser_id)
-            if loser:
-                loser.losses += 1
-                loser.games_played += 1
-        for player_id in draw_ids:
-            player = User.query.get(player_id)
-            if player:
-                player.draws += 1
-                player.games_played += 1
-        db.session.commit()
+    def finish(self, winner, reason=None):
+        """Termine la partie : résultat en mémoire et game_over émis tout de suite,
+        le reste (base de données, statistiques) part dans la file de finalisation."""
+        if self.result is not None:
+            return False
+        self.game_over = True
+        self.winner = winner
+        flag_scheduler.cancel(self.game_uuid)
+        self.result = {
+            'game_uuid': self.game_uuid,
+            'white_player_id': self.white_player_id,
+            'black_player_id': self.black_player_id,
+            'winner': winner,
+            'reason': reason,
+            'finished_at': time.time()
+        }
+        move_log.close(self.game_uuid)
+
+        if winner == 'draw':
+            message = 'Partie nulle'
+        elif reason:
+            message = f'Victoire des {RESULT_LABELS[winner]} ({reason})'
+        else:
+            message = f'Victoire des {RESULT_LABELS[winner]} !'
+        if self.socketio:
+            with emit_seconds.time('game_over'):
+                self.socketio.emit('game_over', {
+                    'result': message,
+                    'winner': winner,
+                    'game_uuid': self.game_uuid
+                }, to=self.game_uuid)
+        log.info('Partie terminée', game_uuid=self.game_uuid, winner=winner, reason=reason)
+        self.publish_to_spectators()
+
+        finalizer.submit(self.result)
+        return True
+
+    def is_player(self, player_id):
+        return player_id in (self.white_player_id, self.black_player_id)
 
     def is_player_turn(self, player_id):
         return (player_id == self.white_player_id if self.current_turn == 'white' else player_id == self.black_player_id)
 
-    def emit_game_state(self):
-        self.socketio.emit('game_state', {
+    def legal_moves(self):
+        """Coups jouables en UCI, envoyés aux clients pour valider leurs coups sans moteur."""
+        return [] if self.game_over else self.position().legal
+
+    def emit_game_state(self, to=None):
+        """État complet : envoyé à l'arrivée d'un joueur ou sur trou de séquence."""
+        with emit_seconds.time('game_state'):
+            self.socketio.emit('game_state', {
+                'seq': self.seq,
+                'board_fen': self.board.fen(),
+                'turn': 'white' if self.board.turn == chess.WHITE else 'black',
+                'is_game_over': self.game_over,
+                'winner': self.winner,
+                'white_time': self.white_time,
+                'black_time': self.black_time,
+                'running': self.running,
+                'legal_moves': self.legal_moves()
+            }, to=to or self.game_uuid)
+
+    def emit_move(self, move_uci):
+        """Delta d'un coup accepté ; le client l'applique si seq suit la sienne."""
+        with emit_seconds.time('game_move'):
+            self.socketio.emit('game_move', {
+                'seq': self.seq,
+                'move': move_uci,
+                'white_time': round(self.white_time, 1),
+                'black_time': round(self.black_time, 1),
+                'running': self.running,
+                'is_game_over': self.game_over,
+                'winner': self.winner,
+                'legal_moves': self.legal_moves()
+            }, to=self.game_uuid)
+        self.publish_to_spectators()
+
+    def spectator_frame(self):
+        """État complet en lecture seule : les spectateurs peuvent manquer des coups."""
+        return {
+            'game_uuid': self.game_uuid,
+            'seq': self.seq,
             'board_fen': self.board.fen(),
-            'turn': 'white' if self.board.turn == chess.WHITE else 'black',
+            'last_move': decode_move(self.moves[-1]).uci() if self.moves else None,
+            'white_time': round(self.time_left('white'), 1),
+            'black_time': round(self.time_left('black'), 1),
+            'running': self.running,
             'is_game_over': self.game_over,
-            'winner': self.winner,
-            'white_time': self.clock['white'],
-            'black_time': self.clock['black'],
-            'running': self.clock['running']
-        }, room=self.game_uuid)
+            'winner': self.winner
+        }
+
+    def publish_to_spectators(self):
+        # Rien à construire tant que personne ne regarde
+        if self.spectators:
+            spectator_fanout.publish(self.game_uuid, self.spectator_frame())
 
     def resign(self, player_id):
         if not self.game_over:
-            self.game_over = True
-            self.winner = 'black' if player_id == self.white_player_id else 'white'
-            winner_id = self.black_player_id if player_id == self.white_player_id else self.white_player_id
-            self.update_player_stats(winner_id=winner_id, loser_id=player_id)
-            self.socketio.emit('game_over', {
-                'result': 'Abandon',
-                'winner': self.winner
-            }, room=self.game_uuid)
-
-    def offer_draw(self):
-        if not self.game_over:
-            self.socketio.emit('draw_offered', room=self.game_uuid)
+            self.finish('black' if player_id == self.white_player_id else 'white', 'abandon')
 
-    def accept_draw(self):
-        if not self.game_over:
-            self.game_over = True
-            self.update_player_stats(draw_ids=[self.white_player_id, self.black_player_id])
-            self.socketio.emit('game_over', {
-                'result': 'Nulle',
-                'winner': 'draw'
-            }, room=self.game_uuid)
-
-    def decline_draw(self):
-        if not self.game_over:
-            self.socketio.emit('draw_declined', room=self.game_uuid)
+    def offer_draw(self, player_id):
+        """Enregistre l'offre de nulle d'un joueur ; False si elle n'est pas recevable."""
+        if self.game_over or not self.is_player(player_id):
+            return False
+        self.draw_offer = player_id
+        return True
+
+    def accept_draw(self, player_id):
+        # Seule une offre de l'adversaire peut être acceptée
+        if self.game_over or not self.is_player(player_id) or self.draw_offer in (None, player_id):
+            return False
+        return self.finish('draw', 'accord')
+
+    def decline_draw(self, player_id):
+        if self.game_over or not self.is_player(player_id) or self.draw_offer in (None, player_id):
+            return False
+        self.draw_offer = None
+        self.socketio.emit('draw_declined', room=self.game_uuid)
+        return True
 
     def handle_disconnect(self, player_id):
         if not self.game_over:
-            self.game_over = True
-            self.winner = 'black' if player_id == self.white_player_id else 'white'
-            winner_id = self.black_player_id if player_id == self.white_player_id else self.white_player_id
-            self.update_player_stats(winner_id=winner_id, loser_id=player_id)
-            if self.socketio:
-                self.socketio.emit('game_over', {
-                    'result': 'Abandon',
-                    'winner': self.winner
-                }, room=self.game_uuid)
+            self.finish('black' if player_id == self.white_player_id else 'white', 'abandon')
 
-# Dictionnaire pour stocker les parties actives
-active_games = {}
+# Parties actives de ce worker, de la moins récemment utilisée à la plus récente
+active_games = OrderedDict()
+games_lock = threading.Lock()
+_socketio = None
+# Un verrou par partie : coups reçus en direct et relayés par d'autres workers
+game_locks = {}
+game_locks_lock = threading.Lock()
+
+# Budget mémoire : nombre de parties gardées en mémoire, et inactivité (s)
+# au-delà de laquelle une partie peut être mise sur disque
+ACTIVE_GAMES_BUDGET = int(os.environ.get('ACTIVE_GAMES_BUDGET', 10000))
+IDLE_SECONDS = int(os.environ.get('IDLE_SECONDS', 300))
+
+def game_lock(game_uuid):
+    """Sérialise les modifications d'une partie dans ce worker."""
+    with game_locks_lock:
+        return game_locks.setdefault(game_uuid, threading.Lock())
+
+def _track(game):
+    with games_lock:
+        active_games[game.game_uuid] = game
+
+def adopt_game(data):
+    """Reprend une partie cédée par un autre worker et relance sa pendule."""
+    game = ChessGame.from_state(data)
+    _track(game)
+    if not game.game_over:
+        game.schedule_flag()
+    return game
+
+def release_game(game_uuid):
+    """Retire une partie de ce worker (en mémoire ou sur disque) et renvoie son état, pour la céder."""
+    with games_lock:
+        game = active_games.pop(game_uuid, None)
+    if game is not None:
+        state = game.to_state()
+    else:
+        state = game_store.load(game_uuid)
+        if state is None:
+            return None
+    game_store.discard(game_uuid)
+    flag_scheduler.cancel(game_uuid)
+    move_log.close(game_uuid)
+    return state
+
+def owned_games():
+    """Parties de ce worker, y compris celles mises sur disque."""
+    with games_lock:
+        uuids = list(active_games)
+    return uuids + game_store.list()
 
 def create_game(game_uuid, white_player_id, black_player_id):
     game = ChessGame(game_uuid, white_player_id, black_player_id)
-    active_games[game_uuid] = game
+    _track(game)
+    game.schedule_flag()
+    return game
+
+def create_games(pairs):
+    """Crée d'un coup les parties d'une ronde de tournoi, (game_uuid, blancs, noirs)."""
+    games = [ChessGame(game_uuid, white_id, black_id) for game_uuid, white_id, black_id in pairs]
+    with games_lock:
+        for game in games:
+            active_games[game.game_uuid] = game
+    for game in games:
+        game.schedule_flag()
+    return games
+
+def restore_game(game_uuid, white_player_id, black_player_id):
+    """Reconstruit une partie en cours depuis son dernier instantané et la fin du journal."""
+    if not move_log.exists(game_uuid) or game_uuid in active_games:
+        return None
+    snapshot, moves = move_log.load(game_uuid)
+    game = ChessGame(game_uuid, white_player_id, black_player_id)
+    if snapshot:
+        game.board = chess.Board(snapshot['fen'])
+        game.zobrist = zobrist_key(game.board)
+        game.recent = array('Q', [game.zobrist])
+        # Coups antérieurs à l'instantané : repris de l'instantané, sans être rejoués
+        if 'moves' in snapshot:
+            game.moves = array('H', base64.b64decode(snapshot['moves']))
+        else:
+            # Instantané d'une version précédente, sans les coups : relus dans le journal
+            history = move_log.history(game_uuid)[:snapshot['ply']]
+            game.moves = array('H', (encode_move(chess.Move.from_uci(uci)) for uci in history))
+        game.white_time, game.black_time, game.running = snapshot['white'], snapshot['black'], snapshot['running']
+    for move in moves:
+        game.play(chess.Move.from_uci(move['uci']))
+        game.white_time, game.black_time, game.running = move['white'], move['black'], move['running']
+    game.game_over = game.board.is_game_over()
+    game.seq = game.board.ply()
+    # Le temps d'indisponibilité du serveur n'est décompté à personne
+    game.clock_started = time.time()
+    game_store.discard(game_uuid)
+    _track(game)
+    if not game.game_over:
+        game.schedule_flag()
     return game
 
 def get_game(game_uuid):
-    return active_games.get(game_uuid)
+    """Partie de ce worker ; une partie mise sur disque est rechargée de façon transparente."""
+    with games_lock:
+        game = active_games.get(game_uuid)
+        if game is not None:
+            active_games.move_to_end(game_uuid)
+            game.last_active = time.time()
+            return game
+    state = game_store.load(game_uuid)
+    if state is None:
+        return None
+    game = ChessGame.from_state(state)
+    with games_lock:
+        # Un autre thread a pu la recharger entre-temps
+        game = active_games.setdefault(game_uuid, game)
+    game_store.discard(game_uuid)
+    log.debug('Partie rechargée depuis le disque', game_uuid=game_uuid)
+    return game
 
-def remove_game(game_uuid):
-    if game_uuid in active_games:
-        del active_games[game_uuid]
+def game_exists(game_uuid):
+    """Partie vivante sur ce worker, en mémoire ou sur disque, sans la recharger."""
+    with games_lock:
+        if game_uuid in active_games:
+            return True
+    return game_store.exists(game_uuid)
 
-def init_socketio(socketio):
-    @socketio.on('join_game')
-    def handle_join_game(data):
-        game_uuid = data['game_uuid']
-        game = get_game(game_uuid)
-        if game:
-            game.emit_game_state()
-            return {'status': 'success'}
-        return {'status': 'error', 'message': 'Partie non trouvée'}
-
-    @socketio.on('make_move')
-    def handle_make_move(data):
-        game_uuid = data['game_uuid']
-        move_uci = data['move']
+def evict_game(game_uuid):
+    """Met une partie inactive sur disque ; sa pendule reste programmée."""
+    lock = game_lock(game_uuid)
+    # Une partie en train de jouer un coup n'est pas inactive : on la laisse
+    if not lock.acquire(blocking=False):
+        return False
+    try:
+        with games_lock:
+            game = active_games.get(game_uuid)
+        if game is None:
+            return False
+        game_store.save(game_uuid, game.to_state())
+        with games_lock:
+            active_games.pop(game_uuid, None)
+        move_log.close(game_uuid)
+        return True
+    finally:
+        lock.release()
+
+def handle_flag(game_uuid):
+    with game_lock(game_uuid):
         game = get_game(game_uuid)
         if game:
-            success, message = game.make_move(data['player_id'], move_uci)
-            return {'status': 'success' if success else 'error', 'message': message}
-        return {'status': 'error', 'message': 'Partie non trouvée'}
+            game.check_flag()
+
+# Un seul ordonnanceur pour les pendules de toutes les parties
+flag_scheduler = FlagScheduler(on_flag=handle_flag)
+
+def remove_game(game_uuid):
+    with games_lock:
+        active_games.pop(game_uuid, None)
+    game_store.discard(game_uuid)
+    move_log.close(game_uuid)
+    with game_locks_lock:
+        game_locks.pop(game_uuid, None)
+
+def reap_finished_games(grace):
+    """Retire de la mémoire les parties terminées depuis plus de `grace` secondes."""
+    cutoff = time.time() - grace
+    with games_lock:
+        finished = [game_uuid for game_uuid, game in active_games.items()
+                    if game.result is not None and game.result['finished_at'] < cutoff]
+    for game_uuid in finished:
+        remove_game(game_uuid)
+    return len(finished)
+
+
+class IdleEvictor:
+    """Tient le nombre de parties en mémoire sous le budget du worker.
+
+    Au-delà du budget, les parties les moins récemment utilisées et inactives
+    depuis IDLE_SECONDS sont écrites sur disque, puis rechargées par get_game
+    au prochain join_game ou make_move.
+    """
+
+    def __init__(self, budget=ACTIVE_GAMES_BUDGET, idle_seconds=IDLE_SECONDS, interval=5):
+        self.budget = budget
+        self.idle_seconds = idle_seconds
+        self.interval = interval
+        self.evicted = 0
+        self._started = False
+
+    def sweep(self):
+        excess = len(active_games) - self.budget
+        if excess <= 0:
+            return 0
+        cutoff = time.time() - self.idle_seconds
+        with games_lock:
+            candidates = []
+            for game_uuid, game in active_games.items():
+                if len(candidates) >= excess or game.last_active > cutoff:
+                    # Ordre LRU : les suivantes ont servi plus récemment
+                    break
+                candidates.append(game_uuid)
+        count = sum(1 for game_uuid in candidates if evict_game(game_uuid))
+        self.evicted += count
+        if count:
+            log.info('Parties inactives mises sur disque', count=count, in_memory=len(active_games))
+        return count
+
+    def _run(self, sleep):
+        while True:
+            try:
+                self.sweep()
+            except Exception:
+                log.exception('Erreur de mise sur disque des parties inactives')
+            sleep(self.interval)
+
+    def start(self, socketio=None):
+        if self._started:
+            return
+        self._started = True
+        if socketio is not None:
+            socketio.start_background_task(self._run, socketio.sleep)
+        else:
+            threading.Thread(target=self._run, args=(time.sleep,), daemon=True).start()
+
+
+idle_evictor = IdleEvictor()
+
+def init_socketio(socketio):
+    """Serveur Socket.IO utilisé par les parties pour diffuser leur état ; les événements
+    des joueurs (join_game, make_move) sont traités par app.py, via le routeur."""
+    global _socketio
+    _socketio = socketio
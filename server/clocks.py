@@ -0,0 +1,79 @@
+import heapq
+import threading
+import time
+from logs import get_logger
+
+log = get_logger('clocks')
+
+
+class FlagScheduler:
+    """Échéances des pendules de toutes les parties, dans un seul tas.
+
+    Chaque coup reprogramme l'échéance de la partie en O(log n) ; l'ancienne
+    entrée reste dans le tas mais est ignorée grâce à son numéro de version.
+    Un unique thread attend la prochaine échéance et appelle `on_flag`.
+    """
+
+    def __init__(self, on_flag):
+        self.on_flag = on_flag
+        self.heap = []
+        self.versions = {}
+        self.condition = threading.Condition()
+        self._started = False
+
+    def __len__(self):
+        return len(self.versions)
+
+    def schedule(self, game_uuid, deadline):
+        with self.condition:
+            version = self.versions.get(game_uuid, 0) + 1
+            self.versions[game_uuid] = version
+            heapq.heappush(self.heap, (deadline, game_uuid, version))
+            if len(self.heap) > 2 * len(self.versions) + 64:
+                self._compact()
+            if self.heap[0][1] == game_uuid:
+                self.condition.notify()
+
+    def cancel(self, game_uuid):
+        with self.condition:
+            self.versions.pop(game_uuid, None)
+
+    def _compact(self):
+        self.heap = [entry for entry in self.heap if self.versions.get(entry[1]) == entry[2]]
+        heapq.heapify(self.heap)
+
+    def _next_due(self):
+        """Attend la prochaine échéance valide et la retire du tas."""
+        with self.condition:
+            while True:
+                if not self.heap:
+                    self.condition.wait()
+                    continue
+                deadline, game_uuid, version = self.heap[0]
+                if self.versions.get(game_uuid) != version:
+                    heapq.heappop(self.heap)
+                    continue
+                delay = deadline - time.time()
+                if delay > 0:
+                    self.condition.wait(delay)
+                    continue
+                heapq.heappop(self.heap)
+                del self.versions[game_uuid]
+                return game_uuid
+
+    def _run(self):
+        while True:
+            game_uuid = self._next_due()
+            try:
+                self.on_flag(game_uuid)
+            except Exception:
+                log.exception('Chute du drapeau', game_uuid=game_uuid)
+
+    def start(self, socketio=None):
+        if self._started:
+            return
+        self._started = True
+        if socketio is not None:
+            socketio.start_background_task(self._run)
+        else:
+            threading.Thread(target=self._run, daemon=True).start()
@@ -0,0 +1,59 @@
+import contextvars
+import multiprocessing
+import os
+
+# Mode du serveur Socket.IO : 'threading' (un thread système par connexion, par
+# défaut), 'eventlet' ou 'gevent' (threads verts : des milliers de connexions
+# WebSocket par processus ; paquets optionnels eventlet, ou gevent et
+# gevent-websocket). À importer avant tout autre module.
+ASYNC_MODE = os.environ.get('ASYNC_MODE', 'threading')
+
+if ASYNC_MODE == 'eventlet':
+    import eventlet
+    import eventlet.debug
+    eventlet.monkey_patch()
+    # Le thread de gestion d'un pool de processus et multiprocessing (au lancement
+    # d'un processus) attendent tous deux la fin des processus du pool
+    eventlet.debug.hub_prevent_multiple_readers(False)
+elif ASYNC_MODE == 'gevent':
+    from gevent import monkey
+    monkey.patch_all()
+
+# Après le patch : les files et connexions des pools de processus attendent sans
+# bloquer la boucle des threads verts
+from concurrent.futures import ProcessPoolExecutor  # noqa: E402
+
+
+# Vrai dans un appel déjà confié à un thread système : les appels imbriqués
+# (commit qui déclenche un flush) s'y exécutent directement
+_offloaded = contextvars.ContextVar('offloaded', default=False)
+
+
+def _offload(fn, *args):
+    _offloaded.set(True)
+    return fn(*args)
+
+
+def run_blocking(fn, *args):
+    """Exécute un appel bloquant (hachage de mot de passe, écriture en base) dans
+    un thread système, pour ne pas bloquer la boucle des threads verts."""
+    if ASYNC_MODE == 'threading' or _offloaded.get():
+        return fn(*args)
+    if ASYNC_MODE == 'eventlet':
+        from eventlet import tpool
+        return tpool.execute(contextvars.copy_context().run, _offload, fn, *args)
+    from gevent import get_hub
+    return get_hub().threadpool.apply(contextvars.copy_context().run, (_offload, fn, *args))
+
+
+# Modules importés une fois par le serveur forkserver, dont héritent les processus des pools
+FORKSERVER_PRELOAD = ['chess', 'werkzeug.security']
+
+
+def process_pool(workers, initializer=None, initargs=()):
+    """Pool de processus (hachage, analyse) créés par un serveur forkserver : ses
+    processus ne copient ni la boucle eventlet/gevent ni les verrous des threads
+    du serveur. À arrêter par son propriétaire, à la sortie au plus tard."""
+    context = multiprocessing.get_context('forkserver')
+    context.set_forkserver_preload(FORKSERVER_PRELOAD)
+    return ProcessPoolExecutor(workers, mp_context=context, initializer=initializer, initargs=initargs)
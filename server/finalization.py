@@ -0,0 +1,63 @@
+import queue
+import threading
+import time
+from logs import get_logger
+
+log = get_logger('finalization')
+
+MAX_ATTEMPTS = 5
+RETRY_DELAY = 0.5  # secondes, doublé à chaque nouvel essai
+
+
+class Finalizer:
+    """File de traitement des fins de partie, exécutée hors des handlers Socket.IO.
+
+    Chaque résultat passe par les étapes enregistrées avec `register`, dans
+    l'ordre ; une étape en échec est retentée avant de passer à la suivante.
+    """
+
+    def __init__(self, max_attempts=MAX_ATTEMPTS, retry_delay=RETRY_DELAY):
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.stages = []
+        self.jobs = queue.Queue()
+        self._started = False
+
+    def register(self, stage):
+        self.stages.append(stage)
+        return stage
+
+    def submit(self, result):
+        self.jobs.put(result)
+
+    def _process(self, result, sleep):
+        for stage in self.stages:
+            for attempt in range(1, self.max_attempts + 1):
+                try:
+                    stage(result)
+                    break
+                except Exception:
+                    log.exception('Finalisation', game_uuid=result.get('game_uuid'), stage=stage.__name__,
+                                  attempt=attempt)
+                    if attempt < self.max_attempts:
+                        sleep(self.retry_delay * 2 ** (attempt - 1))
+
+    def _run(self, sleep):
+        while True:
+            result = self.jobs.get()
+            try:
+                self._process(result, sleep)
+            finally:
+                self.jobs.task_done()
+
+    def start(self, socketio=None):
+        if self._started:
+            return
+        self._started = True
+        if socketio is not None:
+            socketio.start_background_task(self._run, socketio.sleep)
+        else:
+            threading.Thread(target=self._run, args=(time.sleep,), daemon=True).start()
+
+
+finalizer = Finalizer()
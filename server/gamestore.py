@@ -0,0 +1,46 @@
+import json
+import os
+
+# Parties inactives sorties de la mémoire : un fichier JSON par partie
+GAMESTORE_DIR = os.environ.get('CHESS_IDLE_DIR', 'idle_games')
+
+
+class GameStore:
+    def __init__(self, directory=GAMESTORE_DIR):
+        self.directory = directory
+
+    def _path(self, game_uuid):
+        return os.path.join(self.directory, f'{game_uuid}.json')
+
+    def save(self, game_uuid, state):
+        # Écriture atomique, comme les instantanés du journal des coups
+        os.makedirs(self.directory, exist_ok=True)
+        path = self._path(game_uuid)
+        with open(path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(state, f)
+        os.replace(path + '.tmp', path)
+
+    def load(self, game_uuid):
+        try:
+            with open(self._path(game_uuid), encoding='utf-8') as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def discard(self, game_uuid):
+        try:
+            os.remove(self._path(game_uuid))
+        except FileNotFoundError:
+            pass
+
+    def list(self):
+        try:
+            return [name[:-5] for name in os.listdir(self.directory) if name.endswith('.json')]
+        except FileNotFoundError:
+            return []
+
+    def exists(self, game_uuid):
+        return os.path.exists(self._path(game_uuid))
+
+
+game_store = GameStore()
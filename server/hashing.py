@@ -0,0 +1,73 @@
+import atexit
+import os
+import threading
+from werkzeug.security import check_password_hash, generate_password_hash
+from concurrency import process_pool, run_blocking
+from metrics import registry
+
+# Processus dédiés au hachage des mots de passe (0 : dans le processus du serveur)
+# et nombre maximal de hachages en cours ou en attente
+PASSWORD_WORKERS = int(os.environ.get('PASSWORD_WORKERS', min(os.cpu_count() or 1, 4)))
+HASH_QUEUE_LIMIT = int(os.environ.get('HASH_QUEUE_LIMIT', 32))
+
+
+class HasherBusy(Exception):
+    """File de hachage pleine : la demande est refusée tout de suite plutôt que mise en attente."""
+
+
+class PasswordHasher:
+    """Hachage et vérification des mots de passe (scrypt/pbkdf2) hors du processus du serveur.
+
+    Un pic de connexions occupe les processus du pool et non celui qui sert
+    les parties ; au-delà de `queue_limit` demandes en cours, les suivantes
+    sont rejetées avec HasherBusy. Le pool est créé au premier hachage.
+    """
+
+    def __init__(self, workers=PASSWORD_WORKERS, queue_limit=HASH_QUEUE_LIMIT):
+        self.workers = workers
+        self.queue_limit = queue_limit
+        self.pending = 0
+        self.rejected = 0
+        self.lock = threading.Lock()
+        self.pool = None
+
+    def _pool(self):
+        with self.lock:
+            if self.pool is None:
+                self.pool = process_pool(self.workers)
+                atexit.register(self.shutdown)
+            return self.pool
+
+    def shutdown(self):
+        with self.lock:
+            pool, self.pool = self.pool, None
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
+
+    def _run(self, fn, *args):
+        with self.lock:
+            if self.pending >= self.queue_limit:
+                self.rejected += 1
+                raise HasherBusy()
+            self.pending += 1
+        try:
+            if self.workers <= 0:
+                return run_blocking(fn, *args)
+            return self._pool().submit(fn, *args).result()
+        finally:
+            with self.lock:
+                self.pending -= 1
+
+    def hash(self, password):
+        return self._run(generate_password_hash, password)
+
+    def verify(self, password_hash, password):
+        return self._run(check_password_hash, password_hash, password)
+
+
+password_hasher = PasswordHasher()
+
+registry.gauge('chess_password_hash_pending', 'Hachages de mots de passe en cours ou en attente',
+               callback=lambda: password_hasher.pending)
+registry.counter('chess_password_hash_rejected', 'Demandes refusées, file de hachage pleine',
+                 callback=lambda: password_hasher.rejected)
@@ -0,0 +1,79 @@
+import bisect
+import threading
+import uuid
+
+PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+
+class LobbySnapshot:
+    """Liste des parties en attente, gardée en mémoire entre deux invalidations.
+
+    `loader()` renvoie les parties triées par (created_at, id), chacune avec
+    au moins 'id', 'game_type' et 'created_at' (ISO 8601). La version change à
+    chaque invalidation et sert d'ETag ; avec un backend d'état partagé, elle
+    y est conservée pour que l'invalidation atteigne tous les workers.
+
+    Le compteur repart de zéro avec le processus (ou le backend) : la version
+    est préfixée d'un jeton tiré au démarrage, gardé dans le backend s'il y en
+    a un, pour qu'un ETag d'avant le redémarrage ne soit jamais reconnu.
+    """
+
+    def __init__(self, loader, backend=None):
+        self.loader = loader
+        self.backend = backend
+        self.version = 0
+        self.token = None if backend else uuid.uuid4().hex[:8]
+        self.lock = threading.Lock()
+        self._views = None
+
+    def _shared_token(self):
+        token = self.backend.hget('lobby', 'token')
+        if token is None:
+            self.backend.hset('lobby', 'token', uuid.uuid4().hex[:8])
+            # Relu : si deux workers démarrent ensemble, le dernier écrit l'emporte pour tous
+            token = self.backend.hget('lobby', 'token')
+        return token
+
+    def invalidate(self):
+        with self.lock:
+            self.version = self.backend.hincr('lobby', 'version') if self.backend else self.version + 1
+            self._views = None
+
+    def _load(self):
+        with self.lock:
+            if self.backend:
+                if self.token is None:
+                    self.token = self._shared_token()
+                version = self.backend.hget('lobby', 'version') or 0
+                if version != self.version:
+                    self.version = version
+                    self._views = None
+            if self._views is None:
+                games = self.loader()
+                views = {None: games}
+                for game in games:
+                    views.setdefault(game['game_type'], []).append(game)
+                # Clés de tri par vue, pour reprendre après un curseur par dichotomie
+                self._views = {game_type: (items, [(game['created_at'], game['id']) for game in items])
+                               for game_type, items in views.items()}
+            return self._views, f'{self.token}.{self.version}'
+
+    def page(self, game_type=None, cursor=None, limit=PAGE_SIZE):
+        """Renvoie (parties, curseur suivant ou None, version préfixée du jeton de démarrage)."""
+        views, version = self._load()
+        items, keys = views.get(game_type, ([], []))
+        start = bisect.bisect_right(keys, decode_cursor(cursor)) if cursor else 0
+        limit = max(1, min(limit, MAX_PAGE_SIZE))
+        games = items[start:start + limit]
+        next_cursor = encode_cursor(games[-1]) if start + limit < len(items) else None
+        return games, next_cursor, version
+
+
+def encode_cursor(game):
+    return f"{game['created_at']}|{game['id']}"
+
+
+def decode_cursor(cursor):
+    created_at, _, game_id = cursor.rpartition('|')
+    return created_at, int(game_id)
@@ -0,0 +1,104 @@
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+from datetime import datetime, UTC
+
+# Niveau (DEBUG, INFO, WARNING, ERROR) et format ('json' ou 'text') des journaux
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
+LOG_FORMAT = os.environ.get('LOG_FORMAT', 'json')
+
+
+class JsonFormatter(logging.Formatter):
+    """Une ligne JSON par événement : horodatage, niveau, module, message et champs."""
+
+    def format(self, record):
+        entry = {
+            'ts': datetime.fromtimestamp(record.created, UTC).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        entry.update(getattr(record, 'fields', {}))
+        if record.exc_text:
+            entry['exception'] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    def format(self, record):
+        fields = ' '.join(f'{key}={value}' for key, value in getattr(record, 'fields', {}).items())
+        line = f'[{record.levelname}] {record.name}: {record.getMessage()}'
+        line = f'{line} {fields}' if fields else line
+        return f'{line}\n{record.exc_text}' if record.exc_text else line
+
+
+class RecordQueueHandler(logging.handlers.QueueHandler):
+    """Met en file l'enregistrement avec ses champs ; la trace d'une exception
+    est rendue tout de suite, tant que l'objet exception est disponible."""
+
+    def prepare(self, record):
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+class Logger:
+    """Journal structuré : `log.info('message', game_uuid=..., move=...)`.
+
+    Le niveau est testé avant de construire l'enregistrement, si bien qu'un
+    appel sous le niveau actif (les DEBUG du chemin des coups) ne coûte presque rien.
+    """
+
+    def __init__(self, name):
+        self.logger = logging.getLogger(f'chess.{name}')
+
+    def _log(self, level, message, fields, exc_info=False):
+        if self.logger.isEnabledFor(level):
+            self.logger.log(level, message, exc_info=exc_info, extra={'fields': fields})
+
+    def debug(self, message, **fields):
+        self._log(logging.DEBUG, message, fields)
+
+    def info(self, message, **fields):
+        self._log(logging.INFO, message, fields)
+
+    def warning(self, message, **fields):
+        self._log(logging.WARNING, message, fields)
+
+    def error(self, message, **fields):
+        self._log(logging.ERROR, message, fields)
+
+    def exception(self, message, **fields):
+        self._log(logging.ERROR, message, fields, exc_info=True)
+
+
+def get_logger(name):
+    return Logger(name)
+
+
+_listener = None
+
+
+def configure(level=LOG_LEVEL, fmt=LOG_FORMAT):
+    """Les appels de journal ne font qu'empiler l'enregistrement ; l'écriture sur
+    la sortie standard se fait dans le thread du QueueListener."""
+    global _listener
+    if _listener is not None:
+        return
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(JsonFormatter() if fmt == 'json' else TextFormatter())
+    records = queue.SimpleQueue()
+    root = logging.getLogger('chess')
+    root.setLevel(level)
+    root.addHandler(RecordQueueHandler(records))
+    root.propagate = False
+    _listener = logging.handlers.QueueListener(records, handler)
+    _listener.start()
+    atexit.register(_listener.stop)
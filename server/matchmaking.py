@@ -0,0 +1,360 @@
+import bisect
+import itertools
+import threading
+import time
+import uuid
+from datetime import datetime, UTC
+from logs import get_logger
+from metrics import matchmaking_wait_seconds
+
+log = get_logger('matchmaking')
+
+# Fenêtre ELO acceptable pour le mode classé : elle s'élargit avec le temps d'attente
+ELO_WINDOW_BASE = 200
+ELO_WINDOW_GROWTH = 10  # points ELO supplémentaires par seconde d'attente
+ELO_WINDOW_MAX = 1000
+
+MATCHMAKING_INTERVAL = 0.5  # secondes entre deux cycles d'appariement
+
+
+def elo_window(entry, now):
+    """Écart ELO accepté pour un joueur, selon son temps d'attente."""
+    waited = (now - entry['timestamp']).total_seconds()
+    return min(ELO_WINDOW_BASE + ELO_WINDOW_GROWTH * max(waited, 0), ELO_WINDOW_MAX)
+
+
+class FifoQueue:
+    """File d'attente du mode décontracté : premier arrivé, premier servi."""
+
+    def __init__(self):
+        self._entries = {}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, user_id):
+        return user_id in self._entries
+
+    def add(self, entry):
+        self._entries[entry['id']] = entry
+        return len(self._entries)
+
+    def remove(self, user_id):
+        return self._entries.pop(user_id, None)
+
+    def position(self, user_id):
+        if user_id not in self._entries:
+            return None
+        return next(i for i, uid in enumerate(self._entries) if uid == user_id) + 1
+
+    def pop_pairs(self, now):
+        pairs = []
+        waiting = list(self._entries.values())
+        for player1, player2 in zip(waiting[0::2], waiting[1::2]):
+            del self._entries[player1['id']]
+            del self._entries[player2['id']]
+            pairs.append((player1, player2))
+        return pairs
+
+
+class RatingQueue(FifoQueue):
+    """File d'attente du mode classé, indexée par ELO.
+
+    Les joueurs sont gardés dans une liste triée par (elo, ordre d'arrivée) :
+    l'adversaire le plus proche se trouve par recherche dichotomique.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._sorted = []
+        self._keys = {}
+        self._seq = itertools.count()
+
+    def add(self, entry):
+        key = (entry['elo'], next(self._seq), entry['id'])
+        self._keys[entry['id']] = key
+        bisect.insort(self._sorted, key)
+        return super().add(entry)
+
+    def remove(self, user_id):
+        key = self._keys.pop(user_id, None)
+        if key is None:
+            return None
+        index = bisect.bisect_left(self._sorted, key)
+        del self._sorted[index]
+        return super().remove(user_id)
+
+    def _nearest(self, user_id):
+        key = self._keys[user_id]
+        index = bisect.bisect_left(self._sorted, key)
+        neighbours = []
+        if index > 0:
+            neighbours.append(self._sorted[index - 1])
+        if index + 1 < len(self._sorted):
+            neighbours.append(self._sorted[index + 1])
+        if not neighbours:
+            return None
+        return min(neighbours, key=lambda other: abs(other[0] - key[0]))
+
+    def pop_pairs(self, now):
+        pairs = []
+        # Les joueurs qui attendent depuis le plus longtemps sont servis en premier
+        for entry in list(self._entries.values()):
+            if entry['id'] not in self._entries:
+                continue
+            nearest = self._nearest(entry['id'])
+            if nearest is None:
+                break
+            opponent = self._entries[nearest[2]]
+            gap = abs(opponent['elo'] - entry['elo'])
+            if gap <= min(elo_window(entry, now), elo_window(opponent, now)):
+                self.remove(entry['id'])
+                self.remove(opponent['id'])
+                pairs.append((entry, opponent))
+        return pairs
+
+
+def new_entry(user_id, username, elo, name=None, description=None):
+    return {
+        'id': user_id,
+        'username': username,
+        'elo': elo,
+        'timestamp': datetime.now(UTC),
+        'name': name or 'Partie d\'échecs',
+        'description': description or ''
+    }
+
+
+class Matchmaker:
+    """Files d'attente par type de partie et cycle d'appariement en arrière-plan.
+
+    `on_match(game_type, player1, player2)` est appelé hors du verrou pour
+    chaque paire trouvée ; player1 (le plus ancien dans la file) joue les blancs.
+    `on_queue_status(user_id, status)` reçoit, en fin de cycle, les positions
+    qui ont changé depuis la dernière notification.
+    """
+
+    def __init__(self, on_match, on_queue_status=None, interval=MATCHMAKING_INTERVAL):
+        self.on_match = on_match
+        self.on_queue_status = on_queue_status
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.queues = {'ranked': RatingQueue()}
+        self._started = False
+        self._dirty = False
+        self._reported = {}
+
+    def _queue(self, game_type):
+        if game_type not in self.queues:
+            self.queues[game_type] = FifoQueue()
+        return self.queues[game_type]
+
+    def enqueue(self, game_type, user_id, username, elo, name=None, description=None):
+        """Ajoute un joueur ; renvoie sa position, ou None s'il est déjà en file."""
+        return self.add_entry(game_type, new_entry(user_id, username, elo, name, description))
+
+    def add_entry(self, game_type, entry):
+        user_id = entry['id']
+        with self.lock:
+            queue = self._queue(game_type)
+            if user_id in queue:
+                return None
+            self._dirty = True
+            return queue.add(entry)
+
+    def cancel(self, game_type, user_id):
+        with self.lock:
+            self._dirty = True
+            return self._queue(game_type).remove(user_id)
+
+    def status(self, game_type, user_id):
+        with self.lock:
+            queue = self._queue(game_type)
+            return queue.position(user_id), len(queue)
+
+    def depths(self):
+        """Nombre de joueurs en file par type de partie."""
+        with self.lock:
+            return {game_type: len(queue) for game_type, queue in self.queues.items()}
+
+    def stale_entries(self, cutoff):
+        """Joueurs entrés en file avant `cutoff` : [(type de partie, user_id)]."""
+        with self.lock:
+            return [(game_type, user_id)
+                    for game_type, queue in self.queues.items()
+                    for user_id, entry in queue._entries.items()
+                    if entry['timestamp'] < cutoff]
+
+    def _changed_statuses(self):
+        """Positions modifiées depuis la dernière notification (verrou tenu)."""
+        current = {}
+        for game_type, queue in self.queues.items():
+            total = len(queue)
+            for position, user_id in enumerate(queue._entries, start=1):
+                current[(game_type, user_id)] = (position, total)
+
+        changed = [(key, value) for key, value in current.items()
+                   if self._reported.get(key) != value]
+        self._reported = current
+        self._dirty = False
+        return [(user_id, {
+            'game_type': game_type,
+            'in_queue': True,
+            'queue_position': position,
+            'total_players': total
+        }) for (game_type, user_id), (position, total) in changed]
+
+    def run_cycle(self):
+        now = datetime.now(UTC)
+        statuses = []
+        with self.lock:
+            matches = [(game_type, pair)
+                       for game_type, queue in self.queues.items()
+                       for pair in queue.pop_pairs(now)]
+            if self.on_queue_status and (matches or self._dirty):
+                statuses = self._changed_statuses()
+
+        for game_type, (player1, player2) in matches:
+            for player in (player1, player2):
+                matchmaking_wait_seconds.observe((now - player['timestamp']).total_seconds(), game_type)
+            try:
+                self.on_match(game_type, player1, player2)
+            except Exception:
+                log.exception('Création de la partie impossible', game_type=game_type)
+                # Remettre les joueurs en file avec leur ancienneté d'origine
+                with self.lock:
+                    queue = self._queue(game_type)
+                    for player in (player1, player2):
+                        if player['id'] not in queue:
+                            queue.add(player)
+                    self._dirty = True
+
+        for user_id, status in statuses:
+            self.on_queue_status(user_id, status)
+        return len(matches)
+
+    def _run(self, sleep):
+        while True:
+            try:
+                self.run_cycle()
+            except Exception:
+                log.exception('Cycle de matchmaking')
+            sleep(self.interval)
+
+    def start(self, socketio=None):
+        """Démarre le cycle d'appariement (tâche de fond Socket.IO si fournie)."""
+        if self._started:
+            return
+        self._started = True
+        if socketio is not None:
+            socketio.start_background_task(self._run, socketio.sleep)
+        else:
+            threading.Thread(target=self._run, args=(time.sleep,), daemon=True).start()
+
+
+class SharedMatchmaker(Matchmaker):
+    """Matchmaker réparti entre plusieurs workers.
+
+    Les joueurs en file sont conservés dans le backend d'état partagé et les
+    demandes (entrée, annulation) y sont publiées ; seul le worker qui détient
+    le bail `matchmaking:leader` tient les files en mémoire et apparie. Un
+    nouveau meneur reconstruit ses files depuis la liste des joueurs en file.
+    """
+
+    LEADER = 'matchmaking:leader'
+    INBOX = 'matchmaking:inbox'
+    STATUS = 'matchmaking:status'
+    TYPES = 'matchmaking:types'
+
+    def __init__(self, backend, on_match, on_queue_status=None, interval=MATCHMAKING_INTERVAL):
+        super().__init__(self._on_match, self._on_queue_status, interval)
+        self.backend = backend
+        self.match_callback = on_match
+        self.status_callback = on_queue_status
+        self.owner = uuid.uuid4().hex
+        self.leader = False
+
+    @staticmethod
+    def _members(game_type):
+        return f'matchmaking:{game_type}'
+
+    def enqueue(self, game_type, user_id, username, elo, name=None, description=None):
+        members = self._members(game_type)
+        if self.backend.hget(members, user_id) is not None:
+            return None
+        entry = new_entry(user_id, username, elo, name, description)
+        entry['timestamp'] = entry['timestamp'].isoformat()
+        self.backend.hset(self.TYPES, game_type, 1)
+        self.backend.hset(members, user_id, entry)
+        self.backend.rpush(self.INBOX, ['enqueue', game_type, entry])
+        return self.backend.hlen(members)
+
+    def cancel(self, game_type, user_id):
+        entry = self.backend.hdel(self._members(game_type), user_id)
+        self.backend.hdel(self.STATUS, f'{game_type}:{user_id}')
+        self.backend.rpush(self.INBOX, ['cancel', game_type, user_id])
+        return entry
+
+    def status(self, game_type, user_id):
+        members = self._members(game_type)
+        total = self.backend.hlen(members)
+        if self.backend.hget(members, user_id) is None:
+            return None, total
+        status = self.backend.hget(self.STATUS, f'{game_type}:{user_id}')
+        return (status['queue_position'] if status else total), total
+
+    def depths(self):
+        return {game_type: self.backend.hlen(self._members(game_type))
+                for game_type in self.backend.hgetall(self.TYPES)}
+
+    def stale_entries(self, cutoff):
+        cutoff = cutoff.isoformat()
+        return [(game_type, int(user_id))
+                for game_type in self.backend.hgetall(self.TYPES)
+                for user_id, entry in self.backend.hgetall(self._members(game_type)).items()
+                if entry['timestamp'] < cutoff]
+
+    def _load_members(self):
+        self.queues = {'ranked': RatingQueue()}
+        for game_type in self.backend.hgetall(self.TYPES):
+            entries = sorted(self.backend.hgetall(self._members(game_type)).values(),
+                             key=lambda entry: entry['timestamp'])
+            for entry in entries:
+                self._queue(game_type).add(dict(entry, timestamp=datetime.fromisoformat(entry['timestamp'])))
+        self._reported = {}
+        self._dirty = True
+
+    def run_cycle(self):
+        if not self.backend.lease(self.LEADER, self.owner, self.interval * 6):
+            if self.leader:
+                with self.lock:
+                    self.leader = False
+                    self.queues = {'ranked': RatingQueue()}
+            return 0
+
+        requests = self.backend.drain(self.INBOX)
+        with self.lock:
+            if not self.leader:
+                # Les demandes en attente sont déjà reflétées par les joueurs en file
+                self.leader = True
+                self._load_members()
+            else:
+                for action, game_type, payload in requests:
+                    queue = self._queue(game_type)
+                    if action == 'enqueue' and payload['id'] not in queue:
+                        queue.add(dict(payload, timestamp=datetime.fromisoformat(payload['timestamp'])))
+                    elif action == 'cancel':
+                        queue.remove(payload)
+                    self._dirty = True
+        return super().run_cycle()
+
+    def _on_match(self, game_type, player1, player2):
+        self.match_callback(game_type, player1, player2)
+        for player in (player1, player2):
+            self.backend.hdel(self._members(game_type), player['id'])
+            self.backend.hdel(self.STATUS, f"{game_type}:{player['id']}")
+
+    def _on_queue_status(self, user_id, status):
+        self.backend.hset(self.STATUS, f"{status['game_type']}:{user_id}", status)
+        if self.status_callback:
+            self.status_callback(user_id, status)
@@ -0,0 +1,162 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+
+# Bornes des histogrammes de durée, en secondes
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+# Attente en file de matchmaking : de la seconde à quelques minutes
+WAIT_BUCKETS = (0.5, 1, 2, 5, 10, 20, 30, 60, 120, 300, 600)
+
+
+def format_labels(names, values, extra=()):
+    pairs = [f'{name}="{value}"' for name, value in zip(names, values)] + list(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class Histogram:
+    """Histogramme cumulatif au format Prometheus ; observe() coûte une dichotomie et un verrou."""
+
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.buckets = tuple(buckets)
+        self.series = {}
+        self.lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            series = self.series.get(label_values)
+            if series is None:
+                series = self.series[label_values] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    @contextmanager
+    def time(self, *label_values):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, *label_values)
+
+    def samples(self):
+        with self.lock:
+            series = {labels: (list(counts), total) for labels, (counts, total) in self.series.items()}
+        for label_values, (counts, total) in sorted(series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += count
+                bucket = format_labels(self.labels, label_values, ['le="%s"' % bound])
+                yield f'{self.name}_bucket{bucket} {cumulative}'
+            yield f'{self.name}_sum{format_labels(self.labels, label_values)} {total}'
+            yield f'{self.name}_count{format_labels(self.labels, label_values)} {cumulative}'
+
+
+class Gauge:
+    """Valeur instantanée : tenue à jour par set/inc/dec, ou lue par `callback` au moment
+    de l'export (un nombre, ou un dict {valeurs des labels: nombre})."""
+
+    kind = 'gauge'
+
+    def __init__(self, name, documentation, labels=(), callback=None):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.callback = callback
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def set(self, value, *label_values):
+        with self.lock:
+            self.values[label_values] = value
+
+    def inc(self, *label_values, amount=1):
+        with self.lock:
+            self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def dec(self, *label_values, amount=1):
+        self.inc(*label_values, amount=-amount)
+
+    def samples(self):
+        if self.callback is not None:
+            values = self.callback()
+            if not isinstance(values, dict):
+                values = {(): values}
+        else:
+            with self.lock:
+                values = dict(self.values)
+        for label_values, value in sorted(values.items()):
+            if not isinstance(label_values, tuple):
+                label_values = (label_values,)
+            yield f'{self.name}{format_labels(self.labels, label_values)} {value}'
+
+
+class Counter(Gauge):
+    """Total qui ne fait que croître depuis le démarrage ; exporté avec le suffixe _total."""
+
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labels=(), callback=None):
+        if not name.endswith('_total'):
+            name += '_total'
+        super().__init__(name, documentation, labels, callback)
+
+    def set(self, value, *label_values):
+        raise TypeError('Un compteur ne peut pas être fixé')
+
+    def inc(self, *label_values, amount=1):
+        if amount < 0:
+            raise ValueError('Un compteur ne peut que croître')
+        super().inc(*label_values, amount=amount)
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = {}
+
+    def register(self, metric):
+        self.metrics[metric.name] = metric
+        return metric
+
+    def histogram(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, documentation, labels, buckets))
+
+    def gauge(self, name, documentation, labels=(), callback=None):
+        return self.register(Gauge(name, documentation, labels, callback))
+
+    def counter(self, name, documentation, labels=(), callback=None):
+        return self.register(Counter(name, documentation, labels, callback))
+
+    def render(self):
+        """Toutes les métriques au format texte d'exposition Prometheus (version 0.0.4)."""
+        lines = []
+        for metric in self.metrics.values():
+            try:
+                samples = list(metric.samples())
+            except Exception:
+                # Une jauge illisible ne doit pas priver l'export des autres métriques
+                continue
+            lines.append(f'# HELP {metric.name} {metric.documentation}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            lines.extend(samples)
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+move_validation_seconds = registry.histogram(
+    'chess_move_validation_seconds', 'Analyse et contrôle de légalité d\'un coup reçu')
+emit_seconds = registry.histogram(
+    'chess_emit_seconds', 'Durée des emits Socket.IO d\'une partie', labels=('event',))
+db_commit_seconds = registry.histogram(
+    'chess_db_commit_seconds', 'Durée des commits SQLAlchemy (flush compris)')
+matchmaking_wait_seconds = registry.histogram(
+    'chess_matchmaking_wait_seconds', 'Attente en file avant appariement', labels=('game_type',),
+    buckets=WAIT_BUCKETS)
+connected_sockets = registry.gauge(
+    'chess_connected_sockets', 'Connexions Socket.IO ouvertes sur ce worker', labels=('namespace',))
@@ -1,20 +1,2 @@
-from flask_login import UserMixin
-from werkzeug.security import generate_password_hash, check_password_hash
-from database import db
-
-class User(UserMixin, db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    username = db.Column(db.String(80), unique=True, nullable=False)
-    email = db.Column(db.String(120), unique=True, nullable=False)
-    password_hash = db.Column(db.String(128))
-    games_played = db.Column(db.Integer, default=0)
-    wins = db.Column(db.Integer, default=0)
-    losses = db.Column(db.Integer, default=0)
-    draws = db.Column(db.Integer, default=0)
-    elo_rating = db.Column(db.Integer, default=1000)  # Classement ELO pour le mode ranked
-
-    def set_password(self, password):
-        self.password_hash = generate_password_hash(password)
-
-    def check_password(self, password):
-        return check_password_hash(self.password_hash, password) 
\ No newline at end of file
+# Le modèle est défini une seule fois, dans database.py
+from database import User
@@ -0,0 +1,162 @@
+import base64
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+# Journal des coups des parties en cours : un fichier .log en ajout seul par
+# partie, et un instantané .snap (FEN, pendules et coups encodés) tous les
+# SNAPSHOT_EVERY coups. Seuls les journaux des MOVELOG_OPEN_FILES parties les plus
+# récemment jouées restent ouverts ; les autres sont rouverts au coup suivant.
+MOVELOG_DIR = os.environ.get('CHESS_MOVELOG_DIR', 'movelogs')
+SNAPSHOT_EVERY = 20
+MOVELOG_OPEN_FILES = int(os.environ.get('CHESS_MOVELOG_OPEN_FILES', 256))
+
+
+class MoveLog:
+    def __init__(self, directory=MOVELOG_DIR, snapshot_every=SNAPSHOT_EVERY, open_files=MOVELOG_OPEN_FILES):
+        self.directory = directory
+        self.snapshot_every = snapshot_every
+        self.open_files = open_files
+        self._files = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _path(self, game_uuid, extension):
+        return os.path.join(self.directory, f'{game_uuid}.{extension}')
+
+    def _file(self, game_uuid):
+        # Appelé sous self._lock : un fichier fermé par l'éviction n'est plus en cours d'écriture
+        handle = self._files.get(game_uuid)
+        if handle is not None:
+            self._files.move_to_end(game_uuid)
+            return handle
+        os.makedirs(self.directory, exist_ok=True)
+        handle = open(self._path(game_uuid, 'log'), 'a', encoding='utf-8')
+        self._files[game_uuid] = handle
+        while len(self._files) > self.open_files:
+            self._files.popitem(last=False)[1].close()
+        return handle
+
+    def append(self, game_uuid, ply, move_uci, white, black, running, fen=None, moves=None):
+        """Ajoute un coup accepté avec les pendules ; `fen` déclenche un instantané tous les N coups,
+        avec `moves` (coups encodés, array('H')) si fourni."""
+        line = json.dumps({
+            'ply': ply,
+            'uci': move_uci,
+            'white': white,
+            'black': black,
+            'running': running,
+            'ts': time.time()
+        }) + '\n'
+        with self._lock:
+            handle = self._file(game_uuid)
+            handle.write(line)
+            handle.flush()
+            offset = handle.tell()
+
+        if fen is not None and ply % self.snapshot_every == 0:
+            self.snapshot(game_uuid, ply, fen, white, black, running, offset, moves)
+
+    def snapshot(self, game_uuid, ply, fen, white, black, running, offset, moves=None):
+        # Le journal jusqu'à `offset` est sur disque avant l'instantané qui y renvoie
+        self._sync(self._path(game_uuid, 'log'))
+        # Écriture atomique : un instantané est soit l'ancien, soit le nouveau
+        path = self._path(game_uuid, 'snap')
+        data = {
+            'ply': ply,
+            'fen': fen,
+            'white': white,
+            'black': black,
+            'running': running,
+            'offset': offset
+        }
+        if moves is not None:
+            data['moves'] = base64.b64encode(moves.tobytes()).decode()
+        with open(path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(data, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(path + '.tmp', path)
+
+    @staticmethod
+    def _sync(path):
+        # Descripteur à part : celui du journal peut être fermé entre-temps par l'éviction
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def load(self, game_uuid):
+        """Renvoie (instantané ou None, coups postérieurs à l'instantané)."""
+        snapshot = None
+        try:
+            with open(self._path(game_uuid, 'snap'), encoding='utf-8') as f:
+                snapshot = json.load(f)
+        except (FileNotFoundError, ValueError):
+            pass
+
+        moves = []
+        try:
+            with open(self._path(game_uuid, 'log'), encoding='utf-8') as f:
+                if snapshot:
+                    f.seek(snapshot['offset'])
+                for line in f:
+                    try:
+                        moves.append(json.loads(line))
+                    except ValueError:
+                        # Dernière ligne tronquée par un arrêt brutal
+                        break
+        except FileNotFoundError:
+            pass
+
+        if snapshot:
+            moves = [move for move in moves if move['ply'] > snapshot['ply']]
+        return snapshot, moves
+
+    def entries(self, game_uuid):
+        """Tous les coups de la partie avec leurs pendules, dans l'ordre."""
+        moves = []
+        try:
+            with open(self._path(game_uuid, 'log'), encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        moves.append(json.loads(line))
+                    except ValueError:
+                        break
+        except FileNotFoundError:
+            pass
+        return moves
+
+    def history(self, game_uuid):
+        """Tous les coups de la partie en UCI, dans l'ordre."""
+        return [move['uci'] for move in self.entries(game_uuid)]
+
+    def exists(self, game_uuid):
+        return os.path.exists(self._path(game_uuid, 'log'))
+
+    def last_move_at(self, game_uuid):
+        """Horodatage (epoch) du dernier coup journalisé, ou None sans journal."""
+        try:
+            return os.path.getmtime(self._path(game_uuid, 'log'))
+        except FileNotFoundError:
+            return None
+
+    def close(self, game_uuid):
+        with self._lock:
+            handle = self._files.pop(game_uuid, None)
+        if handle:
+            handle.close()
+
+    def discard(self, game_uuid):
+        """Supprime le journal d'une partie archivée."""
+        self.close(game_uuid)
+        for extension in ('log', 'snap'):
+            try:
+                os.remove(self._path(game_uuid, extension))
+            except FileNotFoundError:
+                pass
+
+
+move_log = MoveLog()
@@ -0,0 +1,417 @@
+import fcntl
+import heapq
+import io
+import json
+import mmap
+import os
+import struct
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta, UTC
+
+import chess
+import chess.pgn
+from sqlalchemy import tuple_
+
+from logs import get_logger
+from metrics import registry
+from positions import decode_move, encode_move, push_move, zobrist_key
+
+log = get_logger('posindex')
+
+# Index des positions des parties archivées : segments triés en lecture seule
+# et manifeste (liste des segments + dernière partie indexée)
+POSITION_INDEX_DIR = os.environ.get('CHESS_POSITION_INDEX_DIR', 'position_index')
+POSITION_INDEX_INTERVAL = int(os.environ.get('POSITION_INDEX_INTERVAL', 60))
+# Parties lues par requête, parties par nouveau segment, et délai avant d'indexer une
+# partie archivée (une transaction plus lente ne passe pas sous le curseur)
+INDEX_BATCH = 500
+SEGMENT_GAMES = 2000
+INDEX_LAG = 60
+# Un segment est fusionné avec le précédent tant que celui-ci n'est pas MERGE_RATIO fois plus gros
+MERGE_RATIO = 4
+
+# Enregistrement de 16 octets : clé Zobrist, partie, coup joué ensuite (0 : dernière
+# position), résultat. Les segments sont triés par (clé, partie).
+RECORD = struct.Struct('<QIHBx')
+KEY = struct.Struct('<Q')
+NO_MOVE = 0
+RESULTS = ('white', 'black', 'draw')
+# Agrégats d'un segment (fichier .agg à côté du .idx), triés par (clé, coup) :
+# enregistrements par coup et par résultat, et sous le coup GAMES, parties
+# distinctes passées par la position. Une position jouée dans des milliers de
+# parties se lit ainsi en quelques enregistrements.
+AGGREGATE = struct.Struct('<QHIII')
+GAMES = 0xFFFF
+
+
+def aggregate(records):
+    """Agrégats (clé, coup, blancs, noirs, nulles) d'enregistrements triés par (clé, partie)."""
+    key, moves, games, last_game = None, {}, [0, 0, 0], None
+    for record_key, game_id, move, result in records:
+        if record_key != key:
+            if key is not None:
+                yield from _key_aggregates(key, moves, games)
+            key, moves, games, last_game = record_key, {}, [0, 0, 0], None
+        if game_id != last_game:
+            games[result] += 1
+            last_game = game_id
+        if move != NO_MOVE:
+            moves.setdefault(move, [0, 0, 0])[result] += 1
+    if key is not None:
+        yield from _key_aggregates(key, moves, games)
+
+
+def _key_aggregates(key, moves, games):
+    for move in sorted(moves):
+        yield (key, move, *moves[move])
+    yield (key, GAMES, *games)
+
+
+def aggregates_name(name):
+    return name[:-len('.idx')] + '.agg'
+
+
+def game_records(game_id, pgn, result):
+    """Enregistrements d'une partie : une position par demi-coup, plus la position finale."""
+    game = chess.pgn.read_game(io.StringIO(pgn))
+    if game is None:
+        return []
+    code = RESULTS.index(result)
+    board = game.board()
+    key = zobrist_key(board)
+    records = []
+    for move in game.mainline_moves():
+        records.append((key, game_id, encode_move(move), code))
+        key = push_move(board, move, key)
+    records.append((key, game_id, NO_MOVE, code))
+    return records
+
+
+class Segment:
+    """Segment ouvert en mmap ; recherche dichotomique sur la clé, sans rien charger."""
+
+    def __init__(self, path, record=RECORD):
+        self.record = record
+        self.file = open(path, 'rb')
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.count = len(self.map) // record.size
+        self.aggregates = None
+
+    def __len__(self):
+        return self.count
+
+    def _key(self, i):
+        return KEY.unpack_from(self.map, i * self.record.size)[0]
+
+    def _bound(self, key):
+        # Premier enregistrement dont la clé est >= key
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._key(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def _range(self, key):
+        lo = self._bound(key)
+        return lo, self._bound(key + 1) if key < 0xFFFFFFFFFFFFFFFF else self.count
+
+    def lookup(self, key):
+        lo, end = self._range(key)
+        return self.record.iter_unpack(self.map[lo * self.record.size:end * self.record.size])
+
+    def recent(self, key, limit):
+        """Les `limit` plus grands identifiants de parties passées par la position (les
+        enregistrements d'une clé sont triés par partie : lus depuis la fin)."""
+        lo, end = self._range(key)
+        games = []
+        for i in range(end - 1, lo - 1, -1):
+            game_id = RECORD.unpack_from(self.map, i * RECORD.size)[1]
+            if not games or games[-1] != game_id:
+                games.append(game_id)
+                if len(games) == limit:
+                    break
+        return games
+
+    def __iter__(self):
+        return self.record.iter_unpack(self.map)
+
+    def close(self):
+        if self.aggregates is not None:
+            self.aggregates.close()
+        self.map.close()
+        self.file.close()
+
+
+class PositionIndex:
+    """Index « parties passées par cette position », construit par ajouts successifs.
+
+    Chaque mise à jour écrit un nouveau segment trié avec les parties archivées
+    depuis la précédente ; les derniers segments sont ensuite fusionnés quand
+    ils ont une taille comparable, si bien qu'il en reste O(log n) et qu'aucune
+    reconstruction complète n'est jamais nécessaire. Un seul processus écrit à
+    la fois (verrou fcntl) ; les lecteurs rechargent le manifeste s'il a changé.
+    """
+
+    def __init__(self, directory=POSITION_INDEX_DIR):
+        self.directory = directory
+        self.lock = threading.Lock()
+        self.segments = {}
+        self.manifest = {'segments': [], 'watermark': None, 'next': 0}
+        self.manifest_mtime = None
+        self.app = None
+        self._started = False
+
+    def init_app(self, app, db, game_model):
+        self.app = app
+        self.db = db
+        self.game_model = game_model
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    # -- lecture --
+
+    def _refresh(self):
+        try:
+            mtime = os.stat(self._path('manifest.json')).st_mtime_ns
+        except FileNotFoundError:
+            return
+        if mtime == self.manifest_mtime:
+            return
+        with open(self._path('manifest.json'), encoding='utf-8') as f:
+            manifest = json.load(f)
+        for name in manifest['segments']:
+            if name not in self.segments:
+                try:
+                    segment = Segment(self._path(name))
+                except FileNotFoundError:
+                    # Segment fusionné entre-temps : le manifeste suivant le remplace
+                    return self._refresh()
+                try:
+                    segment.aggregates = Segment(self._path(aggregates_name(name)), AGGREGATE)
+                except FileNotFoundError:
+                    # Segment d'une version précédente : ses enregistrements sont parcourus
+                    pass
+                self.segments[name] = segment
+        for name in set(self.segments) - set(manifest['segments']):
+            self.segments.pop(name).close()
+        self.manifest = manifest
+        self.manifest_mtime = mtime
+
+    def lookup(self, board, limit=20):
+        """Parties passées par la position de `board` : coups joués ensuite avec leurs
+        résultats, et identifiants des `limit` parties les plus récentes."""
+        key = zobrist_key(board)
+        moves = defaultdict(lambda: [0, 0, 0])
+        totals = [0, 0, 0]
+        recent = []
+        with self.lock:
+            self._refresh()
+            for name in self.manifest['segments']:
+                segment = self.segments[name]
+                # Chaque partie est dans un seul segment : les agrégats s'additionnent ;
+                # ceux d'un segment d'une version précédente sont calculés ici
+                sums = (segment.aggregates.lookup(key) if segment.aggregates is not None
+                        else aggregate(segment.lookup(key)))
+                for _, move, *counts in sums:
+                    target = totals if move == GAMES else moves[move]
+                    for result, count in enumerate(counts):
+                        target[result] += count
+                recent += segment.recent(key, limit)
+
+        next_moves = []
+        for code, counts in moves.items():
+            move = decode_move(code)
+            next_moves.append({
+                'uci': move.uci(),
+                'san': board.san(move) if board.is_legal(move) else move.uci(),
+                'games': sum(counts),
+                **dict(zip(RESULTS, counts)),
+            })
+        next_moves.sort(key=lambda entry: -entry['games'])
+        return {
+            'games': sum(totals),
+            **dict(zip(RESULTS, totals)),
+            'moves': next_moves,
+            'recent': heapq.nlargest(limit, recent),
+        }
+
+    def stats(self):
+        with self.lock:
+            self._refresh()
+            return sum(len(self.segments[name]) for name in self.manifest['segments'])
+
+    # -- écriture --
+
+    def _write_manifest(self, manifest):
+        path = self._path('manifest.json')
+        with open(path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(manifest, f)
+        os.replace(path + '.tmp', path)
+
+    def _write_file(self, path, record, records, sleep=None):
+        with open(path + '.tmp', 'wb') as f:
+            buffer = bytearray()
+            for values in records:
+                buffer += record.pack(*values)
+                if len(buffer) >= 1 << 20:
+                    f.write(buffer)
+                    buffer.clear()
+                    if sleep is not None:
+                        sleep(0)
+            f.write(buffer)
+        os.replace(path + '.tmp', path)
+
+    def _write_segment(self, manifest, records, sleep=None):
+        name = f"seg-{manifest['next']:08d}.idx"
+        manifest['next'] += 1
+        self._write_file(self._path(name), RECORD, records, sleep)
+        self._write_aggregates(name, sleep)
+        return name
+
+    def _write_aggregates(self, name, sleep=None):
+        # Relu depuis le segment écrit : une clé présente dans toutes les parties
+        # n'est jamais chargée en entier
+        segment = Segment(self._path(name))
+        try:
+            self._write_file(self._path(aggregates_name(name)), AGGREGATE, aggregate(segment), sleep)
+        finally:
+            segment.close()
+
+    def _merge_tail(self, manifest, sleep=None):
+        """Fusionne les derniers segments de taille comparable, par fusion des fichiers triés."""
+        merged = []
+        segments = manifest['segments']
+        while len(segments) > 1:
+            older, newer = (os.path.getsize(self._path(name)) for name in segments[-2:])
+            if older > newer * MERGE_RATIO:
+                break
+            sources = [Segment(self._path(name)) for name in segments[-2:]]
+            try:
+                name = self._write_segment(manifest, heapq.merge(*sources), sleep)
+            finally:
+                for source in sources:
+                    source.close()
+            merged += segments[-2:]
+            segments[-2:] = [name]
+        return merged
+
+    def _new_games(self, watermark, cutoff, limit):
+        Game = self.game_model
+        query = (
+            self.db.select(Game.id, Game.updated_at, Game.white_player_id, Game.winner_id, Game.pgn)
+            .where(Game.status == 'finished', Game.pgn.isnot(None), Game.updated_at < cutoff)
+            .order_by(Game.updated_at, Game.id)
+            .limit(limit)
+        )
+        if watermark is not None:
+            query = query.where(tuple_(Game.updated_at, Game.id) > watermark)
+        rows = self.db.session.execute(query).all()
+        self.db.session.remove()
+        return rows
+
+    def update(self, sleep=None):
+        """Indexe les parties archivées depuis la dernière mise à jour ; renvoie leur nombre.
+
+        `sleep` est appelé entre deux parties : dans le serveur, l'analyse des PGN
+        (quelques ms par partie) laisse ainsi passer les événements des joueurs.
+
+        Les parties sont parcourues par (updated_at, id) : l'archivage est la
+        dernière écriture d'une partie terminée, et le curseur est enregistré
+        dans le manifeste avec le segment qui les contient.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        with open(self._path('lock'), 'w') as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return 0
+            try:
+                with open(self._path('manifest.json'), encoding='utf-8') as f:
+                    manifest = json.load(f)
+            except FileNotFoundError:
+                manifest = {'segments': [], 'watermark': None, 'next': 0}
+            self._discard_orphans(manifest)
+            for name in manifest['segments']:
+                # Segments d'une version précédente, sans agrégats
+                if not os.path.exists(self._path(aggregates_name(name))):
+                    self._write_aggregates(name, sleep)
+
+            indexed = 0
+            cutoff = datetime.now(UTC) - timedelta(seconds=INDEX_LAG)
+            while True:
+                watermark = manifest['watermark']
+                if watermark is not None:
+                    watermark = (datetime.fromisoformat(watermark[0]), watermark[1])
+                records = []
+                games = 0
+                with self.app.app_context():
+                    while games < SEGMENT_GAMES:
+                        rows = self._new_games(watermark, cutoff, INDEX_BATCH)
+                        for row in rows:
+                            if row.winner_id is None:
+                                result = 'draw'
+                            else:
+                                result = 'white' if row.winner_id == row.white_player_id else 'black'
+                            records += game_records(row.id, row.pgn, result)
+                            if sleep is not None:
+                                sleep(0)
+                        games += len(rows)
+                        if rows:
+                            watermark = (rows[-1].updated_at, rows[-1].id)
+                        if len(rows) < INDEX_BATCH:
+                            break
+                if games == 0:
+                    break
+
+                records.sort()
+                if records:
+                    manifest['segments'].append(self._write_segment(manifest, records))
+                merged = self._merge_tail(manifest, sleep)
+                manifest['watermark'] = [watermark[0].isoformat(), watermark[1]]
+                self._write_manifest(manifest)
+                for name in merged:
+                    os.remove(self._path(name))
+                    os.remove(self._path(aggregates_name(name)))
+                indexed += games
+                log.info('Index des positions', games=games, records=len(records),
+                         segments=len(manifest['segments']))
+                if games < SEGMENT_GAMES:
+                    break
+            return indexed
+
+    def _discard_orphans(self, manifest):
+        # Segments écrits par une mise à jour interrompue avant son manifeste
+        names = set(manifest['segments'])
+        names |= {aggregates_name(name) for name in names}
+        for name in os.listdir(self.directory):
+            if name.startswith('seg-') and name not in names:
+                os.remove(self._path(name))
+
+    def _run(self, sleep):
+        while True:
+            sleep(POSITION_INDEX_INTERVAL)
+            try:
+                self.update(sleep=sleep)
+            except Exception:
+                log.exception('Index des positions')
+
+    def start(self, socketio=None):
+        if self.app is None or self._started:
+            return
+        self._started = True
+        if socketio is not None:
+            socketio.start_background_task(self._run, socketio.sleep)
+        else:
+            threading.Thread(target=self._run, args=(time.sleep,), daemon=True).start()
+
+
+position_index = PositionIndex()
+
+registry.gauge('chess_position_index_records', 'Positions dans l\'index des parties archivées',
+               callback=position_index.stats)
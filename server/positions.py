@@ -0,0 +1,119 @@
+import os
+import sys
+import threading
+from collections import OrderedDict, namedtuple
+
+import chess
+import chess.polyglot
+
+from metrics import registry
+
+# Positions gardées en cache (environ 300 octets chacune)
+POSITION_CACHE_SIZE = int(os.environ.get('POSITION_CACHE_SIZE', 50000))
+
+ZOBRIST = chess.polyglot.POLYGLOT_RANDOM_ARRAY
+hasher = chess.polyglot.ZobristHasher(ZOBRIST)
+
+# legal : coups légaux en UCI (tuple trié, envoyé tel quel aux clients)
+# outcome : 'white', 'black' ou 'draw' si la position seule termine la partie
+# (mat, pat, matériel insuffisant), sinon None
+PositionInfo = namedtuple('PositionInfo', ['legal', 'outcome'])
+
+
+def zobrist_key(board):
+    """Clé Zobrist (Polyglot) complète de la position, pour initialiser une partie."""
+    return chess.polyglot.zobrist_hash(board)
+
+
+def _piece_masks(board):
+    return (board.pawns, board.knights, board.bishops, board.rooks, board.queens, board.kings,
+            board.occupied_co[chess.BLACK], board.occupied_co[chess.WHITE])
+
+
+def _state_key(board):
+    return hasher.hash_castling(board) ^ hasher.hash_ep_square(board) ^ hasher.hash_turn(board)
+
+
+def push_move(board, move, key):
+    """Joue `move` et renvoie la clé Zobrist de la nouvelle position.
+
+    La clé est mise à jour de façon incrémentale : seules les cases dont le
+    contenu change (départ, arrivée, prise en passant, tour du roque) sont
+    recalculées, au lieu de hacher les 64 cases après chaque coup.
+    """
+    before = _piece_masks(board)
+    key ^= _state_key(board)
+    board.push(move)
+    after = _piece_masks(board)
+    for piece_type in range(6):
+        # Pas de raccourci sur before == after : une promotion qui prend une pièce
+        # du même type laisse le masque du type inchangé mais change sa couleur
+        for pivot in (0, 1):
+            changed = (before[piece_type] & before[6 + pivot]) ^ (after[piece_type] & after[6 + pivot])
+            for square in chess.scan_reversed(changed):
+                key ^= ZOBRIST[64 * (piece_type * 2 + pivot) + square]
+    return key ^ _state_key(board)
+
+
+def encode_move(move):
+    """Coup sur 16 bits : case de départ, case d'arrivée, pièce de promotion."""
+    return move.from_square | move.to_square << 6 | (move.promotion or 0) << 12
+
+
+def decode_move(code):
+    return chess.Move(code & 63, code >> 6 & 63, code >> 12 or None)
+
+
+def analyse(board):
+    legal = tuple(sorted(sys.intern(move.uci()) for move in board.legal_moves))
+    if not legal:
+        outcome = ('black' if board.turn == chess.WHITE else 'white') if board.is_check() else 'draw'
+    elif board.is_insufficient_material():
+        outcome = 'draw'
+    else:
+        outcome = None
+    return PositionInfo(legal, outcome)
+
+
+class PositionCache:
+    """Cache LRU borné des positions, partagé par toutes les parties du worker.
+
+    Les ouvertures reviennent sans cesse d'une partie à l'autre : leurs coups
+    légaux ne sont générés qu'une fois. La répétition et la règle des 75 coups
+    dépendent de l'historique et restent vérifiées par la partie.
+    """
+
+    def __init__(self, maxsize=POSITION_CACHE_SIZE):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def lookup(self, key, board):
+        with self.lock:
+            info = self.entries.get(key)
+            if info is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return info
+            self.misses += 1
+        info = analyse(board)
+        with self.lock:
+            self.entries[key] = info
+            if len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+        return info
+
+    def stats(self):
+        return {'hit': self.hits, 'miss': self.misses}
+
+
+position_cache = PositionCache()
+
+registry.gauge('chess_position_cache_entries', 'Positions en cache', callback=lambda: len(position_cache))
+registry.counter('chess_position_cache_lookups', 'Consultations du cache de positions depuis le démarrage',
+                 labels=('result',), callback=position_cache.stats)
@@ -0,0 +1,90 @@
+import numpy as np
+from sqlalchemy import bindparam, select, update
+
+K_FACTOR = 32
+DEFAULT_RATING = 1000
+PERIOD_SECONDS = 24 * 3600  # une période de classement par jour pour le recalcul
+
+
+def expected_score(rating, opponent_rating):
+    return 1 / (1 + 10 ** ((opponent_rating - rating) / 400))
+
+
+def elo_update(white_rating, black_rating, white_score, k=K_FACTOR):
+    """Nouveaux classements (blancs, noirs) après une partie ; white_score vaut 1, 0.5 ou 0."""
+    delta = k * (white_score - expected_score(white_rating, black_rating))
+    return round(white_rating + delta), round(black_rating - delta)
+
+
+def recompute(white, black, white_score, periods, n_players, k=K_FACTOR, initial=DEFAULT_RATING):
+    """Recalcule tous les classements depuis l'historique complet.
+
+    `white`, `black` : indices des joueurs (0..n_players-1), `white_score` : 1, 0.5
+    ou 0, `periods` : numéro de période croissant. Dans une période, toutes les
+    parties sont évaluées avec les classements du début de période, ce qui
+    permet de traiter chaque période en une seule opération vectorisée.
+    """
+    white = np.asarray(white, dtype=np.int64)
+    black = np.asarray(black, dtype=np.int64)
+    white_score = np.asarray(white_score, dtype=np.float64)
+    periods = np.asarray(periods)
+
+    ratings = np.full(n_players, initial, dtype=np.float64)
+    if len(white) == 0:
+        return ratings
+
+    # Bornes de chaque période dans l'historique trié
+    boundaries = np.flatnonzero(np.diff(periods)) + 1
+    starts = np.concatenate(([0], boundaries))
+    ends = np.concatenate((boundaries, [len(periods)]))
+
+    for start, end in zip(starts, ends):
+        w, b = white[start:end], black[start:end]
+        expected = 1 / (1 + 10 ** ((ratings[b] - ratings[w]) / 400))
+        delta = k * (white_score[start:end] - expected)
+        ratings += np.bincount(w, weights=delta, minlength=n_players)
+        ratings -= np.bincount(b, weights=delta, minlength=n_players)
+    return ratings
+
+
+def rebuild(session, user_model, game_model, period_seconds=PERIOD_SECONDS):
+    """Recalcule et enregistre le classement de tous les joueurs à partir des
+    parties classées terminées ; renvoie le nombre de parties prises en compte."""
+    rows = session.execute(
+        select(game_model.white_player_id, game_model.black_player_id,
+               game_model.winner_id, game_model.created_at)
+        .where(game_model.game_type == 'ranked',
+               game_model.status == 'finished',
+               game_model.black_player_id.isnot(None))
+        .order_by(game_model.created_at, game_model.id)
+    ).all()
+    user_ids = np.array(session.execute(select(user_model.id).order_by(user_model.id)).scalars().all(),
+                        dtype=np.int64)
+
+    white_ids = np.fromiter((row[0] for row in rows), dtype=np.int64, count=len(rows))
+    black_ids = np.fromiter((row[1] for row in rows), dtype=np.int64, count=len(rows))
+    winner_ids = np.fromiter((row[2] or 0 for row in rows), dtype=np.int64, count=len(rows))
+    periods = np.fromiter((int(row[3].timestamp()) // period_seconds for row in rows),
+                          dtype=np.int64, count=len(rows))
+
+    # Indices des joueurs ; les parties d'un joueur supprimé sont écartées (searchsorted
+    # renverrait l'indice d'un voisin)
+    white = np.searchsorted(user_ids, white_ids).clip(max=max(len(user_ids) - 1, 0))
+    black = np.searchsorted(user_ids, black_ids).clip(max=max(len(user_ids) - 1, 0))
+    known = ((user_ids[white] == white_ids) & (user_ids[black] == black_ids) if len(user_ids)
+             else np.zeros(len(rows), dtype=bool))
+    white, black, winner_ids, periods = white[known], black[known], winner_ids[known], periods[known]
+    white_ids, black_ids = white_ids[known], black_ids[known]
+
+    # Partie terminée sans vainqueur : nulle
+    white_score = np.where(winner_ids == white_ids, 1.0, np.where(winner_ids == black_ids, 0.0, 0.5))
+    ratings = recompute(white, black, white_score, periods, len(user_ids))
+
+    table = user_model.__table__
+    if len(user_ids):
+        session.execute(
+            update(table).where(table.c.id == bindparam('user_id')).values(elo_rating=bindparam('rating')),
+            [{'user_id': int(user_id), 'rating': int(round(rating))} for user_id, rating in zip(user_ids, ratings)]
+        )
+        session.commit()
+    return int(known.sum())
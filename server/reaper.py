@@ -0,0 +1,60 @@
+import os
+import threading
+import time
+from logs import get_logger
+
+log = get_logger('reaper')
+
+# Délais du cycle de vie des parties, en secondes
+FINISHED_GRACE = int(os.environ.get('FINISHED_GRACE', 120))  # partie terminée gardée pour les retardataires
+WAITING_TIMEOUT = int(os.environ.get('WAITING_TIMEOUT', 1800))  # partie du lobby sans adversaire
+QUEUE_TIMEOUT = int(os.environ.get('QUEUE_TIMEOUT', 900))  # joueur en file de matchmaking
+ABANDONED_TIMEOUT = int(os.environ.get('ABANDONED_TIMEOUT', 3600))  # partie commencée sans partie vivante
+REAPER_INTERVAL = 30
+
+
+class Reaper:
+    """Nettoyage périodique de ce qui ne se termine pas tout seul.
+
+    Chaque tâche enregistrée avec `register` est appelée à chaque passage et
+    renvoie le nombre d'éléments retirés ; une tâche en échec n'empêche pas
+    les suivantes de s'exécuter.
+    """
+
+    def __init__(self, interval=REAPER_INTERVAL):
+        self.interval = interval
+        self.tasks = []
+        self.reaped = {}
+        self._started = False
+
+    def register(self, task):
+        self.tasks.append(task)
+        return task
+
+    def sweep(self):
+        for task in self.tasks:
+            try:
+                count = task() or 0
+            except Exception:
+                log.exception('Nettoyage', task=task.__name__)
+                continue
+            if count:
+                self.reaped[task.__name__] = self.reaped.get(task.__name__, 0) + count
+                log.info('Nettoyage', task=task.__name__, count=count)
+
+    def _run(self, sleep):
+        while True:
+            sleep(self.interval)
+            self.sweep()
+
+    def start(self, socketio=None):
+        if self._started:
+            return
+        self._started = True
+        if socketio is not None:
+            socketio.start_background_task(self._run, socketio.sleep)
+        else:
+            threading.Thread(target=self._run, args=(time.sleep,), daemon=True).start()
+
+
+reaper = Reaper()
@@ -3,16 +3,14 @@ from flask_login import login_required, current_user
 from models.game import Game
 from models.user import User
 from database import db
+from matchmaking import Matchmaker
 import uuid
 from datetime import datetime
 from collections import defaultdict
-import threading
 
 game_bp = Blueprint('game', __name__)
 
-# File d'attente pour le matchmaking
-matchmaking_queue = defaultdict(list)
-queue_lock = threading.Lock()
+_app = None
 
 # Dictionnaire pour stocker les notifications de match
 match_notifications = defaultdict(dict)
@@ -75,108 +73,54 @@ def join_game(game_id):
         'game_uuid': game.game_uuid
     }), 200
 
+def create_match_game(game_type, player1, player2):
+    with _app.app_context():
+        game = Game(
+            game_uuid=str(uuid.uuid4()),
+            white_player_id=player1['id'],
+            black_player_id=player2['id'],
+            game_type=game_type,
+            status='in_progress'
+        )
+        db.session.add(game)
+        db.session.commit()
+
+        match_notifications[player1['id']] = {
+            'game_id': game.id,
+            'game_uuid': game.game_uuid,
+            'opponent': player2['username'],
+            'color': 'white',
+            'match_found': True
+        }
+        match_notifications[player2['id']] = {
+            'game_id': game.id,
+            'game_uuid': game.game_uuid,
+            'opponent': player1['username'],
+            'color': 'black',
+            'match_found': True
+        }
+
+matchmaker = Matchmaker(on_match=create_match_game)
+
+@game_bp.record_once
+def start_matchmaking(state):
+    global _app
+    _app = state.app
+    matchmaker.start()
+
 @game_bp.route('/api/games/matchmaking', methods=['POST'])
 @login_required
 def matchmaking():
     data = request.get_json()
     game_type = data.get('game_type', 'casual')
-    
-    with queue_lock:
-        if current_user.id in [user['id'] for user in matchmaking_queue[game_type]]:
-            return jsonify({'error': 'Vous êtes déjà dans la file d\'attente'}), 400
-        
-        matchmaking_queue[game_type].append({
-            'id': current_user.id,
-            'username': current_user.username,
-            'elo': current_user.elo_rating,
-            'timestamp': datetime.utcnow()
-        })
-        
-        if len(matchmaking_queue[game_type]) >= 2:
-            if game_type == 'ranked':
-                matchmaking_queue[game_type].sort(key=lambda x: x['elo'])
-                player1 = matchmaking_queue[game_type][0]
-                player2 = matchmaking_queue[game_type][1]
-                if abs(player1['elo'] - player2['elo']) <= 200:
-                    matchmaking_queue[game_type].remove(player1)
-                    matchmaking_queue[game_type].remove(player2)
-                    
-                    game = Game(
-                        game_uuid=str(uuid.uuid4()),
-                        white_player_id=player1['id'],
-                        black_player_id=player2['id'],
-                        game_type=game_type,
-                        status='in_progress'
-                    )
-                    db.session.add(game)
-                    db.session.commit()
-                    
-                    match_notifications[player1['id']] = {
-                        'game_id': game.id,
-                        'game_uuid': game.game_uuid,
-                        'opponent': player2['username'],
-                        'color': 'white',
-                        'match_found': True
-                    }
-                    match_notifications[player2['id']] = {
-                        'game_id': game.id,
-                        'game_uuid': game.game_uuid,
-                        'opponent': player1['username'],
-                        'color': 'black',
-                        'match_found': True
-                    }
-                    
-                    return jsonify({
-                        'message': 'Match trouvé !',
-                        'game_id': game.id,
-                        'game_uuid': game.game_uuid,
-                        'opponent': player2['username'] if current_user.id == player1['id'] else player1['username'],
-                        'color': 'white' if current_user.id == player1['id'] else 'black',
-                        'match_found': True
-                    }), 200
-            else:
-                player1 = matchmaking_queue[game_type][0]
-                player2 = matchmaking_queue[game_type][1]
-                matchmaking_queue[game_type].remove(player1)
-                matchmaking_queue[game_type].remove(player2)
-                
-                game = Game(
-                    game_uuid=str(uuid.uuid4()),
-                    white_player_id=player1['id'],
-                    black_player_id=player2['id'],
-                    game_type=game_type,
-                    status='in_progress'
-                )
-                db.session.add(game)
-                db.session.commit()
-                
-                match_notifications[player1['id']] = {
-                    'game_id': game.id,
-                    'game_uuid': game.game_uuid,
-                    'opponent': player2['username'],
-                    'color': 'white',
-                    'match_found': True
-                }
-                match_notifications[player2['id']] = {
-                    'game_id': game.id,
-                    'game_uuid': game.game_uuid,
-                    'opponent': player1['username'],
-                    'color': 'black',
-                    'match_found': True
-                }
-                
-                return jsonify({
-                    'message': 'Match trouvé !',
-                    'game_id': game.id,
-                    'game_uuid': game.game_uuid,
-                    'opponent': player2['username'] if current_user.id == player1['id'] else player1['username'],
-                    'color': 'white' if current_user.id == player1['id'] else 'black',
-                    'match_found': True
-                }), 200
-    
+
+    queue_position = matchmaker.enqueue(game_type, current_user.id, current_user.username, current_user.elo_rating)
+    if queue_position is None:
+        return jsonify({'error': 'Vous êtes déjà dans la file d\'attente'}), 400
+
     return jsonify({
         'message': 'Recherche d\'adversaire en cours...',
-        'queue_position': len(matchmaking_queue[game_type]),
+        'queue_position': queue_position,
         'match_found': False
     }), 200
 
@@ -184,42 +128,24 @@ def matchmaking():
 @login_required
 def matchmaking_status():
     game_type = request.args.get('game_type', 'casual')
-    
-    with queue_lock:
-        queue_position = next((i for i, user in enumerate(matchmaking_queue[game_type]) if user['id'] == current_user.id), None)
-        
-        if queue_position is not None:
-            return jsonify({
-                'in_queue': True,
-                'queue_position': queue_position + 1,
-                'total_players': len(matchmaking_queue[game_type])
-            })
-        
-        return jsonify({'in_queue': False})
+    queue_position, total_players = matchmaker.status(game_type, current_user.id)
+
+    if queue_position is not None:
+        return jsonify({
+            'in_queue': True,
+            'queue_position': queue_position,
+            'total_players': total_players
+        })
+
+    return jsonify({'in_queue': False})
 
 @game_bp.route('/api/games/matchmaking/cancel', methods=['POST'])
 @login_required
 def cancel_matchmaking():
     game_type = request.args.get('game_type', 'casual')
-    
-    with queue_lock:
-        matchmaking_queue[game_type] = [user for user in matchmaking_queue[game_type] if user['id'] != current_user.id]
-    
-    return jsonify({'message': 'Recherche d\'adversaire annulée'}), 200
+    matchmaker.cancel(game_type, current_user.id)
 
-@game_bp.route('/api/games/matchmaking/check')
-@login_required
-def check_matchmaking():
-    if current_user.id in match_notifications:
-        notification = match_notifications.pop(current_user.id)
-        return jsonify({
-            'match_found': True,
-            'game_id': notification['game_id'],
-            'game_uuid': notification['game_uuid'],
-            'opponent': notification['opponent'],
-            'color': notification['color']
-        })
-    return jsonify({'match_found': False})
+    return jsonify({'message': 'Recherche d\'adversaire annulée'}), 200
 
 @game_bp.route('/chessgame/<string:game_uuid>')
 @login_required
@@ -0,0 +1,202 @@
+import atexit
+import bisect
+import hashlib
+import os
+import threading
+import time
+import uuid
+from contextlib import nullcontext
+
+from logs import get_logger
+from state import POLL_INTERVAL
+
+log = get_logger('sharding')
+
+HEARTBEAT_INTERVAL = 1.0  # secondes entre deux signes de vie d'un worker
+WORKER_TTL = 5.0  # un worker silencieux depuis plus longtemps a quitté l'anneau
+FORWARD_TIMEOUT = 5.0  # secondes d'attente de la réponse du worker propriétaire
+RING_REPLICAS = 64  # points par worker sur l'anneau
+MAX_HOPS = 3
+
+WORKERS = 'shard:workers'
+HANDOFF = 'shard:handoff'
+
+GAME_NOT_FOUND = {'status': 'error', 'message': 'Partie non trouvée'}
+GAME_UNAVAILABLE = {'status': 'error', 'message': 'Partie momentanément indisponible'}
+
+
+def ring_hash(key):
+    return int.from_bytes(hashlib.sha1(key.encode()).digest()[:8], 'big')
+
+
+class HashRing:
+    """Hachage cohérent : le départ ou l'arrivée d'un worker ne déplace que ses parties."""
+
+    def __init__(self, members=(), replicas=RING_REPLICAS):
+        self.members = frozenset(members)
+        points = sorted((ring_hash(f'{member}#{i}'), member)
+                        for member in self.members for i in range(replicas))
+        self.keys = [point for point, _ in points]
+        self.owners = [member for _, member in points]
+
+    def owner(self, key):
+        if not self.keys:
+            return None
+        index = bisect.bisect(self.keys, ring_hash(key)) % len(self.keys)
+        return self.owners[index]
+
+
+class GameRouter:
+    """Chaque partie appartient à un seul worker, choisi sur l'anneau par son game_uuid.
+
+    Le propriétaire garde l'échiquier et la pendule en mémoire ; les événements
+    reçus par un autre worker lui sont relayés par le backend d'état et sa
+    réponse (l'ack Socket.IO) est renvoyée à l'émetteur. Quand l'anneau change,
+    chaque worker cède au nouveau propriétaire les parties qu'il ne possède plus.
+
+    `get_game(uuid)` lit une partie de ce worker, `adopt(state)` reprend une
+    partie cédée, `release(uuid)` en retire une et renvoie son état, et
+    `on_members_lost()` est appelé quand un worker disparaît sans céder ses
+    parties (elles sont alors rechargées depuis le journal des coups).
+    """
+
+    def __init__(self, backend, get_game, adopt, release, owned_games, on_members_lost=None, lock=None):
+        self.backend = backend
+        self.shared = backend.shared
+        self.worker_id = os.environ.get('WORKER_ID') or uuid.uuid4().hex[:12]
+        self.get_game = get_game
+        self.adopt = adopt
+        self.release = release
+        self.owned_games = owned_games
+        self.on_members_lost = on_members_lost
+        self.lock = lock or (lambda game_uuid: nullcontext())
+        self.handlers = {}
+        self.ring = HashRing([self.worker_id])
+        self.inbox = f'shard:{self.worker_id}:inbox'
+        self._started = False
+
+    def handler(self, event):
+        """Enregistre l'action exécutée chez le propriétaire : fn(game, user_id, data)."""
+        def decorator(fn):
+            self.handlers[event] = fn
+            return fn
+        return decorator
+
+    def owner(self, game_uuid):
+        return self.ring.owner(game_uuid) or self.worker_id
+
+    def owns(self, game_uuid):
+        return not self.shared or self.owner(game_uuid) == self.worker_id
+
+    def call(self, event, game_uuid, user_id, data, hops=0):
+        """Exécute l'événement chez le propriétaire de la partie et renvoie sa réponse."""
+        if self.owns(game_uuid):
+            return self._execute(event, game_uuid, user_id, data)
+        if hops >= MAX_HOPS:
+            # Anneaux des workers en désaccord : relu une fois ; jamais exécuté hors du propriétaire
+            self._heartbeat()
+            if self.owns(game_uuid):
+                return self._execute(event, game_uuid, user_id, data)
+            log.warning('Événement relayé sans propriétaire', event=event, game_uuid=game_uuid, hops=hops)
+            return GAME_UNAVAILABLE
+        return self._forward(self.owner(game_uuid), event, game_uuid, user_id, data, hops)
+
+    def _execute(self, event, game_uuid, user_id, data):
+        with self.lock(game_uuid):
+            game = self.get_game(game_uuid)
+            if game is None and self.shared:
+                game = self._take_handoff(game_uuid)
+            return self.handlers[event](game, user_id, data)
+
+    def _take_handoff(self, game_uuid):
+        state = self.backend.hdel(HANDOFF, game_uuid)
+        return self.adopt(state) if state else None
+
+    def _forward(self, owner, event, game_uuid, user_id, data, hops):
+        request_id = uuid.uuid4().hex
+        reply = f'shard:reply:{request_id}'
+        self.backend.rpush(f'shard:{owner}:inbox', {
+            'event': event, 'game_uuid': game_uuid, 'user_id': user_id,
+            'data': data, 'hops': hops + 1, 'reply': reply
+        })
+        deadline = time.time() + FORWARD_TIMEOUT
+        while time.time() < deadline:
+            replies = self.backend.drain(reply)
+            if replies:
+                return replies[0]
+            time.sleep(POLL_INTERVAL)
+        log.error('Pas de réponse du worker propriétaire', owner=owner, event=event, game_uuid=game_uuid)
+        return GAME_UNAVAILABLE
+
+    def _serve_inbox(self):
+        for message in self.backend.drain(self.inbox):
+            try:
+                response = self.call(message['event'], message['game_uuid'], message['user_id'],
+                                     message['data'], message['hops'])
+            except Exception:
+                log.exception('Événement relayé', event=message['event'], game_uuid=message['game_uuid'])
+                response = GAME_UNAVAILABLE
+            self.backend.rpush(message['reply'], response)
+
+    def _heartbeat(self):
+        now = time.time()
+        self.backend.hset(WORKERS, self.worker_id, now)
+        alive = {worker for worker, seen in self.backend.hgetall(WORKERS).items() if seen > now - WORKER_TTL}
+        alive.add(self.worker_id)
+        if alive == self.ring.members:
+            return
+        lost = self.ring.members - alive
+        self.ring = HashRing(alive)
+        log.info('Anneau des parties modifié', workers=len(alive))
+        self._rebalance()
+        if lost and self.on_members_lost:
+            self.on_members_lost()
+
+    def _rebalance(self):
+        """Cède les parties qui ont changé de propriétaire et reprend celles qu'on nous a cédées."""
+        for game_uuid in list(self.owned_games()):
+            if not self.owns(game_uuid):
+                with self.lock(game_uuid):
+                    state = self.release(game_uuid)
+                if state:
+                    self.backend.hset(HANDOFF, game_uuid, state)
+        for game_uuid in self.backend.hgetall(HANDOFF):
+            if self.owns(game_uuid) and self.get_game(game_uuid) is None:
+                with self.lock(game_uuid):
+                    self._take_handoff(game_uuid)
+
+    def leave(self):
+        """Quitte l'anneau en cédant toutes ses parties aux workers restants."""
+        self.backend.hdel(WORKERS, self.worker_id)
+        others = self.ring.members - {self.worker_id}
+        if not others:
+            return
+        self.ring = HashRing(others)
+        self._rebalance()
+
+    def _run(self, sleep):
+        last_heartbeat = 0
+        while True:
+            try:
+                if time.time() - last_heartbeat >= HEARTBEAT_INTERVAL:
+                    last_heartbeat = time.time()
+                    self._heartbeat()
+                self._serve_inbox()
+            except Exception:
+                log.exception('Routage des parties')
+            sleep(POLL_INTERVAL)
+
+    def join(self):
+        """Inscrit le worker sur l'anneau ; à appeler avant de recharger ses parties."""
+        if self.shared:
+            self._heartbeat()
+
+    def start(self, socketio=None):
+        if self._started or not self.shared:
+            return
+        self._started = True
+        atexit.register(self.leave)
+        if socketio is not None:
+            socketio.start_background_task(self._run, socketio.sleep)
+        else:
+            threading.Thread(target=self._run, args=(time.sleep,), daemon=True).start()
@@ -0,0 +1,79 @@
+import os
+import threading
+import time
+import zlib
+from logs import get_logger
+from metrics import emit_seconds, registry
+
+log = get_logger('spectators')
+
+# Images par seconde envoyées aux spectateurs d'une partie, et nombre de
+# sous-rooms entre lesquelles ses spectateurs sont répartis
+SPECTATOR_FPS = float(os.environ.get('SPECTATOR_FPS', 2))
+SPECTATOR_SHARDS = int(os.environ.get('SPECTATOR_SHARDS', 8))
+
+
+def shard_of(sid, shards=SPECTATOR_SHARDS):
+    return zlib.crc32(sid.encode()) % shards
+
+
+def spectator_room(game_uuid, shard):
+    """Les spectateurs n'entrent jamais dans la room des joueurs (game_uuid)."""
+    return f'{game_uuid}:spectators:{shard}'
+
+
+class SpectatorFanout:
+    """Diffusion aux spectateurs, découplée des coups des joueurs.
+
+    Un coup ne fait que remplacer la dernière image en attente de sa partie ;
+    le thread de diffusion envoie au plus SPECTATOR_FPS images par seconde et
+    par partie, toujours la plus récente. Les spectateurs sont répartis en
+    sous-rooms, avec une pause entre deux sous-rooms pour que les événements
+    des joueurs passent entre deux envois, même avec des milliers de spectateurs.
+    """
+
+    def __init__(self, fps=SPECTATOR_FPS, shards=SPECTATOR_SHARDS):
+        self.interval = 1 / fps
+        self.shards = shards
+        self.pending = {}
+        self.lock = threading.Lock()
+        self.frames = 0
+        self.socketio = None
+        self._started = False
+
+    def publish(self, game_uuid, frame):
+        with self.lock:
+            self.pending[game_uuid] = frame
+
+    def flush(self, sleep):
+        with self.lock:
+            pending, self.pending = self.pending, {}
+        for game_uuid, frame in pending.items():
+            with emit_seconds.time('spectator_state'):
+                for shard in range(self.shards):
+                    self.socketio.emit('spectator_state', frame, to=spectator_room(game_uuid, shard))
+                    sleep(0)
+        self.frames += len(pending)
+        return len(pending)
+
+    def _run(self, sleep):
+        while True:
+            started = time.monotonic()
+            try:
+                self.flush(sleep)
+            except Exception:
+                log.exception('Diffusion aux spectateurs')
+            sleep(max(self.interval - (time.monotonic() - started), 0))
+
+    def start(self, socketio):
+        if self._started:
+            return
+        self._started = True
+        self.socketio = socketio
+        socketio.start_background_task(self._run, socketio.sleep)
+
+
+spectator_fanout = SpectatorFanout()
+
+registry.counter('chess_spectator_frames', 'Images envoyées aux spectateurs depuis le démarrage',
+                 callback=lambda: spectator_fanout.frames)
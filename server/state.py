@@ -0,0 +1,345 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+import socketio
+
+# État partagé entre workers : 'memory' (un seul processus, par défaut),
+# 'sqlite:///chemin/etat.db' ou 'redis://localhost:6379/0'
+STATE_BACKEND = os.environ.get('STATE_BACKEND', 'memory')
+LOCK_TIMEOUT = 5  # secondes avant qu'un verrou abandonné puisse être repris
+POLL_INTERVAL = 0.01  # secondes entre deux lectures de la file de messages SQLite
+
+
+class MemoryBackend:
+    """État dans le processus courant : dictionnaires, listes et verrous locaux."""
+
+    shared = False
+
+    def __init__(self):
+        self.hashes = {}
+        self.lists = {}
+        self.locks = {}
+        self.leases = {}
+        self._lock = threading.Lock()
+
+    def hget(self, name, key):
+        return self.hashes.get(name, {}).get(key)
+
+    def hset(self, name, key, value):
+        self.hashes.setdefault(name, {})[key] = value
+
+    def hdel(self, name, key):
+        return self.hashes.get(name, {}).pop(key, None)
+
+    def hgetall(self, name):
+        return dict(self.hashes.get(name, {}))
+
+    def hlen(self, name):
+        return len(self.hashes.get(name, {}))
+
+    def hincr(self, name, key):
+        with self._lock:
+            value = self.hashes.setdefault(name, {}).get(key, 0) + 1
+            self.hashes[name][key] = value
+            return value
+
+    def rpush(self, name, value):
+        with self._lock:
+            self.lists.setdefault(name, []).append(value)
+
+    def drain(self, name):
+        with self._lock:
+            return self.lists.pop(name, [])
+
+    def lock(self, name):
+        with self._lock:
+            return self.locks.setdefault(name, threading.Lock())
+
+    def lease(self, name, owner, ttl):
+        with self._lock:
+            holder, expires = self.leases.get(name, (None, 0))
+            if holder in (None, owner) or expires < time.time():
+                self.leases[name] = (owner, time.time() + ttl)
+                return True
+            return False
+
+
+class SqliteBackend:
+    """État partagé par les workers d'une même machine, dans un fichier SQLite.
+
+    Sert aussi de remplaçant local à Redis pour les tests multi-processus.
+    """
+
+    shared = True
+
+    def __init__(self, path):
+        self.path = path
+        self.local = threading.local()
+        with self._connect() as connection:
+            connection.executescript('''
+                CREATE TABLE IF NOT EXISTS state_hash (
+                    name TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL,
+                    PRIMARY KEY (name, key));
+                CREATE TABLE IF NOT EXISTS state_list (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT NOT NULL, value TEXT NOT NULL);
+                CREATE INDEX IF NOT EXISTS ix_state_list_name ON state_list (name, id);
+                CREATE TABLE IF NOT EXISTS state_lock (
+                    name TEXT PRIMARY KEY, owner TEXT NOT NULL, expires REAL NOT NULL);
+                CREATE TABLE IF NOT EXISTS state_message (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT, channel TEXT NOT NULL,
+                    value TEXT NOT NULL, created REAL NOT NULL);
+            ''')
+
+    def _connect(self):
+        connection = getattr(self.local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=LOCK_TIMEOUT, isolation_level=None,
+                                         check_same_thread=False)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            self.local.connection = connection
+        return connection
+
+    @contextmanager
+    def _transaction(self):
+        connection = self._connect()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            yield connection
+            connection.execute('COMMIT')
+        except Exception:
+            connection.execute('ROLLBACK')
+            raise
+
+    def hget(self, name, key):
+        row = self._connect().execute('SELECT value FROM state_hash WHERE name = ? AND key = ?',
+                                      (name, str(key))).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def hset(self, name, key, value):
+        self._connect().execute('INSERT OR REPLACE INTO state_hash (name, key, value) VALUES (?, ?, ?)',
+                                (name, str(key), json.dumps(value)))
+
+    def hdel(self, name, key):
+        with self._transaction() as connection:
+            row = connection.execute('SELECT value FROM state_hash WHERE name = ? AND key = ?',
+                                     (name, str(key))).fetchone()
+            connection.execute('DELETE FROM state_hash WHERE name = ? AND key = ?', (name, str(key)))
+        return json.loads(row[0]) if row else None
+
+    def hgetall(self, name):
+        rows = self._connect().execute('SELECT key, value FROM state_hash WHERE name = ?', (name,))
+        return {key: json.loads(value) for key, value in rows}
+
+    def hlen(self, name):
+        return self._connect().execute('SELECT COUNT(*) FROM state_hash WHERE name = ?', (name,)).fetchone()[0]
+
+    def hincr(self, name, key):
+        with self._transaction() as connection:
+            connection.execute('INSERT INTO state_hash (name, key, value) VALUES (?, ?, 1) '
+                               'ON CONFLICT (name, key) DO UPDATE SET value = value + 1', (name, str(key)))
+            return int(connection.execute('SELECT value FROM state_hash WHERE name = ? AND key = ?',
+                                          (name, str(key))).fetchone()[0])
+
+    def rpush(self, name, value):
+        self._connect().execute('INSERT INTO state_list (name, value) VALUES (?, ?)', (name, json.dumps(value)))
+
+    def drain(self, name):
+        with self._transaction() as connection:
+            rows = connection.execute('SELECT id, value FROM state_list WHERE name = ? ORDER BY id',
+                                      (name,)).fetchall()
+            if rows:
+                connection.execute('DELETE FROM state_list WHERE name = ? AND id <= ?', (name, rows[-1][0]))
+        return [json.loads(value) for _, value in rows]
+
+    def lease(self, name, owner, ttl):
+        now = time.time()
+        with self._transaction() as connection:
+            row = connection.execute('SELECT owner, expires FROM state_lock WHERE name = ?', (name,)).fetchone()
+            if row and row[0] != owner and row[1] > now:
+                return False
+            connection.execute('INSERT OR REPLACE INTO state_lock (name, owner, expires) VALUES (?, ?, ?)',
+                               (name, owner, now + ttl))
+            return True
+
+    def release(self, name, owner):
+        self._connect().execute('DELETE FROM state_lock WHERE name = ? AND owner = ?', (name, owner))
+
+    def lock(self, name):
+        return SharedLock(self, name)
+
+    def publish(self, channel, value):
+        self._connect().execute('INSERT INTO state_message (channel, value, created) VALUES (?, ?, ?)',
+                                (channel, value, time.time()))
+
+    def listen(self, channel):
+        connection = self._connect()
+        last_id = connection.execute('SELECT COALESCE(MAX(id), 0) FROM state_message').fetchone()[0]
+        cleaned = time.time()
+        while True:
+            rows = connection.execute('SELECT id, value FROM state_message WHERE channel = ? AND id > ? ORDER BY id',
+                                      (channel, last_id)).fetchall()
+            for message_id, value in rows:
+                last_id = message_id
+                yield value
+            if time.time() - cleaned > 60:
+                cleaned = time.time()
+                connection.execute('DELETE FROM state_message WHERE created < ?', (cleaned - 60,))
+            if not rows:
+                time.sleep(POLL_INTERVAL)
+
+
+class RedisBackend:
+    """État partagé dans Redis (dépendance optionnelle : paquet `redis`)."""
+
+    shared = True
+
+    def __init__(self, url):
+        import redis
+        self.redis = redis.Redis.from_url(url)
+
+    def hget(self, name, key):
+        value = self.redis.hget(name, str(key))
+        return json.loads(value) if value is not None else None
+
+    def hset(self, name, key, value):
+        self.redis.hset(name, str(key), json.dumps(value))
+
+    def hdel(self, name, key):
+        pipeline = self.redis.pipeline()
+        pipeline.hget(name, str(key))
+        pipeline.hdel(name, str(key))
+        value, _ = pipeline.execute()
+        return json.loads(value) if value is not None else None
+
+    def hgetall(self, name):
+        return {key.decode(): json.loads(value) for key, value in self.redis.hgetall(name).items()}
+
+    def hlen(self, name):
+        return self.redis.hlen(name)
+
+    def hincr(self, name, key):
+        return self.redis.hincrby(name, str(key), 1)
+
+    def rpush(self, name, value):
+        self.redis.rpush(name, json.dumps(value))
+
+    def drain(self, name):
+        pipeline = self.redis.pipeline()
+        pipeline.lrange(name, 0, -1)
+        pipeline.delete(name)
+        values, _ = pipeline.execute()
+        return [json.loads(value) for value in values]
+
+    def lease(self, name, owner, ttl):
+        if self.redis.set(name, owner, nx=True, px=int(ttl * 1000)):
+            return True
+        if self.redis.get(name) == owner.encode():
+            self.redis.pexpire(name, int(ttl * 1000))
+            return True
+        return False
+
+    def release(self, name, owner):
+        if self.redis.get(name) == owner.encode():
+            self.redis.delete(name)
+
+    def lock(self, name):
+        return self.redis.lock(f'lock:{name}', timeout=LOCK_TIMEOUT)
+
+
+class SharedLock:
+    """Verrou inter-processus posé comme un bail court dans le backend."""
+
+    def __init__(self, backend, name):
+        self.backend = backend
+        self.name = f'lock:{name}'
+        self.owner = uuid.uuid4().hex
+
+    def __enter__(self):
+        while not self.backend.lease(self.name, self.owner, LOCK_TIMEOUT):
+            time.sleep(POLL_INTERVAL)
+        return self
+
+    def __exit__(self, *exc):
+        self.backend.release(self.name, self.owner)
+
+
+class SharedDict:
+    """Vue de type dict sur un hash du backend ; les clés sont converties par `key_type`."""
+
+    def __init__(self, backend, name, key_type=str):
+        self.backend = backend
+        self.name = name
+        self.key_type = key_type
+
+    def __getitem__(self, key):
+        value = self.backend.hget(self.name, key)
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, value):
+        self.backend.hset(self.name, key, value)
+
+    def __delitem__(self, key):
+        self.backend.hdel(self.name, key)
+
+    def __contains__(self, key):
+        return self.backend.hget(self.name, key) is not None
+
+    def __len__(self):
+        return self.backend.hlen(self.name)
+
+    def get(self, key, default=None):
+        value = self.backend.hget(self.name, key)
+        return default if value is None else value
+
+    def pop(self, key, default=None):
+        value = self.backend.hdel(self.name, key)
+        return default if value is None else value
+
+    def items(self):
+        return [(self.key_type(key), value) for key, value in self.backend.hgetall(self.name).items()]
+
+
+class SqliteManager(socketio.PubSubManager):
+    """Diffusion Socket.IO entre workers via la table de messages SQLite."""
+
+    name = 'sqlite'
+
+    def __init__(self, backend, channel='socketio', write_only=False, logger=None):
+        super().__init__(channel=channel, write_only=write_only, logger=logger)
+        self.backend = backend
+
+    def _publish(self, data):
+        self.backend.publish(self.channel, self.json.dumps(data))
+
+    def _listen(self):
+        yield from self.backend.listen(self.channel)
+
+
+def create_backend(url=STATE_BACKEND):
+    if url == 'memory':
+        return MemoryBackend()
+    if url.startswith('sqlite:///'):
+        return SqliteBackend(url[len('sqlite:///'):])
+    if url.startswith('redis://'):
+        return RedisBackend(url)
+    raise ValueError(f'Backend d\'état inconnu : {url}')
+
+
+def socketio_options(url=STATE_BACKEND, backend=None):
+    """Options de SocketIO pour que les emits atteignent les clients de tous les workers."""
+    if url.startswith('redis://'):
+        return {'message_queue': url}
+    if url.startswith('sqlite:///'):
+        return {'client_manager': SqliteManager(backend)}
+    return {}
+
+
+state = create_backend()
@@ -0,0 +1,95 @@
+import atexit
+import threading
+import time
+from sqlalchemy import bindparam, update
+from logs import get_logger
+from usercache import user_cache
+
+log = get_logger('stats')
+
+FLUSH_INTERVAL = 0.2  # secondes de regroupement avant écriture
+
+COUNTERS = ('games_played', 'wins', 'losses', 'draws')
+
+
+class StatsWriter:
+    """Écriture différée des statistiques des joueurs.
+
+    Les résultats sont cumulés en mémoire par joueur, puis appliqués
+    périodiquement en une transaction d'incréments SQL
+    (`wins = wins + :wins`), sans lecture préalable des lignes.
+    """
+
+    def __init__(self, interval=FLUSH_INTERVAL):
+        self.interval = interval
+        self.pending = {}
+        self.lock = threading.Lock()
+        self.app = None
+        self._started = False
+
+    def init_app(self, app, db, user_model):
+        self.app = app
+        self.db = db
+        table = user_model.__table__
+        self.statement = (
+            update(table)
+            .where(table.c.id == bindparam('user_id'))
+            .values({name: table.c[name] + bindparam('n_' + name) for name in COUNTERS})
+        )
+        atexit.register(self.flush)
+
+    def add(self, user_id, result):
+        """Compte une partie pour un joueur ; `result` vaut 'win', 'loss' ou 'draw'."""
+        with self.lock:
+            counters = self.pending.setdefault(user_id, dict.fromkeys(COUNTERS, 0))
+            counters['games_played'] += 1
+            counters[{'win': 'wins', 'loss': 'losses', 'draw': 'draws'}[result]] += 1
+
+    def _merge(self, batch):
+        # Remet un lot non écrit dans les compteurs en attente
+        with self.lock:
+            for user_id, counters in batch.items():
+                pending = self.pending.setdefault(user_id, dict.fromkeys(COUNTERS, 0))
+                for name in COUNTERS:
+                    pending[name] += counters[name]
+
+    def flush(self):
+        if self.app is None:
+            return 0
+        with self.lock:
+            batch, self.pending = self.pending, {}
+        if not batch:
+            return 0
+
+        params = [dict({'n_' + name: value for name, value in counters.items()}, user_id=user_id)
+                  for user_id, counters in batch.items()]
+        with self.app.app_context():
+            try:
+                self.db.session.execute(self.statement, params)
+                self.db.session.commit()
+            except Exception:
+                self.db.session.rollback()
+                self._merge(batch)
+                raise
+        user_cache.invalidate(*batch)
+        return len(batch)
+
+    def _run(self, sleep):
+        while True:
+            sleep(self.interval)
+            try:
+                self.flush()
+            except Exception:
+                log.exception('Écriture des statistiques')
+
+    def start(self, socketio=None):
+        if self._started:
+            return
+        self._started = True
+        if socketio is not None:
+            socketio.start_background_task(self._run, socketio.sleep)
+        else:
+            threading.Thread(target=self._run, args=(time.sleep,), daemon=True).start()
+
+
+stats_writer = StatsWriter()
@@ -0,0 +1,124 @@
+import os
+import sys
+import tempfile
+import uuid
+from datetime import datetime, timedelta
+
+# Base, journaux et index dans un répertoire jetable, avant d'importer l'application
+_tmp = tempfile.mkdtemp(prefix='chess-test-')
+os.environ.setdefault('DATABASE_URL', 'sqlite:///' + os.path.join(_tmp, 'chess.db'))
+for _name, _sub in (('CHESS_MOVELOG_DIR', 'movelogs'), ('CHESS_IDLE_DIR', 'idle_games'),
+                    ('CHESS_POSITION_INDEX_DIR', 'position_index')):
+    os.environ.setdefault(_name, os.path.join(_tmp, _sub))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as server  # noqa: E402
+
+server.start_workers()
+
+
+def _login(username):
+    client = server.app.test_client()
+    client.post('/register', json={'username': username, 'email': f'{username}@test', 'password': 'secret'})
+    client.post('/login', json={'username': username, 'password': 'secret'})
+    return client
+
+
+def _game(white, black):
+    game_uuid = str(uuid.uuid4())
+    with server.app.app_context():
+        ids = {user.username: user.id for user in server.User.query.filter(
+            server.User.username.in_([white, black]))}
+        server.db.session.add(server.Game(game_uuid=game_uuid, white_player_id=ids[white],
+                                          black_player_id=ids[black], status='in_progress',
+                                          game_type='casual'))
+        server.db.session.commit()
+    return game_uuid
+
+
+def test_spectator_cannot_play_or_answer_draw():
+    suffix = uuid.uuid4().hex[:8]
+    white, black, spectator = (f'{name}-{suffix}' for name in ('white', 'black', 'spectator'))
+    clients = {name: _login(name) for name in (white, black, spectator)}
+    game_uuid = _game(white, black)
+    sockets = {name: server.socketio.test_client(server.app, flask_test_client=client)
+               for name, client in clients.items()}
+
+    assert sockets[white].emit('join_game', {'game_uuid': game_uuid}, callback=True)['status'] == 'success'
+    assert sockets[spectator].emit('watch_game', {'game_uuid': game_uuid}, callback=True)['status'] == 'success'
+
+    # Trait aux Blancs : ni le spectateur, ni les Noirs ne peuvent jouer
+    response = sockets[spectator].emit('make_move', {'game_uuid': game_uuid, 'move': 'e2e4'}, callback=True)
+    assert response['status'] == 'error'
+    response = sockets[black].emit('make_move', {'game_uuid': game_uuid, 'move': 'e2e4'}, callback=True)
+    assert response['status'] == 'error'
+    response = sockets[white].emit('make_move', {'game_uuid': game_uuid, 'move': 'e2e4'}, callback=True)
+    assert response['status'] == 'success'
+
+    # Offre de nulle : seul l'adversaire de celui qui l'a faite peut y répondre
+    response = sockets[spectator].emit('offer_draw', {'game_uuid': game_uuid}, callback=True)
+    assert response['status'] == 'error'
+    assert sockets[white].emit('offer_draw', {'game_uuid': game_uuid}, callback=True)['status'] == 'success'
+    for name in (spectator, white):
+        response = sockets[name].emit('accept_draw', {'game_uuid': game_uuid}, callback=True)
+        assert response['status'] == 'error'
+    assert not server.get_game(game_uuid).game_over
+    assert sockets[black].emit('accept_draw', {'game_uuid': game_uuid}, callback=True)['status'] == 'success'
+    assert server.get_game(game_uuid).winner == 'draw'
+
+
+def test_history_pages_with_cursor():
+    suffix = uuid.uuid4().hex[:8]
+    player, opponent = f'history-{suffix}', f'opponent-{suffix}'
+    client = _login(player)
+    _login(opponent)
+    # Horodatages partagés deux à deux et couleurs alternées : le curseur départage par id
+    created = datetime(2026, 1, 1)
+    with server.app.app_context():
+        ids = {user.username: user.id for user in server.User.query.filter(
+            server.User.username.in_([player, opponent]))}
+        for i in range(7):
+            white, black = (player, opponent) if i % 2 == 0 else (opponent, player)
+            server.db.session.add(server.Game(game_uuid=str(uuid.uuid4()), white_player_id=ids[white],
+                                              black_player_id=ids[black], status='finished',
+                                              game_type='casual', created_at=created + timedelta(minutes=i // 2)))
+        server.db.session.commit()
+
+    seen, cursor = [], None
+    while True:
+        query = {'limit': 3, **({'cursor': cursor} if cursor else {})}
+        body = client.get(f'/api/user/{ids[player]}/games', query_string=query).get_json()
+        assert len(body['games']) <= 3
+        seen += body['games']
+        cursor = body['next_cursor']
+        if cursor is None:
+            break
+    keys = [(game['created_at'], game['id']) for game in seen]
+    assert len(seen) == 7 and keys == sorted(keys, reverse=True)
+    assert {game['color'] for game in seen} == {'white', 'black'}
+
+    response = client.get(f'/api/user/{ids[player]}/games', query_string={'cursor': 'invalide'})
+    assert response.status_code == 400
+
+
+def test_moves_are_sent_as_sequenced_deltas():
+    suffix = uuid.uuid4().hex[:8]
+    white, black = f'white-{suffix}', f'black-{suffix}'
+    clients = {name: _login(name) for name in (white, black)}
+    game_uuid = _game(white, black)
+    sockets = {name: server.socketio.test_client(server.app, flask_test_client=client)
+               for name, client in clients.items()}
+    for name in (white, black):
+        assert sockets[name].emit('join_game', {'game_uuid': game_uuid}, callback=True)['status'] == 'success'
+    states = [event['args'][0] for event in sockets[black].get_received() if event['name'] == 'game_state']
+    start = states[-1]['seq']
+
+    for name, move in ((white, 'e2e4'), (black, 'e7e5'), (white, 'g1f3')):
+        assert sockets[name].emit('make_move', {'game_uuid': game_uuid, 'move': move}, callback=True)['status'] == 'success'
+
+    # Un delta par coup, numéroté à la suite de l'état complet, sans renvoyer l'état
+    events = sockets[black].get_received()
+    deltas = [event['args'][0] for event in events if event['name'] == 'game_move']
+    assert [delta['seq'] for delta in deltas] == [start + 1, start + 2, start + 3]
+    assert [delta['move'] for delta in deltas] == ['e2e4', 'e7e5', 'g1f3']
+    assert not any(event['name'] == 'game_state' for event in events)
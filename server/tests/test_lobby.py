@@ -0,0 +1,56 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from lobby import LobbySnapshot, decode_cursor, encode_cursor  # noqa: E402
+
+
+def _games(count):
+    # Deux parties par horodatage : le curseur départage par id
+    return [{'id': i, 'game_type': 'ranked' if i % 3 == 0 else 'casual',
+             'created_at': f'2026-01-01T00:00:{i // 2:02d}'} for i in range(1, count + 1)]
+
+
+def _walk(lobby, **kwargs):
+    seen, cursor = [], None
+    while True:
+        games, cursor, _ = lobby.page(cursor=cursor, **kwargs)
+        seen += [game['id'] for game in games]
+        if cursor is None:
+            return seen
+
+
+def test_cursor_round_trip():
+    game = {'id': 42, 'created_at': '2026-01-01T10:00:00+00:00'}
+    assert decode_cursor(encode_cursor(game)) == ('2026-01-01T10:00:00+00:00', 42)
+    with pytest.raises(ValueError):
+        decode_cursor('sans-identifiant|x')
+
+
+def test_pages_cover_every_game_once():
+    games = _games(23)
+    lobby = LobbySnapshot(loader=lambda: games)
+    assert _walk(lobby, limit=5) == list(range(1, 24))
+    assert _walk(lobby, limit=5, game_type='ranked') == [game['id'] for game in games
+                                                           if game['game_type'] == 'ranked']
+
+
+def test_cursor_resumes_after_invalidation():
+    games = _games(10)
+    lobby = LobbySnapshot(loader=lambda: list(games))
+    first, cursor, version = lobby.page(limit=4)
+    # Une partie de la première page est rejointe : la suite reprend après le curseur
+    games.remove(first[1])
+    lobby.invalidate()
+    second, _, new_version = lobby.page(cursor=cursor, limit=4)
+    assert [game['id'] for game in second] == [5, 6, 7, 8]
+    assert new_version != version
+
+
+def test_versions_differ_between_restarts():
+    _, _, version = LobbySnapshot(loader=lambda: []).page()
+    _, _, other = LobbySnapshot(loader=lambda: []).page()
+    assert version != other
@@ -0,0 +1,66 @@
+import os
+import sys
+from datetime import datetime, timedelta, UTC
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from matchmaking import ELO_WINDOW_BASE, FifoQueue, RatingQueue  # noqa: E402
+
+NOW = datetime(2026, 1, 1, tzinfo=UTC)
+
+
+def _entry(user_id, elo, waited=0):
+    return {'id': user_id, 'elo': elo, 'timestamp': NOW - timedelta(seconds=waited)}
+
+
+def _ids(pairs):
+    return [(first['id'], second['id']) for first, second in pairs]
+
+
+def test_rating_queue_pairs_nearest_opponents():
+    queue = RatingQueue()
+    for user_id, elo in ((1, 1000), (2, 1500), (3, 1050), (4, 1480)):
+        queue.add(_entry(user_id, elo))
+    assert _ids(queue.pop_pairs(NOW)) == [(1, 3), (2, 4)]
+    assert len(queue) == 0
+
+
+def test_rating_queue_keeps_players_outside_the_window():
+    queue = RatingQueue()
+    queue.add(_entry(1, 1000))
+    queue.add(_entry(2, 1000 + ELO_WINDOW_BASE + 1))
+    assert queue.pop_pairs(NOW) == []
+    assert 1 in queue and 2 in queue
+
+    # La fenêtre s'élargit avec l'attente des deux joueurs
+    later = NOW + timedelta(seconds=30)
+    assert _ids(queue.pop_pairs(later)) == [(1, 2)]
+
+
+def test_rating_queue_serves_the_longest_waiting_player_first():
+    queue = RatingQueue()
+    queue.add(_entry(1, 1100, waited=60))
+    queue.add(_entry(2, 1000))
+    queue.add(_entry(3, 1200))
+    # 1 est à égale distance de 2 et 3 : il est servi avant que 2 et 3 ne se rencontrent
+    pairs = _ids(queue.pop_pairs(NOW))
+    assert len(pairs) == 1 and pairs[0][0] == 1
+    assert len(queue) == 1
+
+
+def test_rating_queue_remove_keeps_index_consistent():
+    queue = RatingQueue()
+    for user_id, elo in ((1, 1000), (2, 1000), (3, 1010)):
+        queue.add(_entry(user_id, elo))
+    assert queue.remove(2)['id'] == 2
+    assert queue.remove(2) is None
+    assert _ids(queue.pop_pairs(NOW)) == [(1, 3)]
+
+
+def test_fifo_queue_pairs_in_arrival_order():
+    queue = FifoQueue()
+    for user_id in (5, 3, 9):
+        queue.add(_entry(user_id, 1000))
+    assert queue.position(9) == 3
+    assert _ids(queue.pop_pairs(NOW)) == [(5, 3)]
+    assert queue.position(9) == 1
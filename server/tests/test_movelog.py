@@ -0,0 +1,52 @@
+import base64
+import os
+import sys
+from array import array
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from movelog import MoveLog  # noqa: E402
+
+FEN = 'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1'
+
+
+def _play(log, game_uuid, plies):
+    for ply in range(1, plies + 1):
+        moves = array('H', range(1, ply + 1))
+        log.append(game_uuid, ply, f'm{ply}', 300 - ply, 300 - ply / 2, 'white', FEN, moves)
+
+
+def test_load_replays_moves_after_the_last_snapshot(tmp_path):
+    log = MoveLog(str(tmp_path), snapshot_every=20)
+    _play(log, 'g', 45)
+    snapshot, moves = log.load('g')
+    assert snapshot['ply'] == 40
+    assert array('H', base64.b64decode(snapshot['moves'])).tolist() == list(range(1, 41))
+    assert [move['ply'] for move in moves] == [41, 42, 43, 44, 45]
+    assert moves[-1]['white'] == 255
+    assert log.history('g') == [f'm{ply}' for ply in range(1, 46)]
+
+
+def test_truncated_last_line_is_ignored(tmp_path):
+    log = MoveLog(str(tmp_path), snapshot_every=20)
+    _play(log, 'g', 3)
+    log.close('g')
+    with open(tmp_path / 'g.log', 'a', encoding='utf-8') as f:
+        f.write('{"ply": 4, "uci"')
+    snapshot, moves = log.load('g')
+    assert snapshot is None
+    assert [move['ply'] for move in moves] == [1, 2, 3]
+
+
+def test_open_files_are_bounded(tmp_path):
+    log = MoveLog(str(tmp_path), snapshot_every=20, open_files=2)
+    for ply in range(1, 4):
+        for game_uuid in 'abcd':
+            log.append(game_uuid, ply, f'{game_uuid}{ply}', 300, 300, 'white')
+    assert len(log._files) == 2
+    # Journal rouvert en ajout : aucun coup perdu
+    for game_uuid in 'abcd':
+        assert log.history(game_uuid) == [f'{game_uuid}{ply}' for ply in range(1, 4)]
+    log.discard('a')
+    assert not log.exists('a')
+    assert log.last_move_at('a') is None and log.last_move_at('b') is not None
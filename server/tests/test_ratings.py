@@ -0,0 +1,43 @@
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ratings import K_FACTOR, elo_update, recompute  # noqa: E402
+
+
+def test_elo_update_is_zero_sum_and_favours_the_underdog():
+    assert elo_update(1000, 1000, 1) == (1000 + K_FACTOR // 2, 1000 - K_FACTOR // 2)
+    assert elo_update(1000, 1000, 0.5) == (1000, 1000)
+    white, black = elo_update(1200, 1000, 0)
+    assert white + black == 2200
+    # Le favori battu perd plus qu'il n'aurait gagné
+    assert 1200 - white > elo_update(1200, 1000, 1)[0] - 1200
+
+
+def test_recompute_without_games_keeps_initial_ratings():
+    ratings = recompute([], [], [], [], 3)
+    assert ratings.tolist() == [1000, 1000, 1000]
+
+
+def test_recompute_matches_sequential_updates_across_periods():
+    # Une partie par période : même résultat que les mises à jour une à une
+    games = [(0, 1, 1.0), (1, 2, 0.5), (2, 0, 0.0), (0, 1, 0.0)]
+    white, black, scores = zip(*games)
+    ratings = recompute(white, black, scores, range(len(games)), 3)
+
+    expected = [1000.0, 1000.0, 1000.0]
+    for w, b, score in games:
+        delta = K_FACTOR * (score - 1 / (1 + 10 ** ((expected[b] - expected[w]) / 400)))
+        expected[w] += delta
+        expected[b] -= delta
+    assert np.allclose(ratings, expected)
+
+
+def test_recompute_uses_ratings_from_the_start_of_the_period():
+    # Deux victoires de 0 sur 1 dans la même période : même gain pour les deux parties
+    ratings = recompute([0, 0], [1, 1], [1.0, 1.0], [7, 7], 2)
+    assert np.allclose(ratings, [1000 + K_FACTOR, 1000 - K_FACTOR])
+    assert np.isclose(ratings.sum(), 2000)
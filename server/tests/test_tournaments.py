@@ -0,0 +1,58 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tournaments import Entrant, assign_colors, pair_players  # noqa: E402
+
+
+def _player(user_id, score=0, color_balance=0, last_color=None):
+    return Entrant(id=user_id, user_id=user_id, username=f'p{user_id}', elo=1000, score=score,
+                   color_balance=color_balance, last_color=last_color, byes=0)
+
+
+def _ids(pairs):
+    return [(first.user_id, second.user_id) for first, second in pairs]
+
+
+def test_pair_players_follows_standings():
+    players = [_player(user_id) for user_id in range(1, 5)]
+    assert _ids(pair_players(players, set())) == [(1, 2), (3, 4)]
+
+
+def test_pair_players_avoids_rematches():
+    players = [_player(user_id) for user_id in range(1, 5)]
+    assert _ids(pair_players(players, {frozenset((1, 2))})) == [(1, 3), (2, 4)]
+
+
+def test_pair_players_backtracks_when_the_bottom_cannot_pair():
+    # 1-2 laisserait 3-4, déjà joué : la paire du haut est revue
+    players = [_player(user_id) for user_id in range(1, 5)]
+    played = {frozenset((3, 4)), frozenset((1, 3))}
+    pairs = pair_players(players, played)
+    assert _ids(pairs) == [(1, 4), (2, 3)]
+    assert not any(frozenset(pair) in played for pair in _ids(pairs))
+
+
+def test_pair_players_prefers_opponent_due_the_other_color():
+    players = [_player(1, score=1, color_balance=1), _player(2, score=1, color_balance=1),
+               _player(3, score=1, color_balance=-1), _player(4, score=1, color_balance=-1)]
+    assert _ids(pair_players(players, set())) == [(1, 3), (2, 4)]
+
+
+def test_pair_players_falls_back_to_standings_order():
+    players = [_player(user_id) for user_id in range(1, 5)]
+    everyone = {frozenset((a, b)) for a in range(1, 5) for b in range(a + 1, 5)}
+    # Toutes les paires déjà jouées : revanches acceptées, dans l'ordre du classement
+    assert _ids(pair_players(players, everyone)) == [(1, 2), (3, 4)]
+    # Budget épuisé : même repli
+    assert _ids(pair_players(players, {frozenset((3, 4))}, budget=0)) == [(1, 2), (3, 4)]
+
+
+def test_assign_colors_balances_colors():
+    first, second = _player(1, color_balance=1), _player(2, color_balance=0)
+    assert assign_colors(first, second) == (second, first)
+    first, second = _player(1, last_color='white'), _player(2, last_color='black')
+    assert assign_colors(first, second) == (second, first)
+    first, second = _player(1), _player(2)
+    assert assign_colors(first, second) == (first, second)
@@ -0,0 +1,312 @@
+import os
+import threading
+import time
+import uuid
+from collections import namedtuple
+from datetime import datetime, timedelta, UTC
+
+from sqlalchemy import insert, update
+
+from database import db, Game, Tournament, TournamentPlayer, User
+from logs import get_logger
+
+log = get_logger('tournaments')
+
+# Rondes d'un tournoi suisse, durée d'une arène (minutes) et intervalle entre deux
+# passages du directeur (appariements de l'arène, rondes terminées, fins d'arène)
+SWISS_ROUNDS = 5
+ARENA_MINUTES = 60
+TOURNAMENT_INTERVAL = int(os.environ.get('TOURNAMENT_INTERVAL', 5))
+# Essais de la recherche d'appariement sans revanche avant d'accepter des revanches
+PAIRING_BUDGET = 200000
+
+POINTS = {
+    'swiss': {'win': 1, 'draw': 0.5, 'loss': 0},
+    'arena': {'win': 2, 'draw': 1, 'loss': 0},
+}
+BYE_POINTS = 1
+
+
+# Inscrit tel que lu en début de ronde (id : ligne TournamentPlayer)
+Entrant = namedtuple('Entrant', ['id', 'user_id', 'username', 'elo', 'score', 'color_balance', 'last_color', 'byes'])
+
+
+def standings_order(player):
+    return -player.score, -(player.elo or 0), player.user_id
+
+
+def pair_players(players, played, budget=PAIRING_BUDGET):
+    """Apparie des joueurs déjà classés (meilleur d'abord), chacun avec le suivant
+    disponible qu'il n'a pas encore rencontré ; à score égal, un adversaire qui
+    doit la couleur opposée passe en premier.
+
+    Recherche en profondeur avec retour arrière : si le bas du classement ne peut
+    plus être apparié sans revanche, les paires du dessus sont revues. Au-delà de
+    `budget` essais, les joueurs sont appariés dans l'ordre, revanches comprises.
+    `played` contient les paires déjà jouées (frozenset des deux user_id).
+    """
+    pairs = []
+    used = set()
+    steps = 0
+
+    def candidates(first, start):
+        # Parcours paresseux : le premier candidat convient presque toujours
+        deferred = []
+        for index in range(start + 1, len(players)):
+            second = players[index]
+            if second.user_id in used:
+                continue
+            if second.score == first.score and first.color_balance * second.color_balance > 0:
+                deferred.append(second)
+                continue
+            if deferred and second.score != first.score:
+                yield from deferred
+                deferred = []
+            yield second
+        yield from deferred
+
+    def search(start):
+        nonlocal steps
+        while start < len(players) and players[start].user_id in used:
+            start += 1
+        if start == len(players):
+            return True
+        first = players[start]
+        used.add(first.user_id)
+        for second in candidates(first, start):
+            if frozenset((first.user_id, second.user_id)) in played:
+                continue
+            steps += 1
+            if steps > budget:
+                break
+            used.add(second.user_id)
+            pairs.append((first, second))
+            if search(start + 1):
+                return True
+            pairs.pop()
+            used.discard(second.user_id)
+        used.discard(first.user_id)
+        return False
+
+    if len(players) % 2 == 0 and search(0):
+        return pairs
+    return list(zip(players[0::2], players[1::2]))
+
+
+def assign_colors(first, second):
+    """(blancs, noirs) : les Blancs à celui qui en a eu le moins, puis à celui qui avait
+    les Noirs à la partie précédente, sinon au mieux classé."""
+    if first.color_balance != second.color_balance:
+        return (first, second) if first.color_balance < second.color_balance else (second, first)
+    if (first.last_color == 'white' and second.last_color != 'white'
+            or first.last_color != 'black' and second.last_color == 'black'):
+        return second, first
+    return first, second
+
+
+class TournamentDirector:
+    """Déroulement des tournois suisses et arènes.
+
+    Une ronde est créée d'un bloc : appariement en mémoire, puis toutes ses
+    parties en un seul INSERT et une seule transaction, avant que `on_round`
+    crée les parties en mémoire et prévienne les joueurs. Le numéro de ronde
+    est réservé par un UPDATE conditionnel, si bien que deux workers qui
+    terminent la même ronde n'en lancent pas deux.
+    """
+
+    def __init__(self, on_round, interval=TOURNAMENT_INTERVAL):
+        self.on_round = on_round
+        self.interval = interval
+        self.app = None
+        self._started = False
+
+    def init_app(self, app):
+        self.app = app
+
+    def _claim_round(self, tournament):
+        round_number = tournament.current_round + 1
+        claimed = db.session.execute(
+            update(Tournament)
+            .where(Tournament.id == tournament.id, Tournament.current_round == round_number - 1)
+            .values(current_round=round_number)
+        ).rowcount
+        return round_number if claimed == 1 else None
+
+    def _players(self, tournament):
+        rows = db.session.execute(
+            db.select(TournamentPlayer.id, TournamentPlayer.user_id, User.username, User.elo_rating,
+                      TournamentPlayer.score, TournamentPlayer.color_balance, TournamentPlayer.last_color,
+                      TournamentPlayer.byes)
+            .join(User, TournamentPlayer.user_id == User.id)
+            .where(TournamentPlayer.tournament_id == tournament.id)
+        )
+        return sorted((Entrant(*row) for row in rows), key=standings_order)
+
+    def _history(self, tournament):
+        """Paires déjà jouées et parties en cours du tournoi."""
+        rows = db.session.execute(
+            db.select(Game.white_player_id, Game.black_player_id, Game.status)
+            .where(Game.tournament_id == tournament.id)
+            .order_by(Game.id)
+        ).all()
+        played = {frozenset((row.white_player_id, row.black_player_id)) for row in rows}
+        last = {}
+        busy = set()
+        for row in rows:
+            last[row.white_player_id] = frozenset((row.white_player_id, row.black_player_id))
+            last[row.black_player_id] = last[row.white_player_id]
+            if row.status in ('active', 'in_progress'):
+                busy.update((row.white_player_id, row.black_player_id))
+        return played, last, busy
+
+    def start_round(self, tournament):
+        """Apparie et crée une ronde ; renvoie le nombre de parties créées."""
+        players = self._players(tournament)
+        played, last, busy = self._history(tournament)
+        bye = None
+        if tournament.format == 'arena':
+            # Arène : les joueurs libres seulement, sans rejouer tout de suite le même adversaire
+            players = [player for player in players if player.user_id not in busy]
+            played = set(last.values())
+            if len(players) % 2:
+                players = players[:-1]
+        elif len(players) % 2:
+            # Suisse : exempt le moins bien classé parmi ceux qui l'ont été le moins souvent
+            bye = min(reversed(players), key=lambda player: player.byes)
+            players.remove(bye)
+        if len(players) < 2:
+            db.session.rollback()
+            return 0
+
+        round_number = self._claim_round(tournament)
+        if round_number is None:
+            db.session.rollback()
+            return 0
+
+        if bye is not None:
+            db.session.execute(
+                update(TournamentPlayer).where(TournamentPlayer.id == bye.id)
+                .values(score=TournamentPlayer.score + BYE_POINTS, byes=TournamentPlayer.byes + 1)
+            )
+        games = []
+        colors = []
+        for first, second in pair_players(players, played):
+            white, black = assign_colors(first, second)
+            colors.append({'id': white.id, 'color_balance': white.color_balance + 1, 'last_color': 'white'})
+            colors.append({'id': black.id, 'color_balance': black.color_balance - 1, 'last_color': 'black'})
+            games.append({
+                'game_uuid': str(uuid.uuid4()),
+                'white_player_id': white.user_id,
+                'black_player_id': black.user_id,
+                'game_type': tournament.game_type,
+                'status': 'in_progress',
+                'name': f'{tournament.name} - ronde {round_number}',
+                'description': None,
+                'tournament_id': tournament.id,
+                'tournament_round': round_number,
+                'white': white.username,
+                'black': black.username,
+            })
+        columns = ('game_uuid', 'white_player_id', 'black_player_id', 'game_type', 'status', 'name',
+                   'tournament_id', 'tournament_round')
+        ids = db.session.execute(
+            insert(Game).returning(Game.id, sort_by_parameter_order=True),
+            [{column: game[column] for column in columns} for game in games]
+        ).scalars().all()
+        for game, game_id in zip(games, ids):
+            game['game_id'] = game_id
+        db.session.execute(update(TournamentPlayer), colors)
+        db.session.commit()
+
+        self.on_round(tournament, games)
+        log.info('Ronde de tournoi', tournament_id=tournament.id, round=round_number, games=len(games))
+        return len(games)
+
+    def launch(self, tournament):
+        """Démarre un tournoi ouvert : première ronde, ou premiers appariements de l'arène."""
+        tournament.status = 'running'
+        if tournament.format == 'arena':
+            tournament.ends_at = datetime.now(UTC) + timedelta(minutes=tournament.rounds or ARENA_MINUTES)
+        return self.start_round(tournament)
+
+    def tournament_of(self, game_uuid):
+        return db.session.execute(
+            db.select(Tournament).join(Game, Game.tournament_id == Tournament.id)
+            .where(Game.game_uuid == game_uuid)
+        ).scalar()
+
+    def record_result(self, result):
+        """Points d'une partie de tournoi terminée, comptés une seule fois : la partie
+        est marquée dans la même transaction que les points."""
+        tournament = self.tournament_of(result['game_uuid'])
+        if tournament is None:
+            return
+        scored = db.session.execute(
+            update(Game)
+            .where(Game.game_uuid == result['game_uuid'], Game.tournament_scored.is_(False))
+            .values(tournament_scored=True, updated_at=Game.updated_at)
+        ).rowcount
+        if scored != 1:
+            db.session.rollback()
+            return
+        points = POINTS[tournament.format]
+        for color, user_id in (('white', result['white_player_id']), ('black', result['black_player_id'])):
+            outcome = 'draw' if result['winner'] == 'draw' else 'win' if result['winner'] == color else 'loss'
+            db.session.execute(
+                update(TournamentPlayer)
+                .where(TournamentPlayer.tournament_id == tournament.id, TournamentPlayer.user_id == user_id)
+                .values(score=TournamentPlayer.score + points[outcome])
+            )
+        db.session.commit()
+
+    def advance(self, tournament):
+        """Suisse : ronde suivante, ou fin du tournoi, quand la ronde en cours est finie."""
+        unfinished = db.session.execute(
+            db.select(db.func.count(Game.id))
+            .where(Game.tournament_id == tournament.id, Game.tournament_round == tournament.current_round,
+                   Game.status.in_(('active', 'in_progress')))
+        ).scalar()
+        if unfinished:
+            return 0
+        if tournament.current_round >= tournament.rounds:
+            tournament.status = 'finished'
+            db.session.commit()
+            return 0
+        return self.start_round(tournament)
+
+    def tick(self):
+        """Un passage : appariements de l'arène, rondes suisses terminées, arènes échues."""
+        now = datetime.now(UTC)
+        created = 0
+        with self.app.app_context():
+            try:
+                running = Tournament.query.filter_by(status='running').all()
+                for tournament in running:
+                    if tournament.format == 'swiss':
+                        created += self.advance(tournament)
+                    elif tournament.ends_at.replace(tzinfo=UTC) <= now:
+                        tournament.status = 'finished'
+                        db.session.commit()
+                    else:
+                        created += self.start_round(tournament)
+            except Exception:
+                db.session.rollback()
+                raise
+        return created
+
+    def _run(self, sleep):
+        while True:
+            sleep(self.interval)
+            try:
+                self.tick()
+            except Exception:
+                log.exception('Tournois')
+
+    def start(self, socketio=None):
+        if self._started:
+            return
+        self._started = True
+        if socketio is not None:
+            socketio.start_background_task(self._run, socketio.sleep)
+        else:
+            threading.Thread(target=self._run, args=(time.sleep,), daemon=True).start()
@@ -0,0 +1,66 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from sqlalchemy.orm import make_transient_to_detached
+from metrics import registry
+
+# Durée de vie (s) et taille du cache des utilisateurs connectés
+USER_CACHE_TTL = int(os.environ.get('USER_CACHE_TTL', 30))
+USER_CACHE_SIZE = int(os.environ.get('USER_CACHE_SIZE', 10000))
+
+
+class UserCache:
+    """Cache LRU à durée de vie des utilisateurs chargés par Flask-Login.
+
+    Les entrées sont des copies détachées des lignes ; `load` les rattache à la
+    session de la requête avec merge(load=False), sans requête SQL. Les écritures
+    des statistiques et du classement invalident l'entrée du joueur ; la durée de
+    vie borne le retard d'un autre worker, qui ne voit pas ces invalidations.
+    """
+
+    def __init__(self, ttl=USER_CACHE_TTL, maxsize=USER_CACHE_SIZE):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def load(self, session, model, user_id):
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(user_id)
+            if entry is not None and entry[0] > now:
+                self.entries.move_to_end(user_id)
+                self.hits += 1
+                return session.merge(entry[1], load=False)
+            self.misses += 1
+        user = session.get(model, user_id)
+        if user is None:
+            return None
+        copy = model(**{column.key: getattr(user, column.key) for column in model.__table__.columns})
+        make_transient_to_detached(copy)
+        with self.lock:
+            self.entries[user_id] = (now + self.ttl, copy)
+            self.entries.move_to_end(user_id)
+            if len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+        return user
+
+    def invalidate(self, *user_ids):
+        with self.lock:
+            for user_id in user_ids:
+                self.entries.pop(user_id, None)
+
+    def stats(self):
+        return {'hit': self.hits, 'miss': self.misses}
+
+
+user_cache = UserCache()
+
+registry.counter('chess_user_cache_lookups', 'Chargements d\'utilisateur par Flask-Login depuis le démarrage',
+                 labels=('result',), callback=user_cache.stats)